@@ -0,0 +1,308 @@
+"""
+ANN Vector Store - Índices Vetoriais Aproximados para o GPTCache
+Substitui a busca exaustiva do índice FAISS plano por HNSW (hnswlib ou FAISS),
+persistido em disco com carga via mmap e inserções incrementais.
+"""
+
+import os
+import abc
+import logging
+import threading
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+from gptcache.manager.vector_data.base import VectorBase, VectorData
+
+# Backends suportados em CacheConfig.vector_store
+VECTOR_STORES = ("faiss_flat", "hnswlib", "faiss")
+# Nome antigo do índice plano, aceito por compatibilidade
+_LEGACY_VECTOR_STORES = {"sqlite": "faiss_flat"}
+
+class _PersistentANNStore(VectorBase, abc.ABC):
+    """Base comum: ids removidos, persistência atômica e busca com sobre-amostragem"""
+
+    def __init__(self, index_file_path: str, dimension: int, top_k: int = 1,
+                 rebuild_ratio: float = 0.2):
+        self._index_file_path = index_file_path
+        self._dimension = dimension
+        self._top_k = top_k
+        # Índice é reconstruído quando removidos >= rebuild_ratio * armazenados
+        self._rebuild_ratio = rebuild_ratio
+        self._deleted: Set[int] = set()
+        self._dirty = False
+        self._lock = threading.RLock()
+        self.logger = logging.getLogger(__name__)
+
+    def _as_matrix(self, data) -> np.ndarray:
+        return np.asarray(data, dtype="float32").reshape(-1, self._dimension)
+
+    @abc.abstractmethod
+    def _add_raw(self, vectors: np.ndarray, ids: np.ndarray):
+        """Insere vetores no índice (chamar com o lock adquirido)"""
+
+    @abc.abstractmethod
+    def _search_raw(self, query: np.ndarray, k: int):
+        """(distâncias, ids) dos k vizinhos, incluindo ids removidos"""
+
+    @abc.abstractmethod
+    def _count_raw(self) -> int:
+        """Vetores armazenados, incluindo removidos"""
+
+    @abc.abstractmethod
+    def _stored_items(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, vetores) de tudo que está armazenado no índice"""
+
+    @abc.abstractmethod
+    def _reset_index(self, capacity: int):
+        """Substitui o índice por um vazio"""
+
+    @abc.abstractmethod
+    def _write(self, path: str):
+        """Grava o índice em path"""
+
+    def mul_add(self, datas: List[VectorData]):
+        if not datas:
+            return
+        vectors = self._as_matrix([data.data for data in datas])
+        ids = np.array([data.id for data in datas], dtype="int64")
+
+        with self._lock:
+            self._add_raw(vectors, ids)
+            self._deleted.difference_update(int(data_id) for data_id in ids)
+            self._dirty = True
+
+    def search(self, data: np.ndarray, top_k: int = -1):
+        if top_k == -1:
+            top_k = self._top_k
+
+        with self._lock:
+            available = self._count_raw() - len(self._deleted)
+            if available <= 0:
+                return None
+
+            # Busca alguns vizinhos extras para compensar ids removidos
+            k = min(top_k + len(self._deleted), self._count_raw())
+            distances, ids = self._search_raw(self._as_matrix(data), k)
+
+            # Filtra ainda com o lock: delete/rebuild concorrentes trocam _deleted
+            results = [
+                (float(distance), int(data_id))
+                for distance, data_id in zip(distances, ids)
+                if int(data_id) >= 0 and int(data_id) not in self._deleted
+            ]
+        return results[:top_k] or None
+
+    def delete(self, ids) -> bool:
+        with self._lock:
+            self._deleted.update(int(data_id) for data_id in ids)
+            self._dirty = True
+            if len(self._deleted) >= self._rebuild_ratio * max(self._count_raw(), 1):
+                self._rebuild()
+        return True
+
+    def rebuild(self, ids=None) -> bool:
+        """Reconstrói o índice só com ids vivos (ou só com ids, se informados)"""
+        with self._lock:
+            self._rebuild(None if ids is None else set(int(data_id) for data_id in ids))
+        return True
+
+    def _rebuild(self, keep: Optional[Set[int]] = None):
+        """Descarta ids removidos do índice (chamar com o lock adquirido)"""
+        ids, vectors = self._stored_items()
+        live = [
+            position for position, data_id in enumerate(ids)
+            if int(data_id) not in self._deleted and (keep is None or int(data_id) in keep)
+        ]
+
+        self._reset_index(len(live))
+        if live:
+            self._add_raw(vectors[live], np.asarray(ids, dtype="int64")[live])
+        self.logger.info(
+            f"Índice vetorial reconstruído: {len(live)} vivos, {len(ids) - len(live)} removidos"
+        )
+        self._deleted = set()
+        self._dirty = True
+
+    def count(self) -> int:
+        with self._lock:
+            return self._count_raw() - len(self._deleted)
+
+    def flush(self):
+        """Grava o índice em arquivo temporário e substitui o anterior"""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = f"{self._index_file_path}.tmp"
+            try:
+                self._write(tmp_path)
+                os.replace(tmp_path, self._index_file_path)
+                self._dirty = False
+            except Exception as e:
+                self.logger.error(f"Erro ao persistir índice vetorial: {e}")
+
+    def close(self):
+        self.flush()
+
+class HnswlibVectorStore(_PersistentANNStore):
+    """Índice HNSW do hnswlib com crescimento automático da capacidade"""
+
+    def __init__(self, index_file_path: str, dimension: int, top_k: int = 1,
+                 max_elements: int = 100000, ef_search: int = 64, m: int = 16,
+                 rebuild_ratio: float = 0.2):
+        super().__init__(index_file_path, dimension, top_k, rebuild_ratio)
+        import hnswlib
+
+        self._hnswlib = hnswlib
+        self._ef_search = ef_search
+        self._max_elements = max_elements
+        self._m = m
+
+        if os.path.isfile(index_file_path):
+            self._index = hnswlib.Index(space="l2", dim=dimension)
+            self._index.load_index(index_file_path, max_elements=max_elements)
+            self._index.set_ef(ef_search)
+            self._deleted = set(
+                label for label in self._index.get_ids_list()
+                if self._is_marked_deleted(label)
+            )
+        else:
+            self._reset_index(0)
+
+    def _is_marked_deleted(self, label: int) -> bool:
+        try:
+            self._index.get_items([label])
+            return False
+        except RuntimeError:
+            return True
+
+    def _add_raw(self, vectors: np.ndarray, ids: np.ndarray):
+        needed = self._index.get_current_count() + len(ids)
+        if needed > self._index.get_max_elements():
+            # Inserções incrementais sem reconstruir o grafo
+            self._index.resize_index(max(needed, self._index.get_max_elements() * 2))
+        self._index.add_items(vectors, ids)
+
+    def delete(self, ids) -> bool:
+        with self._lock:
+            for data_id in ids:
+                try:
+                    self._index.mark_deleted(int(data_id))
+                except RuntimeError:
+                    pass
+        return super().delete(ids)
+
+    def _search_raw(self, query: np.ndarray, k: int):
+        # hnswlib já ignora ids marcados como removidos
+        k = min(k, self._count_raw() - len(self._deleted))
+        self._index.set_ef(max(self._ef_search, k))
+        ids, distances = self._index.knn_query(query, k=k)
+        return distances[0], ids[0]
+
+    def _count_raw(self) -> int:
+        return self._index.get_current_count()
+
+    def _stored_items(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Removidos não são legíveis no hnswlib; ficam de fora já aqui
+        ids = [label for label in self._index.get_ids_list() if label not in self._deleted]
+        vectors = self._as_matrix(self._index.get_items(ids)) if ids else self._as_matrix([])
+        return np.array(ids, dtype="int64"), vectors
+
+    def _reset_index(self, capacity: int):
+        self._index = self._hnswlib.Index(space="l2", dim=self._dimension)
+        self._index.init_index(max_elements=max(self._max_elements, capacity),
+                               ef_construction=200, M=self._m)
+        self._index.set_ef(self._ef_search)
+
+    def _write(self, path: str):
+        self._index.save_index(path)
+
+class FaissVectorStore(_PersistentANNStore):
+    """Índice HNSW do FAISS; arquivo existente é mapeado em memória (mmap)"""
+
+    def __init__(self, index_file_path: str, dimension: int, top_k: int = 1,
+                 ef_search: int = 64, m: int = 32, mmap: bool = True,
+                 rebuild_ratio: float = 0.2):
+        super().__init__(index_file_path, dimension, top_k, rebuild_ratio)
+        import faiss
+
+        self._faiss = faiss
+        self._ef_search = ef_search
+        self._m = m
+        self._mmapped = False
+
+        if os.path.isfile(index_file_path):
+            flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+            self._index = faiss.read_index(index_file_path, flags)
+            self._mmapped = bool(mmap)
+            self._deleted = self._load_deleted()
+            self._set_ef(ef_search)
+        else:
+            self._reset_index(0)
+
+    def _deleted_path(self) -> str:
+        return f"{self._index_file_path}.deleted.npy"
+
+    def _load_deleted(self) -> Set[int]:
+        """HNSW do FAISS não remove ids; removidos ficam em arquivo ao lado"""
+        if os.path.isfile(self._deleted_path()):
+            return set(int(data_id) for data_id in np.load(self._deleted_path()))
+        return set()
+
+    def _set_ef(self, ef: int):
+        id_map = self._faiss.downcast_index(self._index)
+        hnsw_index = self._faiss.downcast_index(id_map.index)
+        hnsw_index.hnsw.efSearch = ef
+
+    def _ensure_writable(self):
+        """Índice mapeado é somente leitura: carrega em memória na primeira inserção"""
+        if self._mmapped:
+            self._index = self._faiss.read_index(self._index_file_path)
+            self._mmapped = False
+            self._set_ef(self._ef_search)
+
+    def _add_raw(self, vectors: np.ndarray, ids: np.ndarray):
+        self._ensure_writable()
+        self._index.add_with_ids(vectors, ids)
+
+    def _search_raw(self, query: np.ndarray, k: int):
+        self._set_ef(max(self._ef_search, k))
+        distances, ids = self._index.search(query, k)
+        return distances[0], ids[0]
+
+    def _count_raw(self) -> int:
+        return self._index.ntotal
+
+    def _stored_items(self) -> Tuple[np.ndarray, np.ndarray]:
+        id_map = self._faiss.downcast_index(self._index)
+        ids = self._faiss.vector_to_array(id_map.id_map)
+        vectors = id_map.index.reconstruct_n(0, id_map.ntotal) if len(ids) else self._as_matrix([])
+        return ids, vectors
+
+    def _reset_index(self, capacity: int):
+        self._index = self._faiss.IndexIDMap2(self._faiss.IndexHNSWFlat(self._dimension, self._m))
+        self._mmapped = False
+        self._set_ef(self._ef_search)
+
+    def _write(self, path: str):
+        self._faiss.write_index(self._index, path)
+        np.save(self._deleted_path(), np.array(sorted(self._deleted), dtype="int64"))
+
+def create_vector_store(store: str, index_file_path: str, dimension: int,
+                        max_elements: int = 100000, ef_search: int = 64,
+                        mmap: bool = True, rebuild_ratio: float = 0.2) -> Optional[VectorBase]:
+    """Cria o índice ANN configurado; None para o índice FAISS plano (busca exaustiva) do GPTCache"""
+    if store in _LEGACY_VECTOR_STORES:
+        logging.getLogger(__name__).warning(
+            f"vector_store '{store}' está obsoleto; use '{_LEGACY_VECTOR_STORES[store]}'"
+        )
+        store = _LEGACY_VECTOR_STORES[store]
+    if store not in VECTOR_STORES:
+        raise ValueError(f"Vector store desconhecido: {store} (opções: {', '.join(VECTOR_STORES)})")
+
+    if store == "hnswlib":
+        return HnswlibVectorStore(index_file_path, dimension, max_elements=max_elements,
+                                  ef_search=ef_search, rebuild_ratio=rebuild_ratio)
+    if store == "faiss":
+        return FaissVectorStore(index_file_path, dimension, ef_search=ef_search, mmap=mmap,
+                                rebuild_ratio=rebuild_ratio)
+    return None
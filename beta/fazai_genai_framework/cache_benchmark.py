@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+"""
+Cache Benchmark - Replay de Requisições para Calibrar o Cache Semântico
+Reexecuta um log de (prompt, resposta, resultado) contra o cache com vários
+thresholds e modelos de embedding, medindo taxa de acerto, acertos falsos,
+latência de consulta e uso de memória
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import logging
+import resource
+import tempfile
+from copy import deepcopy
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+from dataclasses import dataclass, asdict
+
+from framework_config import FrameworkConfig, EscalationLevel
+from cache_manager import CacheManager, chat_cache_keys
+
+DEFAULT_THRESHOLDS = [0.85, 0.90, 0.93, 0.95, 0.97, 0.98, 0.99]
+
+@dataclass
+class BenchmarkResult:
+    """Métricas do replay para um par (modelo de embedding, threshold)"""
+    embedding_model: str
+    threshold: float
+    requests: int = 0
+    hits: int = 0
+    false_hits: int = 0
+    mismatched_hits: int = 0
+    hit_rate: float = 0.0
+    false_hit_rate: float = 0.0
+    lookup_p50_ms: float = 0.0
+    lookup_p95_ms: float = 0.0
+    lookup_p99_ms: float = 0.0
+    store_bytes: int = 0
+    max_rss_mb: float = 0.0
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(percentile / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+def _directory_size(path: str, name_filter: str = "") -> int:
+    """Soma o tamanho dos arquivos cujo nome contém name_filter"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name_filter in name:
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def load_replay_log(path: str) -> List[Dict[str, Any]]:
+    """Lê o log JSONL: {"request"|"prompt", "response", "success"} por linha"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "request" not in record:
+                record["request"] = {"messages": [{"role": "user", "content": record.pop("prompt")}]}
+            records.append(record)
+    return records
+
+def replay_log_from_history(memory_manager, fallback_manager,
+                            max_tasks: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Reconstrói as requisições do gerente (N2) do histórico, com o resultado de cada passo"""
+    system_prompt = fallback_manager._get_personality_prompt()
+    known_failures = fallback_manager.known_failures()
+    level_2 = EscalationLevel.N2_LOCAL_MEMORIA.name
+
+    for history, outcome in memory_manager.iter_task_histories(max_tasks=max_tasks):
+        original_task = (outcome or {}).get("original_task") or history[0].get("original_task")
+        if not original_task:
+            continue
+
+        for index, entry in enumerate(history):
+            if entry.get("level") != level_2:
+                continue
+
+            yield {
+                "request": fallback_manager.build_level_2_request(
+                    original_task, history[:index], system_prompt,
+                    task_id=entry.get("task_id"), known_failures=known_failures
+                ),
+                "response": json.dumps(
+                    {"descricao": entry.get("step_desc"), "comando": entry.get("command")},
+                    ensure_ascii=False
+                ),
+                "success": bool(entry.get("success"))
+            }
+
+class CacheBenchmark:
+    """Replay do log contra caches isolados em diretórios temporários"""
+
+    def __init__(self, config: FrameworkConfig, records: List[Dict[str, Any]]):
+        self.config = config
+        self.records = records
+        self.logger = logging.getLogger(__name__)
+
+    def _make_config(self, embedding_model: str, data_dir: str) -> FrameworkConfig:
+        """Cópia da configuração apontando para um store descartável"""
+        config = deepcopy(self.config)
+        config.enable_cache = True
+        config.cache.embedding_model = embedding_model
+        config.cache.data_dir = data_dir
+        config.cache.shared_mode = False
+        config.cache.vacuum_interval_seconds = None
+        config.cache.maintenance_interval_seconds = None
+        return config
+
+    def run_model(self, embedding_model: str, thresholds: List[float]) -> List[BenchmarkResult]:
+        """Executa o replay para todos os thresholds com um modelo de embedding"""
+        data_dir = tempfile.mkdtemp(prefix="fazai_cache_bench_")
+        results = []
+
+        try:
+            config = self._make_config(embedding_model, data_dir)
+            cache_manager = CacheManager(config)
+            if not cache_manager.is_enabled():
+                raise RuntimeError(f"Não foi possível inicializar o cache com {embedding_model}")
+
+            for threshold in thresholds:
+                role = f"bench_{threshold:.3f}"
+                config.cache.role_thresholds[role] = threshold
+                namespace = cache_manager.get_namespace(role)
+
+                results.append(self._replay(namespace, embedding_model, threshold, data_dir))
+                self.logger.info(
+                    f"{embedding_model} @ {threshold}: "
+                    f"hit_rate={results[-1].hit_rate:.3f} false_hit_rate={results[-1].false_hit_rate:.3f}"
+                )
+
+            # Store temporário é removido ao final; nada a salvar na saída do processo
+            atexit.unregister(cache_manager.save_stats)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+        return results
+
+    def _replay(self, namespace, embedding_model: str, threshold: float,
+                data_dir: str) -> BenchmarkResult:
+        result = BenchmarkResult(embedding_model=embedding_model, threshold=threshold)
+        # Resposta armazenada e resultado observado, por requisição (chave exata)
+        stored_outcomes: Dict[str, Tuple[str, bool]] = {}
+        latencies_ms: List[float] = []
+
+        for record in self.records:
+            result.requests += 1
+            exact_key, prompt = chat_cache_keys(record["request"], namespace.canonicalize)
+
+            start = time.perf_counter()
+            answer = namespace.lookup(exact_key, prompt)
+            latencies_ms.append((time.perf_counter() - start) * 1000.0)
+
+            if answer is None:
+                namespace.store(exact_key, prompt, record["response"])
+                stored_outcomes[exact_key] = (record["response"], bool(record.get("success")))
+                continue
+
+            result.hits += 1
+            if answer != record["response"]:
+                result.mismatched_hits += 1
+            if not self._served_answer_is_valid(record, exact_key, answer, stored_outcomes):
+                result.false_hits += 1
+
+        result.hit_rate = result.hits / result.requests if result.requests else 0.0
+        result.false_hit_rate = result.false_hits / result.hits if result.hits else 0.0
+        result.lookup_p50_ms = _percentile(latencies_ms, 50)
+        result.lookup_p95_ms = _percentile(latencies_ms, 95)
+        result.lookup_p99_ms = _percentile(latencies_ms, 99)
+        result.store_bytes = _directory_size(data_dir, namespace.name)
+        # ru_maxrss em KB no Linux
+        result.max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        return result
+
+    @staticmethod
+    def _served_answer_is_valid(record: Dict[str, Any], exact_key: str, answer: str,
+                                stored_outcomes: Dict[str, Tuple[str, bool]]) -> bool:
+        """Acerto válido: a resposta servida funcionou para esta mesma requisição
+
+        Resposta de outra tarefa (mesmo que lá tenha funcionado) conta como acerto falso.
+        """
+        if answer == record["response"]:
+            return bool(record.get("success"))
+        return stored_outcomes.get(exact_key) == (answer, True)
+
+    def run(self, embedding_models: List[str], thresholds: List[float]) -> List[BenchmarkResult]:
+        results = []
+        for embedding_model in embedding_models:
+            results.extend(self.run_model(embedding_model, thresholds))
+        return results
+
+def recommend(results: List[BenchmarkResult], max_false_hit_rate: float) -> Optional[BenchmarkResult]:
+    """Maior taxa de acerto dentro do limite de acertos falsos"""
+    eligible = [r for r in results if r.hits and r.false_hit_rate <= max_false_hit_rate]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda r: (r.hit_rate, -r.lookup_p95_ms))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibra o threshold do cache semântico reexecutando requisições gravadas",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exemplos de uso:
+
+  # Exportar log de replay a partir do histórico no Qdrant
+  python cache_benchmark.py --export-history replay.jsonl
+
+  # Varredura padrão de thresholds
+  python cache_benchmark.py --log replay.jsonl
+
+  # Comparar modelos de embedding
+  python cache_benchmark.py --log replay.jsonl \\
+      --models sentence-transformers/all-MiniLM-L6-v2 sentence-transformers/all-mpnet-base-v2
+        """
+    )
+
+    parser.add_argument('--log', help='Log JSONL de replay')
+    parser.add_argument('--export-history', metavar='ARQUIVO',
+                        help='Gera o log de replay a partir do histórico de execuções')
+    parser.add_argument('--max-tasks', type=int, default=None,
+                        help='Máximo de tarefas exportadas do histórico')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=DEFAULT_THRESHOLDS,
+                        help='Thresholds de similaridade a testar')
+    parser.add_argument('--models', nargs='+', default=None,
+                        help='Modelos de embedding (padrão: config)')
+    parser.add_argument('--max-false-hit-rate', type=float, default=0.01,
+                        help='Taxa máxima de acertos falsos aceitável (padrão: 0.01)')
+    parser.add_argument('--json', action='store_true',
+                        help='Saída em JSON')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Logs detalhados')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    if not args.log and not args.export_history:
+        parser.error("informe --log ou --export-history")
+
+    try:
+        config = FrameworkConfig.from_env()
+
+        if args.export_history:
+            # Import tardio: genai_mini_framework inicializa clientes e memória
+            from genai_mini_framework import GenAIMiniFramework
+
+            config.cache.warmup_on_start = False
+            framework = GenAIMiniFramework(config)
+            count = 0
+            with open(args.export_history, 'w', encoding='utf-8') as f:
+                for record in replay_log_from_history(
+                    framework.memory_manager, framework.fallback_manager, args.max_tasks
+                ):
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    count += 1
+            print(f"✅ {count} requisições exportadas para {args.export_history}")
+            if not args.log:
+                return
+
+        records = load_replay_log(args.log)
+        models = args.models or [config.cache.embedding_model]
+        print(f"🔁 Replay de {len(records)} requisições "
+              f"({len(models)} modelo(s), {len(args.thresholds)} threshold(s))...")
+
+        results = CacheBenchmark(config, records).run(models, args.thresholds)
+        best = recommend(results, args.max_false_hit_rate)
+
+        if args.json:
+            print(json.dumps({
+                "results": [asdict(r) for r in results],
+                "recommended": asdict(best) if best else None
+            }, indent=2))
+            return
+
+        print(f"\n{'modelo':<45} {'thr':>5} {'hit%':>6} {'falso%':>7} "
+              f"{'p50ms':>7} {'p95ms':>7} {'p99ms':>7} {'store':>9} {'rss':>8}")
+        for r in results:
+            print(f"{r.embedding_model[-45:]:<45} {r.threshold:>5.2f} {r.hit_rate * 100:>6.1f} "
+                  f"{r.false_hit_rate * 100:>7.2f} {r.lookup_p50_ms:>7.2f} {r.lookup_p95_ms:>7.2f} "
+                  f"{r.lookup_p99_ms:>7.2f} {r.store_bytes / 1024:>7.0f}KB {r.max_rss_mb:>6.0f}MB")
+
+        if best:
+            print(f"\n🎯 Recomendado: {best.embedding_model} com threshold {best.threshold} "
+                  f"(acerto {best.hit_rate:.1%}, acertos falsos {best.false_hit_rate:.2%})")
+        else:
+            print(f"\n⚠️  Nenhuma combinação com acertos falsos <= {args.max_false_hit_rate:.1%}")
+
+    except KeyboardInterrupt:
+        print("\n⏹️  Operação cancelada pelo usuário")
+        sys.exit(1)
+
+    except Exception as e:
+        print(f"\n❌ Erro inesperado: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Cache Eviction - Limites, TTL e Políticas de Evicção do Cache Semântico
+Índice SQLite auxiliar que acompanha as entradas de cada namespace do GPTCache
+"""
+
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+
+from sqlite_utils import connect_sqlite
+
+class EvictionPolicy(Enum):
+    """Políticas de evicção disponíveis"""
+    LRU = "lru"
+    LFU = "lfu"
+    COST_AWARE = "cost_aware"
+
+@dataclass
+class CacheEntry:
+    """Entrada rastreada pelo índice de evicção"""
+    prompt_hash: str
+    exact_key: Optional[str]
+    prompt: str
+    answer: str
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class CacheEntryIndex:
+    """Índice das entradas de um namespace: tamanho, acessos, custo e expiração"""
+
+    def __init__(self, db_path: str, policy: EvictionPolicy = EvictionPolicy.LRU,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None, shared: bool = False,
+                 busy_timeout_ms: int = 5000, write_batch_size: int = 1):
+        self.db_path = db_path
+        self.policy = policy
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # Acessos (last_access, hits) acumulados antes de um commit
+        self.write_batch_size = max(write_batch_size, 1)
+        self.logger = logging.getLogger(__name__)
+
+        # Entradas removidas do índice mas ainda presentes no store do GPTCache
+        self.tombstones = 0
+        self._pending_touches: Dict[Tuple[str, str], Tuple[float, int]] = {}
+        self._touches_since_flush = 0
+        self._lock = threading.Lock()
+
+        self._db = connect_sqlite(db_path, shared, busy_timeout_ms)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "prompt_hash TEXT PRIMARY KEY, exact_key TEXT, answer_hash TEXT NOT NULL, "
+            "prompt TEXT NOT NULL, answer TEXT NOT NULL, size_bytes INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, "
+            "cost REAL NOT NULL DEFAULT 0, expires_at REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_entries_answer ON cache_entries (answer_hash)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_entries_exact ON cache_entries (exact_key)"
+        )
+        self._db.commit()
+
+    def add(self, prompt: str, answer: str, exact_key: Optional[str] = None,
+            cost: float = 0.0, ttl_seconds: Optional[float] = None):
+        """Registra (ou substitui) uma entrada"""
+        now = time.time()
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = now + ttl if ttl else None
+        size = len(prompt.encode("utf-8")) + len(answer.encode("utf-8"))
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache_entries (prompt_hash, exact_key, answer_hash, prompt, "
+                "answer, size_bytes, created_at, last_access, hits, cost, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                (_hash(prompt), exact_key, _hash(answer), prompt, answer, size,
+                 now, now, cost, expires_at)
+            )
+            self._db.commit()
+
+    def touch_answer(self, answer: str) -> bool:
+        """Registra acesso (acerto no L1 ou semântico); retorna False se não há entrada viva"""
+        return self._touch("answer_hash", _hash(answer))
+
+    def _touch(self, column: str, value: str) -> bool:
+        now = time.time()
+        with self._lock:
+            # Só leitura no caminho do acerto; a atualização vai para o próximo lote
+            row = self._db.execute(
+                f"SELECT 1 FROM cache_entries "
+                f"WHERE {column} = ? AND (expires_at IS NULL OR expires_at > ?) LIMIT 1",
+                (value, now)
+            ).fetchone()
+            if row is None:
+                return False
+
+            _, hits = self._pending_touches.get((column, value), (now, 0))
+            self._pending_touches[(column, value)] = (now, hits + 1)
+            self._touches_since_flush += 1
+            if self._touches_since_flush >= self.write_batch_size:
+                self._flush_touches()
+            return True
+
+    def _flush_touches(self):
+        """Grava os acessos pendentes em um único commit (chamar com o lock adquirido)"""
+        self._touches_since_flush = 0
+        if not self._pending_touches:
+            return
+
+        for column in {column for column, _ in self._pending_touches}:
+            updates = [
+                (last_access, hits, value)
+                for (touched_column, value), (last_access, hits) in self._pending_touches.items()
+                if touched_column == column
+            ]
+            if updates:
+                self._db.executemany(
+                    f"UPDATE cache_entries SET last_access = MAX(last_access, ?), hits = hits + ? "
+                    f"WHERE {column} = ?", updates
+                )
+        self._db.commit()
+        self._pending_touches.clear()
+
+    def flush(self):
+        """Persiste acessos pendentes"""
+        with self._lock:
+            self._flush_touches()
+
+    def remove_exact(self, exact_key: str) -> List[CacheEntry]:
+        """Remove a entrada armazenada sob esta chave exata"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT prompt_hash, exact_key, prompt, answer FROM cache_entries "
+                "WHERE exact_key = ?", (exact_key,)
+            ).fetchall()
+            return self._delete_rows(rows)
+
+    def remove_answer(self, answer: str) -> List[CacheEntry]:
+        """Remove todas as entradas com esta resposta"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT prompt_hash, exact_key, prompt, answer FROM cache_entries "
+                "WHERE answer_hash = ?", (_hash(answer),)
+            ).fetchall()
+            return self._delete_rows(rows)
+
+    def _delete_rows(self, rows: List[Tuple]) -> List[CacheEntry]:
+        """Remove linhas do índice (chamar com o lock adquirido)"""
+        if not rows:
+            return []
+
+        self._db.executemany(
+            "DELETE FROM cache_entries WHERE prompt_hash = ?", [(row[0],) for row in rows]
+        )
+        self._db.commit()
+        self.tombstones += len(rows)
+        return [CacheEntry(*row) for row in rows]
+
+    def _victim_order(self) -> str:
+        """Ordenação SQL: primeiras linhas são as primeiras a sair"""
+        if self.policy == EvictionPolicy.LFU:
+            return "hits ASC, last_access ASC"
+        if self.policy == EvictionPolicy.COST_AWARE:
+            # Mantém respostas caras (ex.: supervisor N4) e muito usadas
+            return "(cost * (hits + 1)) / (1.0 + (? - last_access) / 3600.0) ASC, last_access ASC"
+        return "last_access ASC"
+
+    def evict(self) -> List[CacheEntry]:
+        """Remove entradas expiradas e as que excedem os limites; retorna as removidas"""
+        now = time.time()
+        removed: List[CacheEntry] = []
+
+        with self._lock:
+            # Ordem de evicção depende dos acessos ainda em memória
+            self._flush_touches()
+            rows = self._db.execute(
+                "SELECT prompt_hash, exact_key, prompt, answer FROM cache_entries "
+                "WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            ).fetchall()
+            removed.extend(self._delete_rows(rows))
+
+            count, total_bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM cache_entries"
+            ).fetchone()
+
+            over_entries = max(count - self.max_entries, 0) if self.max_entries else 0
+            over_bytes = max(total_bytes - self.max_bytes, 0) if self.max_bytes else 0
+            if not over_entries and not over_bytes:
+                return removed
+
+            order = self._victim_order()
+            params = (now,) if "?" in order else ()
+            candidates = self._db.execute(
+                f"SELECT prompt_hash, exact_key, prompt, answer, size_bytes FROM cache_entries "
+                f"ORDER BY {order}", params
+            )
+
+            victims = []
+            for row in candidates:
+                if over_entries <= 0 and over_bytes <= 0:
+                    break
+                victims.append(row[:4])
+                over_entries -= 1
+                over_bytes -= row[4]
+
+            removed.extend(self._delete_rows(victims))
+
+        if removed:
+            self.logger.info(f"Evicção ({self.policy.value}): {len(removed)} entradas removidas")
+        return removed
+
+    def live_entries(self) -> List[CacheEntry]:
+        """Entradas vivas (não expiradas), usadas na compactação do store"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT prompt_hash, exact_key, prompt, answer FROM cache_entries "
+                "WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+            ).fetchall()
+        return [CacheEntry(*row) for row in rows]
+
+    def needs_compaction(self, ratio: float) -> bool:
+        """Store do GPTCache tem lixo suficiente para valer uma recompactação"""
+        return self.tombstones > 0 and self.tombstones >= ratio * max(self.count(), 1)
+
+    def reset_tombstones(self):
+        self.tombstones = 0
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COALESCE(SUM(size_bytes), 0) FROM cache_entries"
+            ).fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM cache_entries")
+            self._db.commit()
+            self._pending_touches.clear()
+            self._touches_since_flush = 0
+            self.tombstones = 0
+
+    def vacuum(self):
+        """Recupera espaço do arquivo do índice"""
+        with self._lock:
+            self._db.execute("VACUUM")
+
+def vacuum_sqlite_file(path: str):
+    """Executa VACUUM em um arquivo SQLite (ex.: store escalar do GPTCache)"""
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
@@ -3,18 +3,84 @@ Cache Manager - Integração com GPTCache
 Sistema de cache inteligente para respostas LLM com similaridade semântica
 """
 
+import os
+import re
+import json
+import time
+import atexit
+import shutil
 import logging
-from typing import Optional, Dict, Any
-from dataclasses import dataclass
+import tempfile
+import threading
+import numpy as np
+from types import SimpleNamespace
+from typing import Optional, Dict, Any, List, Callable, Tuple
+from dataclasses import dataclass, field, asdict
 
-from gptcache import cache
-from gptcache.manager.factory import manager_factory
+from gptcache import Cache, Config
+from gptcache.manager import CacheBase, VectorBase, get_data_manager
+from gptcache.manager.vector_data.base import VectorData
+from gptcache.similarity_evaluation import SearchDistanceEvaluation
 from gptcache.processor.pre import get_prompt
-from gptcache.embedding.huggingface import HuggingfaceEmbedding
-from gptcache.adapter import openai as gptcache_openai
-from gptcache.adapter import google_genai as gptcache_google
+from gptcache.embedding import Huggingface
+from gptcache.adapter.api import get as gptcache_get, put as gptcache_put
+from gptcache.utils.log import gptcache_log
 
 from framework_config import FrameworkConfig
+from exact_cache import ExactMatchCache
+from cache_eviction import CacheEntryIndex, EvictionPolicy, vacuum_sqlite_file
+from ann_vector_store import create_vector_store
+from sqlite_utils import connect_sqlite
+from threshold_tuner import ThresholdTuner
+from prompt_canonicalizer import canonicalize_prompt, canonicalize_messages
+
+# Tabela de perguntas do GPTCache com AUTOINCREMENT: ids (também usados no índice
+# vetorial) nunca são reutilizados entre workers que compartilham o store escalar
+_SHARED_QUESTION_DDL = """
+CREATE TABLE IF NOT EXISTS gptcache_question (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question VARCHAR(3000) NOT NULL,
+    create_on DATETIME,
+    last_access DATETIME,
+    embedding_data BLOB,
+    deleted INTEGER
+)
+"""
+
+# Limites superiores (ms) dos buckets dos histogramas de latência
+LATENCY_BUCKETS_MS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000]
+
+@dataclass
+class LatencyHistogram:
+    """Histograma de latência com buckets fixos em milissegundos"""
+    counts: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+    total_seconds: float = 0.0
+    samples: int = 0
+
+    def observe(self, seconds: float):
+        elapsed_ms = seconds * 1000
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total_seconds += seconds
+        self.samples += 1
+
+    @property
+    def mean(self) -> float:
+        if self.samples == 0:
+            return 0.0
+        return self.total_seconds / self.samples
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "samples": self.samples,
+            "mean_ms": self.mean * 1000
+        }
 
 @dataclass
 class CacheStats:
@@ -23,12 +89,513 @@ class CacheStats:
     misses: int = 0
     total_requests: int = 0
 
+    # Detalhamento por nível
+    l1_hits: int = 0
+    semantic_hits: int = 0
+
+    # Custos do próprio cache
+    lookup_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    embedding_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    # Latência das chamadas LLM em falta de cache e estimativa de economia
+    llm_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    latency_saved_seconds: float = 0.0
+
     @property
     def hit_rate(self) -> float:
         if self.total_requests == 0:
             return 0.0
         return self.hits / self.total_requests
 
+    def record_hit(self, level: str, lookup_seconds: float):
+        """Registra acerto no nível 'l1' ou 'semantic'"""
+        self.hits += 1
+        self.total_requests += 1
+        if level == "l1":
+            self.l1_hits += 1
+        else:
+            self.semantic_hits += 1
+        self.lookup_latency.observe(lookup_seconds)
+        # Economia estimada: latência média do LLM menos o custo da consulta
+        self.latency_saved_seconds += max(self.llm_latency.mean - lookup_seconds, 0.0)
+
+    def record_miss(self, lookup_seconds: float):
+        """Registra falta de cache"""
+        self.misses += 1
+        self.total_requests += 1
+        self.lookup_latency.observe(lookup_seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_requests": self.total_requests,
+            "hit_rate": self.hit_rate,
+            "l1_hits": self.l1_hits,
+            "semantic_hits": self.semantic_hits,
+            "lookup_latency": self.lookup_latency.to_dict(),
+            "embedding_latency": self.embedding_latency.to_dict(),
+            "llm_latency": self.llm_latency.to_dict(),
+            "latency_saved_seconds": self.latency_saved_seconds
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'CacheStats':
+        """Reconstrói estatísticas persistidas (formato de asdict)"""
+        stats = cls()
+        for key in ("hits", "misses", "total_requests", "l1_hits",
+                    "semantic_hits", "latency_saved_seconds"):
+            setattr(stats, key, data.get(key, getattr(stats, key)))
+        for key in ("lookup_latency", "embedding_latency", "llm_latency"):
+            histogram = data.get(key) or {}
+            counts = histogram.get("counts")
+            if counts and len(counts) == len(LATENCY_BUCKETS_MS) + 1:
+                setattr(stats, key, LatencyHistogram(
+                    counts=list(counts),
+                    total_seconds=histogram.get("total_seconds", 0.0),
+                    samples=histogram.get("samples", 0)
+                ))
+        return stats
+
+@dataclass
+class PendingResponse:
+    """Resposta mantida fora do cache até que seu resultado seja conhecido"""
+    exact_key: str
+    prompt: str
+    answer: str
+    cost: float
+    created_at: float
+
+@dataclass
+class CacheTicket:
+    """Referência a uma resposta (provisória ou servida do cache) de um papel/modelo"""
+    role: str
+    model: Optional[str]
+    answer: str
+    # Nível que serviu a resposta ("l1", "semantic") ou None se veio do LLM
+    cache_level: Optional[str] = None
+    # Chave exata da requisição que produziu a resposta
+    exact_key: Optional[str] = None
+
+class CacheNamespace:
+    """Cache semântico isolado para um papel (role) e modelo"""
+
+    def __init__(self, name: str, role: str, model: str, cache_obj: Cache,
+                 similarity_threshold: float, l1: Optional[ExactMatchCache] = None,
+                 stats: Optional[CacheStats] = None,
+                 on_stats_update: Optional[Callable[[], None]] = None,
+                 index: Optional[CacheEntryIndex] = None, db_path: Optional[str] = None,
+                 cost_weight: float = 1.0, compaction_ratio: float = 0.25,
+                 vacuum_interval_seconds: Optional[float] = None,
+                 canonicalize: bool = True, admission: bool = False,
+                 provisional_ttl_seconds: float = 600.0, shared: bool = False):
+        self.name = name
+        self.role = role
+        self.model = model
+        self.cache = cache_obj
+        self.similarity_threshold = similarity_threshold
+        self.l1 = l1
+        # Chaves calculadas sobre a forma canônica do prompt
+        self.canonicalize = canonicalize
+        self.stats = stats or CacheStats()
+        self.on_stats_update = on_stats_update
+
+        # Limites, TTL e evicção
+        self.index = index
+        self.db_path = db_path
+        self.cost_weight = cost_weight
+        self.compaction_ratio = compaction_ratio
+        self.vacuum_interval_seconds = vacuum_interval_seconds
+        self._last_vacuum = time.time()
+        # Store escalar compartilhado entre workers: linhas só são marcadas como removidas
+        self.shared = shared
+
+        # Admissão por resultado: respostas novas aguardam commit/reject
+        self.admission = admission
+        self.provisional_ttl_seconds = provisional_ttl_seconds
+        # Provisórias por chave exata: respostas idênticas de prompts diferentes não colidem
+        self._pending: Dict[str, PendingResponse] = {}
+        self._pending_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def lookup(self, exact_key: str, prompt: str) -> Optional[str]:
+        """Consulta o L1 exato e, só em caso de falta, o cache semântico"""
+        return self.lookup_with_level(exact_key, prompt)[0]
+
+    def lookup_with_level(self, exact_key: str, prompt: str) -> Tuple[Optional[str], Optional[str]]:
+        """Como lookup, retornando também o nível que respondeu ("l1" ou "semantic")"""
+        start = time.perf_counter()
+
+        if self.l1 is not None:
+            answer = self.l1.get(exact_key)
+            if answer is not None and self._is_live(answer):
+                self._record(lambda: self.stats.record_hit("l1", time.perf_counter() - start))
+                return answer, "l1"
+            if answer is not None:
+                # Entrada expirada ou evictada do cache semântico
+                self.l1.delete(exact_key)
+
+        answer = self.get(prompt)
+        if answer is not None and not self._is_live(answer):
+            answer = None
+        lookup_seconds = time.perf_counter() - start
+
+        if answer is None:
+            self._record(lambda: self.stats.record_miss(lookup_seconds))
+            return None, None
+
+        self._record(lambda: self.stats.record_hit("semantic", lookup_seconds))
+        if self.l1 is not None:
+            self.l1.put(exact_key, answer)
+        return answer, "semantic"
+
+    def record_llm_latency(self, seconds: float):
+        """Registra a latência de uma chamada LLM feita após falta de cache"""
+        self._record(lambda: self.stats.llm_latency.observe(seconds))
+
+    def timed_embedding(self, embedding_func: Callable) -> Callable:
+        """Envolve a função de embedding medindo o custo do próprio cache"""
+        def _embed(data, **kwargs):
+            start = time.perf_counter()
+            try:
+                return embedding_func(data, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._stats_lock:
+                    self.stats.embedding_latency.observe(elapsed)
+        return _embed
+
+    def _record(self, update: Callable[[], None]):
+        """Aplica atualização de estatísticas e notifica o gerenciador"""
+        with self._stats_lock:
+            update()
+        if self.on_stats_update:
+            self.on_stats_update()
+
+    def _is_live(self, answer: str) -> bool:
+        """Registra o acesso no índice; False se a entrada expirou ou foi evictada"""
+        if self.index is None:
+            return True
+        return self.index.touch_answer(answer)
+
+    def store(self, exact_key: str, prompt: str, answer: str, cost: float = 0.0,
+              ttl_seconds: Optional[float] = None):
+        """Armazena resposta no L1 e no cache semântico"""
+        if self.l1 is not None:
+            self.l1.put(exact_key, answer)
+        self.put(prompt, answer)
+
+        if self.index is not None:
+            self.index.add(prompt, answer, exact_key, cost=cost * self.cost_weight,
+                           ttl_seconds=ttl_seconds)
+            self.maintain()
+
+    def hold(self, exact_key: str, prompt: str, answer: str, cost: float = 0.0):
+        """Armazena diretamente ou, com admissão ativa, mantém como provisória"""
+        if not self.admission:
+            self.store(exact_key, prompt, answer, cost=cost)
+            return
+
+        now = time.time()
+        with self._pending_lock:
+            # Provisórias sem desfecho (tarefa abandonada) são descartadas
+            expired = [
+                key for key, pending in self._pending.items()
+                if now - pending.created_at > self.provisional_ttl_seconds
+            ]
+            for key in expired:
+                del self._pending[key]
+            self._pending[exact_key] = PendingResponse(exact_key, prompt, answer, cost, now)
+
+    def commit(self, exact_key: str) -> bool:
+        """Admite no cache a resposta provisória da requisição que levou a sucesso"""
+        with self._pending_lock:
+            pending = self._pending.pop(exact_key, None)
+        if pending is None:
+            return False
+
+        self.store(pending.exact_key, pending.prompt, pending.answer, cost=pending.cost)
+        return True
+
+    def reject(self, exact_key: Optional[str], answer: str) -> int:
+        """Descarta a resposta: provisória ou já admitida; retorna entradas removidas"""
+        with self._pending_lock:
+            if exact_key is not None and self._pending.pop(exact_key, None) is not None:
+                return 1
+
+        if self.index is None:
+            return 0
+
+        # Removida do índice, a entrada deixa de ser viva para L1 e cache semântico;
+        # acerto semântico veio de outra chave e é localizado pela resposta servida
+        removed = self.index.remove_exact(exact_key) if exact_key is not None else []
+        removed = removed or self.index.remove_answer(answer)
+        for entry in removed:
+            if self.l1 is not None and entry.exact_key:
+                self.l1.delete(entry.exact_key)
+        return len(removed)
+
+    def pending_count(self) -> int:
+        with self._pending_lock:
+            return len(self._pending)
+
+    def maintain(self):
+        """Aplica TTL e limites; compacta e faz VACUUM quando necessário"""
+        if self.index is None:
+            return
+
+        for entry in self.index.evict():
+            if self.l1 is not None and entry.exact_key:
+                self.l1.delete(entry.exact_key)
+
+        vacuum_due = (
+            self.vacuum_interval_seconds is not None
+            and time.time() - self._last_vacuum >= self.vacuum_interval_seconds
+        )
+        if self.index.needs_compaction(self.compaction_ratio) or vacuum_due:
+            self.compact()
+
+    def compact(self):
+        """Reconstrói o store do GPTCache só com entradas vivas e recupera espaço
+
+        Em modo compartilhado o store não é reconstruído: os índices vetoriais dos
+        outros workers apontam para os ids atuais. Entradas mortas já não são servidas
+        (o índice de entradas as descarta) e só o índice é compactado.
+        """
+        if self.index is None:
+            return
+
+        with self._lock:
+            if not self.shared:
+                live_entries = self.index.live_entries()
+                self._purge_store()
+                for entry in live_entries:
+                    gptcache_put(entry.prompt, entry.answer, cache_obj=self.cache)
+            self.index.reset_tombstones()
+
+            try:
+                self.index.vacuum()
+                if not self.shared and self.db_path and os.path.exists(self.db_path):
+                    vacuum_sqlite_file(self.db_path)
+            except Exception as e:
+                logging.getLogger(__name__).error(f"Erro ao executar VACUUM no cache '{self.name}': {e}")
+
+            self._last_vacuum = time.time()
+
+    def get(self, prompt: str) -> Optional[str]:
+        """Busca resposta similar no cache do namespace"""
+        return gptcache_get(prompt, cache_obj=self.cache)
+
+    def put(self, prompt: str, answer: str):
+        """Armazena resposta no cache do namespace"""
+        with self._lock:
+            gptcache_put(prompt, answer, cache_obj=self.cache)
+
+    def set_similarity_threshold(self, threshold: float):
+        """Ajusta o threshold apenas deste namespace"""
+        self.similarity_threshold = threshold
+        self.cache.config.similarity_threshold = threshold
+
+    def clear(self):
+        """Limpa o cache do namespace"""
+        if self.l1 is not None:
+            self.l1.clear()
+        if self.index is not None:
+            self.index.clear()
+        with self._pending_lock:
+            self._pending.clear()
+        with self._lock:
+            self._purge_store()
+
+    def _purge_store(self):
+        """Remove todas as entradas (escalares e vetores) do store do GPTCache"""
+        data_manager = self.cache.data_manager
+        ids = data_manager.s.get_ids(deleted=False)
+        if ids:
+            data_manager.s.mark_deleted(ids)
+            # Compartilhado: linhas ficam marcadas (invisíveis) para os ids não serem reusados
+            if not self.shared:
+                data_manager.s.clear_deleted_data()
+            data_manager.v.delete(ids)
+        data_manager.flush()
+
+def _messages_to_prompt(messages: List[Dict[str, Any]]) -> str:
+    """Serializa mensagens de chat em texto estável para o cache"""
+    return "\n".join(
+        f"{message.get('role', '')}: {message.get('content', '')}"
+        for message in messages
+    )
+
+def chat_cache_keys(request: Dict[str, Any], canonicalize: bool = True) -> Tuple[str, str]:
+    """Chave exata (L1) e prompt semântico de uma requisição de chat"""
+    messages = request.get("messages", [])
+    if canonicalize:
+        messages = canonicalize_messages(messages)
+    exact_key = ExactMatchCache.make_key(request.get("model"), messages, request)
+    return exact_key, _messages_to_prompt(messages)
+
+def text_cache_keys(model: Optional[str], contents: str, params: Dict[str, Any],
+                    canonicalize: bool = True) -> Tuple[str, str]:
+    """Chave exata (L1) e prompt semântico de um prompt de texto (GenAI)"""
+    if canonicalize:
+        contents = canonicalize_prompt(contents)
+    return ExactMatchCache.make_key(model, contents, params), contents
+
+class CachedStream:
+    """Stream de resposta que, ao ser consumido por inteiro, alimenta o cache"""
+
+    def __init__(self, chunks, content_of: Callable[[Any], Optional[str]],
+                 namespace: Optional[CacheNamespace] = None, exact_key: Optional[str] = None,
+                 prompt: Optional[str] = None, cached: bool = False,
+                 cache_level: Optional[str] = None):
+        self._chunks = chunks
+        self._content_of = content_of
+        self.namespace = namespace
+        self.exact_key = exact_key
+        self.prompt = prompt
+        self.cached = cached
+        self.cache_level = cache_level
+
+    def __iter__(self):
+        start = time.perf_counter()
+        parts = []
+        for chunk in self._chunks:
+            parts.append(self._content_of(chunk) or "")
+            yield chunk
+
+        # Stream interrompido (GeneratorExit) não chega aqui: resposta parcial não é cacheada
+        if self.namespace is not None:
+            llm_seconds = time.perf_counter() - start
+            self.namespace.record_llm_latency(llm_seconds)
+            content = "".join(parts)
+            if content:
+                self.namespace.hold(self.exact_key, self.prompt, content, cost=llm_seconds)
+
+    def close(self):
+        close = getattr(self._chunks, "close", None)
+        if close:
+            close()
+
+def _with_exact_key(response, exact_key: str):
+    """Anota na resposta do LLM a chave exata usada no commit/reject do ticket"""
+    try:
+        response.exact_key = exact_key
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return response
+
+def _chat_chunk_content(chunk) -> Optional[str]:
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+def _genai_chunk_content(chunk) -> Optional[str]:
+    return chunk.text
+
+class CachedChatClient:
+    """Cliente compatível com OpenAI que consulta o cache do seu namespace"""
+
+    def __init__(self, client, namespace: CacheNamespace):
+        self._client = client
+        self.namespace = namespace
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def create(self, **kwargs):
+        """Equivalente a chat.completions.create com cache"""
+        exact_key, prompt = chat_cache_keys(kwargs, self.namespace.canonicalize)
+
+        cached, level = self.namespace.lookup_with_level(exact_key, prompt)
+        if kwargs.get("stream"):
+            return self._create_stream(kwargs, exact_key, prompt, cached, level)
+
+        if cached is not None:
+            return SimpleNamespace(
+                model=kwargs.get("model"),
+                choices=[SimpleNamespace(
+                    index=0,
+                    message=SimpleNamespace(role="assistant", content=cached),
+                    finish_reason="stop"
+                )],
+                usage=None,
+                cached=True,
+                cache_level=level,
+                exact_key=exact_key
+            )
+
+        llm_start = time.perf_counter()
+        response = self._client.chat.completions.create(**kwargs)
+        llm_seconds = time.perf_counter() - llm_start
+        self.namespace.record_llm_latency(llm_seconds)
+        content = response.choices[0].message.content
+        if content:
+            self.namespace.hold(exact_key, prompt, content, cost=llm_seconds)
+        return _with_exact_key(response, exact_key)
+
+    def _create_stream(self, kwargs: Dict[str, Any], exact_key: str, prompt: str,
+                       cached: Optional[str], level: Optional[str]) -> CachedStream:
+        """Streaming: acerto vira um único chunk; falta é repassada e cacheada ao final"""
+        if cached is not None:
+            chunk = SimpleNamespace(
+                model=kwargs.get("model"),
+                choices=[SimpleNamespace(
+                    index=0,
+                    delta=SimpleNamespace(role="assistant", content=cached),
+                    finish_reason="stop"
+                )]
+            )
+            return CachedStream([chunk], _chat_chunk_content, exact_key=exact_key,
+                                cached=True, cache_level=level)
+
+        return CachedStream(
+            self._client.chat.completions.create(**kwargs), _chat_chunk_content,
+            self.namespace, exact_key, prompt
+        )
+
+class CachedGenerativeModel:
+    """Modelo GenAI que consulta o cache do seu namespace"""
+
+    def __init__(self, model, namespace: CacheNamespace):
+        self._model = model
+        self.namespace = namespace
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def generate_content(self, contents, **kwargs):
+        """Equivalente a generate_content com cache para prompts de texto"""
+        if not isinstance(contents, str):
+            return self._model.generate_content(contents, **kwargs)
+
+        exact_key, prompt = text_cache_keys(
+            self.namespace.model, contents, kwargs, self.namespace.canonicalize
+        )
+
+        cached, level = self.namespace.lookup_with_level(exact_key, prompt)
+        if kwargs.get("stream"):
+            if cached is not None:
+                return CachedStream(
+                    [SimpleNamespace(text=cached)], _genai_chunk_content,
+                    exact_key=exact_key, cached=True, cache_level=level
+                )
+            return CachedStream(
+                self._model.generate_content(contents, **kwargs), _genai_chunk_content,
+                self.namespace, exact_key, prompt
+            )
+
+        if cached is not None:
+            return SimpleNamespace(text=cached, cached=True, cache_level=level, exact_key=exact_key)
+
+        llm_start = time.perf_counter()
+        response = self._model.generate_content(contents, **kwargs)
+        llm_seconds = time.perf_counter() - llm_start
+        self.namespace.record_llm_latency(llm_seconds)
+        if response.text:
+            self.namespace.hold(exact_key, prompt, response.text, cost=llm_seconds)
+        return _with_exact_key(response, exact_key)
+
 class CacheManager:
     """Gerenciador de cache inteligente"""
 
@@ -36,103 +603,463 @@ class CacheManager:
         self.config = config
         self.logger = logging.getLogger(__name__)
         self.stats = CacheStats()
+        self.namespaces: Dict[str, CacheNamespace] = {}
+        self._embedding = None
+        self._namespaces_lock = threading.Lock()
         self._initialized = False
 
+        # Estatísticas persistidas entre reinícios
+        self._persisted_stats: Dict[str, Dict[str, Any]] = {}
+        self._updates_since_save = 0
+        self._save_lock = threading.Lock()
+
+        # Thresholds por papel ajustados a partir do desfecho dos acertos
+        self.threshold_tuner = ThresholdTuner(config.cache, self._apply_tuned_threshold)
+
+        # TTL e VACUUM também sem tráfego de escrita (store() só mantém o namespace gravado)
+        self._maintenance_stop = threading.Event()
+        self._maintenance_thread: Optional[threading.Thread] = None
+
         if config.enable_cache:
             self._initialize_cache()
+            self._load_stats()
+            atexit.register(self.save_stats)
+            if self._initialized and config.cache.maintenance_interval_seconds:
+                self._start_maintenance(config.cache.maintenance_interval_seconds)
 
     def _initialize_cache(self):
-        """Inicializa o sistema de cache GPTCache"""
+        """Inicializa o embedding compartilhado pelos caches GPTCache"""
         try:
             # Configurar embedding para similaridade semântica
-            hf_embedding = HuggingfaceEmbedding(self.config.cache.embedding_model)
+            self._embedding = Huggingface(self.config.cache.embedding_model)
 
-            # Configurar gerenciadores de dados
-            data_manager = manager_factory(
-                "sqlite", 
-                data_dir=".", 
-                scalar_name=self.config.cache.db_file
+            self._initialized = True
+            self.logger.info("GPTCache inicializado com sucesso")
+
+        except Exception as e:
+            self.logger.error(f"Erro ao inicializar GPTCache: {e}")
+            self._initialized = False
+
+    def _namespace_name(self, role: str, model: Optional[str]) -> str:
+        """Nome do namespace, seguro para uso em nomes de arquivo"""
+        raw_name = f"{role}__{model}" if model else role
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", raw_name)
+
+    def _namespace_db_file(self, name: str) -> str:
+        """Arquivo SQLite dedicado ao namespace"""
+        stem, ext = os.path.splitext(self.config.cache.db_file)
+        return f"{stem}_{name}{ext or '.db'}"
+
+    def _create_namespace(self, role: str, model: Optional[str]) -> CacheNamespace:
+        """Cria uma instância Cache própria, com store e threshold dedicados"""
+        name = self._namespace_name(role, model)
+        db_file = self._namespace_db_file(name)
+        threshold = self.config.cache.threshold_for(role)
+
+        os.makedirs(self.config.cache.data_dir, exist_ok=True)
+
+        # Configurar gerenciadores de dados
+        data_manager = self._create_managers(name, db_file)
+
+        cache_config = self.config.cache
+        namespace = CacheNamespace(
+            name, role, model or "", Cache(), threshold,
+            l1=self._create_l1(name),
+            stats=self._restore_stats(name),
+            on_stats_update=self._on_stats_update,
+            index=self._create_index(name, role),
+            db_path=os.path.join(cache_config.data_dir, db_file),
+            cost_weight=cache_config.cost_weights.get(role, 1.0),
+            compaction_ratio=cache_config.compaction_ratio,
+            vacuum_interval_seconds=cache_config.vacuum_interval_seconds,
+            canonicalize=cache_config.canonicalize_prompts,
+            admission=cache_config.outcome_admission,
+            provisional_ttl_seconds=cache_config.provisional_ttl_seconds,
+            shared=cache_config.shared_mode
+        )
+
+        namespace.cache.init(
+            pre_embedding_func=get_prompt,
+            embedding_func=namespace.timed_embedding(self._embedding.to_embeddings),
+            data_manager=data_manager,
+            # Distância L2 entre embeddings normalizados (0 a 4) vira similaridade
+            similarity_evaluation=SearchDistanceEvaluation(),
+            config=Config(similarity_threshold=threshold)
+        )
+
+        # Desabilitar logs do cache para reduzir ruído
+        gptcache_log.setLevel(logging.WARNING)
+
+        self.logger.info(f"Namespace de cache '{name}' criado (threshold={threshold})")
+        return namespace
+
+    def _create_managers(self, name: str, db_file: str) -> Any:
+        """Store escalar SQLite + store vetorial (FAISS exaustivo ou índice ANN persistido)"""
+        cache_config = self.config.cache
+        db_path = os.path.join(cache_config.data_dir, db_file)
+
+        if cache_config.shared_mode:
+            return self._create_shared_managers(name, db_path)
+
+        stem, _ = os.path.splitext(db_file)
+        vector_store = create_vector_store(
+            cache_config.vector_store,
+            os.path.join(cache_config.data_dir, f"{stem}.{cache_config.vector_store}.index"),
+            self._embedding.dimension,
+            max_elements=cache_config.ann_max_elements,
+            ef_search=cache_config.ann_ef_search,
+            mmap=cache_config.ann_mmap,
+            rebuild_ratio=cache_config.ann_rebuild_ratio
+        )
+        if vector_store is None:
+            # Padrão: índice plano (busca exaustiva) em arquivo próprio do namespace
+            vector_store = VectorBase(
+                "faiss",
+                dimension=self._embedding.dimension,
+                index_path=os.path.join(cache_config.data_dir, f"{stem}.faiss.index")
             )
 
-            vector_manager = manager_factory(
-                "sqlite", 
-                data_dir=".", 
-                vector_name=self.config.cache.db_file
+        return get_data_manager(CacheBase("sqlite", sql_url=f"sqlite:///{db_path}"), vector_store)
+
+    def _create_shared_managers(self, name: str, db_path: str) -> Any:
+        """Store escalar aberto por vários processos + índice vetorial privado do processo
+
+        O índice não é persistido (cada processo sobrescreveria o mesmo arquivo): é
+        reconstruído na abertura a partir dos embeddings do store escalar.
+        """
+        cache_config = self.config.cache
+        connection = connect_sqlite(db_path, shared=True, busy_timeout_ms=cache_config.sqlite_busy_timeout_ms)
+        try:
+            connection.execute(_SHARED_QUESTION_DDL)
+            ddl = connection.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'gptcache_question'"
+            ).fetchone()[0]
+            connection.commit()
+        finally:
+            connection.close()
+        if "AUTOINCREMENT" not in ddl.upper():
+            self.logger.warning(
+                f"Store do cache '{name}' criado sem AUTOINCREMENT; ids só não são reusados "
+                "porque linhas removidas ficam apenas marcadas"
             )
 
-            # Inicializar cache
-            cache.init(
-                pre_embedding_func=get_prompt,
-                embedding_func=hf_embedding.to_embeddings,
-                data_manager=data_manager,
-                vector_manager=vector_manager,
-                similarity_threshold=self.config.cache.similarity_threshold
+        index_dir = tempfile.mkdtemp(prefix=f"fazai-cache-{name}-")
+        # Registrado antes do Cache.init: roda depois do flush do GPTCache no atexit
+        atexit.register(shutil.rmtree, index_dir, True)
+        vector_store = VectorBase(
+            "faiss", dimension=self._embedding.dimension,
+            index_path=os.path.join(index_dir, "faiss.index")
+        )
+        data_manager = get_data_manager(CacheBase("sqlite", sql_url=f"sqlite:///{db_path}"), vector_store)
+        self._load_shared_vectors(db_path, vector_store)
+        return data_manager
+
+    def _load_shared_vectors(self, db_path: str, vector_store: Any, batch_size: int = 1024):
+        """Carrega no índice local os embeddings vivos gravados por todos os workers"""
+        connection = connect_sqlite(db_path, shared=True,
+                                    busy_timeout_ms=self.config.cache.sqlite_busy_timeout_ms)
+        try:
+            cursor = connection.execute(
+                "SELECT id, embedding_data FROM gptcache_question "
+                "WHERE deleted = 0 AND embedding_data IS NOT NULL"
             )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                vector_store.mul_add([
+                    VectorData(id=row_id, data=np.frombuffer(data, dtype=np.float32))
+                    for row_id, data in rows
+                ])
+        finally:
+            connection.close()
 
-            # Desabilitar logs do cache para reduzir ruído
-            cache.set_logger(None)
+    def _create_l1(self, name: str) -> Optional[ExactMatchCache]:
+        """Cria o cache L1 exato do namespace, se habilitado"""
+        cache_config = self.config.cache
+        if not cache_config.l1_enabled:
+            return None
 
-            self._initialized = True
-            self.logger.info("GPTCache inicializado com sucesso")
+        # Em modo compartilhado o tier em disco é o ponto de encontro entre workers
+        disk_path = None
+        if cache_config.l1_disk_tier or cache_config.shared_mode:
+            stem, _ = os.path.splitext(self._namespace_db_file(name))
+            disk_path = os.path.join(cache_config.data_dir, f"{stem}_l1.db")
 
-        except Exception as e:
-            self.logger.error(f"Erro ao inicializar GPTCache: {e}")
-            self._initialized = False
+        return ExactMatchCache(
+            max_entries=cache_config.l1_max_entries,
+            max_bytes=cache_config.l1_max_bytes,
+            disk_path=disk_path,
+            shared=cache_config.shared_mode,
+            busy_timeout_ms=cache_config.sqlite_busy_timeout_ms,
+            write_batch_size=cache_config.shared_write_batch_size if cache_config.shared_mode else 1
+        )
 
-    def wrap_openai_client(self, client):
-        """Envolve cliente OpenAI com cache"""
+    def _create_index(self, name: str, role: str) -> CacheEntryIndex:
+        """Cria o índice de limites/TTL/evicção do namespace"""
+        cache_config = self.config.cache
+        stem, _ = os.path.splitext(self._namespace_db_file(name))
+
+        return CacheEntryIndex(
+            os.path.join(cache_config.data_dir, f"{stem}_index.db"),
+            policy=EvictionPolicy(cache_config.eviction_policy),
+            max_entries=cache_config.max_entries,
+            max_bytes=cache_config.max_bytes,
+            ttl_seconds=cache_config.role_ttls.get(role, cache_config.ttl_seconds),
+            shared=cache_config.shared_mode,
+            busy_timeout_ms=cache_config.sqlite_busy_timeout_ms,
+            write_batch_size=cache_config.index_write_batch_size
+        )
+
+    def get_namespace(self, role: str, model: Optional[str] = None) -> Optional[CacheNamespace]:
+        """Retorna (criando se necessário) o namespace de um papel/modelo"""
+        if not self._initialized:
+            return None
+
+        name = self._namespace_name(role, model)
+        with self._namespaces_lock:
+            if name not in self.namespaces:
+                self.namespaces[name] = self._create_namespace(role, model)
+            return self.namespaces[name]
+
+    def wrap_openai_client(self, client, role: str = "default", model: Optional[str] = None):
+        """Envolve cliente OpenAI com o cache do papel/modelo"""
         if not self._initialized:
             return client
 
         try:
-            cached_client = gptcache_openai.ChatCompletion(client=client)
-            self.logger.info("Cliente OpenAI envolvido com cache")
+            namespace = self.get_namespace(role, model)
+            cached_client = CachedChatClient(client, namespace)
+            self.logger.info(f"Cliente OpenAI envolvido com cache ({namespace.name})")
             return cached_client
         except Exception as e:
             self.logger.error(f"Erro ao envolver cliente OpenAI: {e}")
             return client
 
-    def wrap_genai_model(self, model):
-        """Envolve modelo GenAI com cache"""
+    def wrap_genai_model(self, model, role: str = "supervisor", model_name: Optional[str] = None):
+        """Envolve modelo GenAI com o cache do papel/modelo"""
         if not self._initialized:
             return model
 
         try:
-            cached_model = gptcache_google.GenerativeModel(gemini_model=model)
-            self.logger.info("Modelo GenAI envolvido com cache")
+            model_name = model_name or getattr(model, "model_name", None)
+            namespace = self.get_namespace(role, model_name)
+            cached_model = CachedGenerativeModel(model, namespace)
+            self.logger.info(f"Modelo GenAI envolvido com cache ({namespace.name})")
             return cached_model
         except Exception as e:
             self.logger.error(f"Erro ao envolver modelo GenAI: {e}")
             return model
 
-    def clear_cache(self):
-        """Limpa o cache"""
+    def warm_chat(self, role: str, request: Dict[str, Any], answer: str) -> bool:
+        """Pré-popula o cache de um papel com uma resposta conhecida"""
+        namespace = self.get_namespace(role, request.get("model"))
+        if namespace is None:
+            return False
+
+        exact_key, prompt = chat_cache_keys(request, namespace.canonicalize)
+        namespace.store(exact_key, prompt, answer, cost=namespace.stats.llm_latency.mean)
+        return True
+
+    def commit_response(self, ticket: CacheTicket) -> bool:
+        """Admite no cache a resposta do ticket (passo executado com sucesso)"""
+        namespace = self.get_namespace(ticket.role, ticket.model)
+        if namespace is None:
+            return False
+
+        if ticket.cache_level == "semantic":
+            self.threshold_tuner.record(ticket.role, True)
+        if ticket.exact_key is None:
+            return False
+        return namespace.commit(ticket.exact_key)
+
+    def reject_response(self, ticket: CacheTicket) -> int:
+        """Descarta a resposta do ticket (JSON inválido ou comando que falhou)"""
+        namespace = self.get_namespace(ticket.role, ticket.model)
+        if namespace is None:
+            return 0
+
+        if ticket.cache_level == "semantic":
+            # Acerto semântico que levou a falha: sinal para subir o threshold
+            self.threshold_tuner.record(ticket.role, False)
+        removed = namespace.reject(ticket.exact_key, ticket.answer)
+        if removed:
+            self.logger.info(f"Resposta descartada do cache '{namespace.name}'")
+        return removed
+
+    def clear_cache(self, role: Optional[str] = None):
+        """Limpa o cache (todos os namespaces ou apenas os de um papel)"""
         if not self._initialized:
             return
 
+        for namespace in list(self.namespaces.values()):
+            if role and namespace.role != role:
+                continue
+            try:
+                namespace.clear()
+                self.logger.info(f"Cache '{namespace.name}' limpo")
+            except Exception as e:
+                self.logger.error(f"Erro ao limpar cache '{namespace.name}': {e}")
+
+    def _stats_path(self) -> str:
+        return os.path.join(self.config.cache.data_dir, self.config.cache.stats_file)
+
+    def _load_stats(self):
+        """Carrega estatísticas persistidas de execuções anteriores"""
+        path = self._stats_path()
+        if not os.path.exists(path):
+            return
+
         try:
-            cache.flush()
-            self.logger.info("Cache limpo")
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._persisted_stats = data.get("namespaces", {})
+            self.threshold_tuner.restore(data.get("thresholds", {}))
+            self.logger.info(f"Estatísticas de cache carregadas de {path}")
         except Exception as e:
-            self.logger.error(f"Erro ao limpar cache: {e}")
+            self.logger.error(f"Erro ao carregar estatísticas do cache: {e}")
+
+    def _restore_stats(self, name: str) -> CacheStats:
+        data = self._persisted_stats.get(name)
+        return CacheStats.from_dict(data) if data else CacheStats()
+
+    def _on_stats_update(self):
+        """Persiste as estatísticas a cada N atualizações"""
+        self._updates_since_save += 1
+        if self._updates_since_save >= self.config.cache.stats_save_interval:
+            self.save_stats()
+
+    def save_stats(self):
+        """Persiste estatísticas de todos os namespaces em JSON"""
+        if not self._initialized:
+            return
+
+        with self._save_lock:
+            self._updates_since_save = 0
+            data = dict(self._persisted_stats)
+            for name, namespace in list(self.namespaces.items()):
+                with namespace._stats_lock:
+                    data[name] = asdict(namespace.stats)
+                # Acessos acumulados do tier L1 em disco
+                if namespace.l1:
+                    namespace.l1.flush()
+                if namespace.index is not None:
+                    namespace.index.flush()
+
+            path = self._stats_path()
+            try:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({
+                        "namespaces": data,
+                        "thresholds": self.threshold_tuner.thresholds(),
+                        "saved_at": time.time()
+                    }, f)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                self.logger.error(f"Erro ao salvar estatísticas do cache: {e}")
 
     def get_cache_stats(self) -> Dict[str, Any]:
         """Retorna estatísticas do cache"""
+        namespaces = list(self.namespaces.values())
+        hits = self.stats.hits + sum(ns.stats.hits for ns in namespaces)
+        misses = self.stats.misses + sum(ns.stats.misses for ns in namespaces)
+        total = self.stats.total_requests + sum(ns.stats.total_requests for ns in namespaces)
+
+        # Agregado por papel
+        roles: Dict[str, Dict[str, Any]] = {}
+        for ns in namespaces:
+            role_stats = roles.setdefault(ns.role, {
+                "hits": 0, "misses": 0, "total_requests": 0,
+                "l1_hits": 0, "semantic_hits": 0, "latency_saved_seconds": 0.0
+            })
+            role_stats["hits"] += ns.stats.hits
+            role_stats["misses"] += ns.stats.misses
+            role_stats["total_requests"] += ns.stats.total_requests
+            role_stats["l1_hits"] += ns.stats.l1_hits
+            role_stats["semantic_hits"] += ns.stats.semantic_hits
+            role_stats["latency_saved_seconds"] += ns.stats.latency_saved_seconds
+
+        for role, role_stats in roles.items():
+            total_role = role_stats["total_requests"]
+            role_stats["hit_rate"] = role_stats["hits"] / total_role if total_role else 0.0
+            role_stats["similarity_threshold"] = self.config.cache.threshold_for(role)
+
         return {
-            "hits": self.stats.hits,
-            "misses": self.stats.misses,
-            "total_requests": self.stats.total_requests,
-            "hit_rate": self.stats.hit_rate,
-            "initialized": self._initialized
+            "hits": hits,
+            "misses": misses,
+            "total_requests": total,
+            "hit_rate": hits / total if total else 0.0,
+            "l1_hits": sum(ns.stats.l1_hits for ns in namespaces),
+            "semantic_hits": sum(ns.stats.semantic_hits for ns in namespaces),
+            "latency_saved_seconds": sum(ns.stats.latency_saved_seconds for ns in namespaces),
+            "initialized": self._initialized,
+            "roles": roles,
+            "threshold_tuner": self.threshold_tuner.get_stats(),
+            "namespaces": {
+                ns.name: {
+                    "role": ns.role,
+                    "model": ns.model,
+                    "similarity_threshold": ns.similarity_threshold,
+                    "l1_entries": len(ns.l1) if ns.l1 is not None else 0,
+                    "entries": ns.index.count() if ns.index is not None else None,
+                    "pending": ns.pending_count(),
+                    "size_bytes": ns.index.total_bytes() if ns.index is not None else None,
+                    **ns.stats.to_dict()
+                }
+                for ns in namespaces
+            }
         }
 
-    def set_similarity_threshold(self, threshold: float):
-        """Ajusta threshold de similaridade do cache"""
-        if 0.0 <= threshold <= 1.0:
-            self.config.cache.similarity_threshold = threshold
-            self.logger.info(f"Threshold de similaridade ajustado para {threshold}")
-        else:
+    def run_maintenance(self):
+        """Aplica TTL/limites e compacta todos os namespaces"""
+        for namespace in list(self.namespaces.values()):
+            try:
+                namespace.maintain()
+            except Exception as e:
+                self.logger.error(f"Erro na manutenção do cache '{namespace.name}': {e}")
+
+    def _start_maintenance(self, interval_seconds: float):
+        def _loop():
+            while not self._maintenance_stop.wait(interval_seconds):
+                self.run_maintenance()
+
+        self._maintenance_thread = threading.Thread(target=_loop, name="cache-maintenance", daemon=True)
+        self._maintenance_thread.start()
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Para a manutenção periódica e persiste as estatísticas"""
+        self._maintenance_stop.set()
+        if self._maintenance_thread is not None:
+            self._maintenance_thread.join(timeout)
+            self._maintenance_thread = None
+        self.save_stats()
+
+    def _apply_tuned_threshold(self, role: str, threshold: float):
+        self.set_similarity_threshold(threshold, role)
+
+    def set_similarity_threshold(self, threshold: float, role: Optional[str] = None):
+        """Ajusta threshold de similaridade (global ou de um papel)"""
+        if not 0.0 <= threshold <= 1.0:
             self.logger.warning("Threshold deve estar entre 0.0 e 1.0")
+            return
+
+        if role:
+            self.config.cache.role_thresholds[role] = threshold
+        else:
+            self.config.cache.similarity_threshold = threshold
+
+        for namespace in self.namespaces.values():
+            if role is None and namespace.role in self.config.cache.role_thresholds:
+                continue
+            if role and namespace.role != role:
+                continue
+            namespace.set_similarity_threshold(threshold)
+
+        self.logger.info(
+            f"Threshold de similaridade ajustado para {threshold}"
+            + (f" (papel {role})" if role else "")
+        )
 
     def is_enabled(self) -> bool:
         """Verifica se o cache está habilitado e funcionando"""
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+Cache Warm-up - Pré-aquecimento do Cache a partir do Histórico
+Reconstrói os prompts do gerente que levaram a tarefas bem-sucedidas e popula o cache
+"""
+
+import sys
+import json
+import argparse
+import logging
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+from dataclasses import dataclass, asdict
+
+from framework_config import FrameworkConfig, EscalationLevel
+
+@dataclass
+class WarmupStats:
+    """Estatísticas de uma execução de warm-up"""
+    tasks_scanned: int = 0
+    tasks_successful: int = 0
+    entries_warmed: int = 0
+    batches: int = 0
+    errors: int = 0
+
+class CacheWarmer:
+    """Pré-aquece o cache do gerente com respostas que levaram a sucesso"""
+
+    def __init__(self, config: FrameworkConfig, memory_manager, cache_manager, fallback_manager):
+        self.config = config
+        self.memory_manager = memory_manager
+        self.cache_manager = cache_manager
+        self.fallback_manager = fallback_manager
+        self.logger = logging.getLogger(__name__)
+
+    def _system_prompt(self) -> str:
+        """Personalidade atual, consultada uma única vez por execução"""
+        if not hasattr(self, "_cached_system_prompt"):
+            self._cached_system_prompt = self.fallback_manager._get_personality_prompt()
+        return self._cached_system_prompt
+
+    def _known_failures(self) -> str:
+        """Falhas conhecidas atuais: fazem parte do prompt das chamadas reais"""
+        if not hasattr(self, "_cached_known_failures"):
+            self._cached_known_failures = self.fallback_manager.known_failures()
+        return self._cached_known_failures
+
+    def _is_successful(self, history: List[Dict[str, Any]],
+                       outcome: Optional[Dict[str, Any]]) -> bool:
+        """Tarefa bem-sucedida segundo o resultado final (ou o último passo, em logs antigos)"""
+        if outcome is not None:
+            return bool(outcome.get("success"))
+        return bool(history) and bool(history[-1].get("success"))
+
+    def _reconstruct_entries(self, history: List[Dict[str, Any]],
+                             outcome: Optional[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], str]]:
+        """Reconstrói (requisição do gerente, resposta) para cada passo N2 bem-sucedido"""
+        original_task = (outcome or {}).get("original_task") or history[0].get("original_task")
+        if not original_task:
+            return
+
+        level_2 = EscalationLevel.N2_LOCAL_MEMORIA.name
+        system_prompt = self._system_prompt()
+        # Mesma requisição das chamadas reais: chave exata só bate com o mesmo prompt
+        task_id = history[0].get("task_id") if history else (outcome or {}).get("outcome_of")
+        request_options = {"task_id": task_id, "known_failures": self._known_failures()}
+
+        for index, entry in enumerate(history):
+            if not entry.get("success") or entry.get("level") != level_2:
+                continue
+
+            # O prompt do passo N usa o histórico dos passos anteriores
+            answer = json.dumps(
+                {"descricao": entry.get("step_desc"), "comando": entry.get("command")},
+                ensure_ascii=False
+            )
+            yield self.fallback_manager.build_level_2_request(
+                original_task, history[:index], system_prompt, **request_options
+            ), answer
+
+        # Encerramento decidido pelo gerente com o histórico completo
+        if outcome is not None and outcome.get("final_level") == level_2:
+            answer = json.dumps(
+                {"descricao": "Tarefa concluída", "comando": None}, ensure_ascii=False
+            )
+            yield self.fallback_manager.build_level_2_request(
+                original_task, history, system_prompt, **request_options
+            ), answer
+
+    def warm_up(self, max_tasks: Optional[int] = None,
+                batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Percorre o histórico e popula o cache do gerente em lotes"""
+        stats = WarmupStats()
+
+        if not self.cache_manager.is_enabled():
+            self.logger.warning("Cache desabilitado, warm-up ignorado")
+            return asdict(stats)
+
+        max_tasks = max_tasks if max_tasks is not None else self.config.cache.warmup_max_tasks
+        batch_size = batch_size or self.config.cache.warmup_batch_size
+        pending = 0
+
+        for history, outcome in self.memory_manager.iter_task_histories(max_tasks=max_tasks):
+            stats.tasks_scanned += 1
+
+            if not self._is_successful(history, outcome):
+                continue
+            stats.tasks_successful += 1
+
+            for request, answer in self._reconstruct_entries(history, outcome):
+                try:
+                    if self.cache_manager.warm_chat("gerente", request, answer):
+                        stats.entries_warmed += 1
+                        pending += 1
+                except Exception as e:
+                    stats.errors += 1
+                    self.logger.error(f"Erro ao pré-aquecer entrada: {e}")
+
+                if pending >= batch_size:
+                    stats.batches += 1
+                    pending = 0
+                    self.cache_manager.save_stats()
+                    self.logger.info(
+                        f"Warm-up: lote {stats.batches} concluído "
+                        f"({stats.entries_warmed} entradas)"
+                    )
+
+        if pending:
+            stats.batches += 1
+            self.cache_manager.save_stats()
+
+        self.logger.info(
+            f"Warm-up concluído: {stats.entries_warmed} entradas de "
+            f"{stats.tasks_successful}/{stats.tasks_scanned} tarefas"
+        )
+        return asdict(stats)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pré-aquece o cache do GenAI Mini Framework a partir do histórico",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exemplos de uso:
+
+  # Aquecer com as 1000 tarefas padrão
+  python cache_warmup.py
+
+  # Limitar tarefas e tamanho do lote
+  python cache_warmup.py --max-tasks 200 --batch-size 50
+        """
+    )
+
+    parser.add_argument('--max-tasks', type=int, default=None,
+                        help='Máximo de tarefas a percorrer (padrão: config)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Entradas por lote (padrão: config)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Logs detalhados')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    # Import tardio: genai_mini_framework depende deste módulo
+    from genai_mini_framework import GenAIMiniFramework
+
+    try:
+        print("🚀 Inicializando framework...")
+        config = FrameworkConfig.from_env()
+        config.cache.warmup_on_start = False
+        if args.batch_size:
+            config.cache.warmup_batch_size = args.batch_size
+
+        framework = GenAIMiniFramework(config)
+
+        print("🔥 Pré-aquecendo cache...")
+        stats = framework.warm_up_cache(max_tasks=args.max_tasks)
+
+        print("✅ Warm-up concluído!")
+        print(f"  📄 Tarefas analisadas: {stats['tasks_scanned']}")
+        print(f"  🎯 Tarefas bem-sucedidas: {stats['tasks_successful']}")
+        print(f"  🗄️  Entradas no cache: {stats['entries_warmed']}")
+        print(f"  📦 Lotes: {stats['batches']}")
+
+    except KeyboardInterrupt:
+        print("\n⏹️  Operação cancelada pelo usuário")
+        sys.exit(1)
+
+    except Exception as e:
+        print(f"\n❌ Erro inesperado: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
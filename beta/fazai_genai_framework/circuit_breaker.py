@@ -0,0 +1,243 @@
+"""
+Circuit Breaker - Proteção contra Servidores Llama.cpp Indisponíveis
+Disjuntor por papel (fechado, aberto, meio-aberto) alimentado pelas chamadas
+reais e por sondagens de saúde em segundo plano, para que um servidor morto
+seja pulado de imediato em vez de custar um timeout por tarefa
+"""
+
+import time
+import logging
+import threading
+import urllib.error
+import urllib.request
+from enum import Enum
+from types import SimpleNamespace
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
+from openai import APIConnectionError, InternalServerError
+
+class CircuitState(Enum):
+    """Estados do disjuntor"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Chamada recusada porque o servidor do papel está com o circuito aberto"""
+
+    def __init__(self, role: str):
+        super().__init__(f"Servidor {role} indisponível (circuito aberto)")
+        self.role = role
+
+class CircuitBreaker:
+    """Disjuntor de um papel: abre após falhas seguidas, testa com uma chamada após o recovery"""
+
+    def __init__(self, name: str, failure_threshold: int = 3, recovery_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.logger = logging.getLogger(__name__)
+
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _transition(self, state: CircuitState):
+        if state != self._state:
+            self.logger.warning(f"Circuito {self.name}: {self._state.value} -> {state.value}")
+            self._state = state
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def _refresh(self):
+        # Aberto há mais que o recovery: libera uma chamada de teste
+        if (self._state == CircuitState.OPEN
+                and time.monotonic() - self._opened_at >= self.recovery_seconds):
+            self._transition(CircuitState.HALF_OPEN)
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def is_open(self) -> bool:
+        """True enquanto chamadas devem ser recusadas sem tentar o servidor"""
+        with self._lock:
+            self._refresh()
+            return self._state == CircuitState.OPEN or (
+                self._state == CircuitState.HALF_OPEN and self._trial_in_flight
+            )
+
+    def allow_request(self) -> bool:
+        """Reserva a chamada; no meio-aberto só uma chamada de teste por vez"""
+        with self._lock:
+            self._refresh()
+            if self._state == CircuitState.CLOSED:
+                return True
+            if self._state == CircuitState.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            self._transition(CircuitState.CLOSED)
+
+    def record_failure(self, error: str = ""):
+        with self._lock:
+            self._failures += 1
+            self._last_error = error[:200] if error else self._last_error
+            if (self._state == CircuitState.HALF_OPEN
+                    or self._failures >= self.failure_threshold):
+                self._transition(CircuitState.OPEN)
+
+    def record_probe(self, healthy: bool, error: str = ""):
+        """Resultado da sondagem: falha (já confirmada pelo prober) abre; sucesso libera o meio-aberto"""
+        with self._lock:
+            if not healthy:
+                self._last_error = error[:200] if error else self._last_error
+                self._transition(CircuitState.OPEN)
+            elif self._state == CircuitState.OPEN:
+                self._transition(CircuitState.HALF_OPEN)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            return {
+                "state": self._state.value,
+                "consecutive_failures": self._failures,
+                "last_error": self._last_error
+            }
+
+class GuardedChatClient:
+    """Cliente OpenAI que passa pelo disjuntor do papel (fica abaixo do cache)"""
+
+    def __init__(self, client, breaker: CircuitBreaker):
+        self._client = client
+        self.breaker = breaker
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def create(self, **kwargs):
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(self.breaker.name)
+
+        try:
+            response = self._client.chat.completions.create(**kwargs)
+        except (APIConnectionError, InternalServerError) as e:
+            # Timeout, conexão recusada ou 5xx: servidor indisponível/sobrecarregado
+            self.breaker.record_failure(str(e))
+            raise
+        except Exception:
+            # Erro da requisição (4xx etc.): o servidor respondeu
+            self.breaker.record_success()
+            raise
+
+        self.breaker.record_success()
+        return response
+
+def health_url(base_url: str, path: str = "/health") -> str:
+    """URL de saúde do llama.cpp: raiz do servidor, sem o sufixo /v1"""
+    root = base_url.rstrip("/")
+    if root.endswith("/v1"):
+        root = root[:-len("/v1")]
+    return root + path
+
+class HealthProber:
+    """Thread que sonda periodicamente o endpoint de saúde de cada servidor
+
+    Uma sondagem perdida (pico de carga, GC) não derruba o papel: só failure_threshold
+    falhas seguidas marcam a réplica ou o papel como indisponível.
+    """
+
+    def __init__(self, urls: Dict[str, List[str]], breakers: Dict[str, CircuitBreaker],
+                 interval_seconds: float = 10.0, timeout_seconds: float = 2.0,
+                 path: str = "/health",
+                 on_endpoint: Optional[Callable[[str, str, bool], None]] = None,
+                 failure_threshold: int = 3):
+        # URLs base por papel (uma por réplica)
+        self.urls = {role: list(role_urls) for role, role_urls in urls.items()}
+        self.breakers = breakers
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.path = path
+        self.on_endpoint = on_endpoint
+        self.failure_threshold = max(failure_threshold, 1)
+        self.logger = logging.getLogger(__name__)
+        # Falhas seguidas por réplica e por papel
+        self._url_failures: Dict[str, int] = {}
+        self._role_failures: Dict[str, int] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _probe_url(self, url: str) -> Tuple[bool, str]:
+        try:
+            with urllib.request.urlopen(health_url(url, self.path), timeout=self.timeout_seconds) as response:
+                healthy = 200 <= response.status < 300
+                return healthy, "" if healthy else f"HTTP {response.status}"
+        except urllib.error.HTTPError as e:
+            body = e.read().decode("utf-8", "replace") if e.fp else ""
+            # llama.cpp com todos os slots ocupados responde 503: vivo, apenas ocupado
+            if e.code == 503 and "no slot available" in body.lower():
+                return True, ""
+            # 503 ao carregar o modelo e demais erros HTTP
+            return False, f"HTTP {e.code}: {body[:100]}"
+        except Exception as e:
+            return False, str(e)
+
+    def _confirmed_failure(self, failures: Dict[str, int], key: str, healthy: bool) -> bool:
+        """Conta falhas seguidas; True quando atingem o limite"""
+        failures[key] = 0 if healthy else failures.get(key, 0) + 1
+        return failures[key] >= self.failure_threshold
+
+    def probe(self, role: str) -> bool:
+        """Sonda as réplicas do papel; o circuito só abre se nenhuma responde por várias sondagens"""
+        healthy_any = False
+        errors = []
+        for url in self.urls[role]:
+            healthy, error = self._probe_url(url)
+            healthy_any = healthy_any or healthy
+            if error:
+                errors.append(f"{url}: {error}")
+            if self.on_endpoint and (healthy or self._confirmed_failure(self._url_failures, url, healthy)):
+                self.on_endpoint(role, url, healthy)
+            if healthy:
+                self._url_failures[url] = 0
+
+        if healthy_any or self._confirmed_failure(self._role_failures, role, healthy_any):
+            self.breakers[role].record_probe(healthy_any, "; ".join(errors))
+        if healthy_any:
+            self._role_failures[role] = 0
+        return healthy_any
+
+    def probe_all(self):
+        for role in self.urls:
+            if role in self.breakers:
+                self.probe(role)
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            self.probe_all()
+            self._stop_event.wait(self.interval_seconds)
+
+    def start(self) -> "HealthProber":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="llama-health", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        """Encerra a thread de sondagem (espera até timeout segundos)"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout if timeout is not None else self.timeout_seconds)
+            self._thread = None
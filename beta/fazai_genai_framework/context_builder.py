@@ -0,0 +1,237 @@
+"""
+Context Builder - Contexto de Histórico com Orçamento de Tokens
+Conta tokens com um tokenizador local e cabe o histórico no orçamento do papel:
+passos antigos viram um resumo incremental (em cache) e as falhas mais
+recentes seguem na íntegra, mantendo o prefill limitado em tarefas longas
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
+
+from framework_config import ContextConfig
+
+class TokenCounter:
+    """Contagem de tokens local: tokenizer.json, vocabulário .gguf ou estimativa"""
+
+    def __init__(self, tokenizer_path: Optional[str] = None, chars_per_token: float = 3.5):
+        self.chars_per_token = chars_per_token
+        self.logger = logging.getLogger(__name__)
+        self._encode = None
+
+        if tokenizer_path:
+            try:
+                self._encode = self._load(tokenizer_path)
+                self.logger.info(f"Tokenizador local carregado de {tokenizer_path}")
+            except Exception as e:
+                self.logger.warning(f"Tokenizador indisponível ({e}); usando estimativa por caracteres")
+
+    @staticmethod
+    def _load(tokenizer_path: str):
+        if tokenizer_path.endswith(".gguf"):
+            # Mesmo vocabulário do servidor llama.cpp, sem carregar os pesos
+            from llama_cpp import Llama
+
+            model = Llama(model_path=tokenizer_path, vocab_only=True, verbose=False)
+            return lambda text: len(model.tokenize(text.encode("utf-8"), add_bos=False))
+
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(tokenizer_path)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encode:
+            return self._encode(text)
+        return int(len(text) / self.chars_per_token) + 1
+
+def _first_line(text: Optional[str], limit: int) -> str:
+    for line in (text or "").splitlines():
+        if line.strip():
+            return line.strip()[:limit]
+    return ""
+
+class ContextBuilder:
+    """Monta o contexto de histórico de uma tarefa dentro do orçamento de tokens do papel"""
+
+    def __init__(self, config: ContextConfig, counter: Optional[TokenCounter] = None):
+        self.config = config
+        self.counter = counter or TokenCounter(config.tokenizer_path, config.chars_per_token)
+        self.logger = logging.getLogger(__name__)
+        # Resumo incremental por tarefa: (linhas dos passos já resumidos, timestamp do último)
+        self._summaries: "OrderedDict[str, Tuple[List[str], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _summary_line(self, index: int, entry: Dict[str, Any]) -> str:
+        action = entry.get('command') or entry.get('step_desc') or 'N/A'
+        if entry.get('success'):
+            outcome = "OK"
+        else:
+            error = _first_line(entry.get('output'), self.config.summary_output_chars)
+            outcome = f"FALHA: {error}" if error else "FALHA"
+        return f"  {index + 1}. [{entry.get('level', 'N/A')}] {action} -> {outcome}\n"
+
+    def _summary_lines(self, original_task: str, history: List[Dict[str, Any]]) -> List[str]:
+        """Linhas de resumo de todos os passos; só os passos novos são resumidos"""
+        key = history[0].get('task_id') or original_task
+
+        with self._lock:
+            lines, last_timestamp = self._summaries.get(key, ([], None))
+            # Histórico reescrito (outra execução com a mesma chave): recomeça
+            if len(lines) > len(history) or (
+                lines and history[len(lines) - 1].get('timestamp') != last_timestamp
+            ):
+                lines = []
+
+            lines = lines + [
+                self._summary_line(i, history[i]) for i in range(len(lines), len(history))
+            ]
+            self._summaries[key] = (lines, history[-1].get('timestamp'))
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.config.summary_cache_size:
+                self._summaries.popitem(last=False)
+
+        return lines
+
+    @staticmethod
+    def _verbatim_entry(index: int, entry: Dict[str, Any], output_chars: int) -> str:
+        return (
+            f"Passo {index + 1} ({entry.get('level', 'N/A')}):\n"
+            f"  - Descrição: {entry.get('step_desc', 'N/A')}\n"
+            f"  - Comando: {entry.get('command', 'N/A')}\n"
+            f"  - Resultado: {'SUCESSO' if entry.get('success') else 'FALHA'}\n"
+            f"  - Output: {(entry.get('output') or '')[:output_chars]}...\n\n"
+        )
+
+    def _initial_verbatim(self, history: List[Dict[str, Any]]) -> List[int]:
+        """Últimos passos e falhas mais recentes, em ordem cronológica"""
+        config = self.config
+        count = len(history)
+        verbatim = set(range(max(count - config.recent_steps_verbatim, 0), count))
+
+        failures = [i for i in range(count) if not history[i].get('success')]
+        verbatim.update(failures[-config.recent_failures_verbatim:] if config.recent_failures_verbatim else [])
+        return sorted(verbatim)
+
+    def _render(self, header: str, history: List[Dict[str, Any]], summary: List[str],
+                verbatim: List[int], omitted: int, output_chars: int, extra: str) -> str:
+        verbatim_set = set(verbatim)
+        folded = [summary[i] for i in range(len(history)) if i not in verbatim_set][omitted:]
+
+        context = header
+        if folded or omitted:
+            context += "Resumo dos Passos Anteriores:\n"
+            if omitted:
+                context += f"  ... {omitted} passos mais antigos omitidos\n"
+            context += "".join(folded) + "\n"
+
+        context += "Histórico de Tentativas:\n"
+        for index in verbatim:
+            context += self._verbatim_entry(index, history[index], output_chars)
+        return context + extra
+
+    def build(self, original_task: str, history: List[Dict[str, Any]], role: str = "gerente",
+              extra: str = "") -> str:
+        """Contexto da tarefa para o papel, dentro de config.budget_for(role) tokens"""
+        header = f"Tarefa Original: {original_task}\n\n"
+        if not history:
+            return header + "Histórico de Tentativas:\nNenhuma tentativa registrada ainda.\n" + extra
+
+        config = self.config
+        budget = config.budget_for(role)
+        summary = self._summary_lines(original_task, history)
+        verbatim = self._initial_verbatim(history)
+        output_chars = config.output_chars
+        omitted = 0
+
+        while True:
+            context = self._render(header, history, summary, verbatim, omitted, output_chars, extra)
+            if self.counter.count(context) <= budget:
+                return context
+
+            folded_count = len(history) - len(verbatim) - omitted
+            successes = [i for i in verbatim[:-1] if history[i].get('success')]
+            if output_chars > config.min_output_chars:
+                # 1) Outputs na íntegra mais curtos
+                output_chars = max(output_chars // 2, config.min_output_chars)
+            elif successes:
+                # 2) Resume os sucessos íntegros (exceto o último passo)
+                verbatim.remove(successes[0])
+            elif folded_count > 0:
+                # 3) Descarta as linhas de resumo mais antigas
+                omitted += 1
+            elif len(verbatim) > 1:
+                # 4) Por fim, resume as falhas íntegras mais antigas
+                verbatim.remove(verbatim[0])
+            else:
+                self.logger.warning(
+                    f"Contexto de {role} excede o orçamento ({budget} tokens) mesmo compactado"
+                )
+                return context
+
+    def _step_turns(self, index: int, entry: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Passo como par de turnos: o passo proposto (assistant) e seu resultado (user)"""
+        step = json.dumps(
+            {"descricao": entry.get('step_desc'), "comando": entry.get('command')},
+            ensure_ascii=False
+        )
+        result = (
+            f"Passo {index + 1} ({entry.get('level', 'N/A')}): "
+            f"{'SUCESSO' if entry.get('success') else 'FALHA'}\n"
+            f"Output: {(entry.get('output') or '')[:self.config.output_chars]}"
+        )
+        return [{"role": "assistant", "content": step}, {"role": "user", "content": result}]
+
+    def _count_messages(self, messages: List[Dict[str, str]]) -> int:
+        # ~4 tokens do template de chat por mensagem
+        return sum(self.counter.count(message["content"]) + 4 for message in messages)
+
+    def _render_turns(self, original_task: str, history: List[Dict[str, Any]], summary: List[str],
+                      folded: int, omitted: int, preamble: str, tail: str) -> List[Dict[str, str]]:
+        opening = f"{preamble}Tarefa Original: {original_task}"
+        if folded:
+            opening += f"\n\nResumo dos passos 1-{folded}:\n"
+            if omitted:
+                opening += f"  ... {omitted} passos mais antigos omitidos\n"
+            opening += "".join(summary[omitted:folded])
+
+        messages = [{"role": "user", "content": opening}]
+        for index in range(folded, len(history)):
+            messages.extend(self._step_turns(index, history[index]))
+
+        messages[-1] = {"role": "user", "content": messages[-1]["content"] + tail}
+        return messages
+
+    def build_turns(self, original_task: str, history: List[Dict[str, Any]], role: str = "gerente",
+                    preamble: str = "", tail: str = "") -> List[Dict[str, str]]:
+        """Histórico como conversa que só cresce no final, para reuso do prefixo no KV cache
+
+        A tarefa abre a conversa e cada passo vira um par de turnos; só o último turno
+        (com tail) muda entre rodadas. Acima do orçamento, passos antigos são resumidos
+        em blocos de summary_block_steps, de modo que o prefixo muda só a cada bloco.
+        """
+        config = self.config
+        budget = config.budget_for(role)
+        summary = self._summary_lines(original_task, history) if history else []
+        block = max(config.summary_block_steps, 1)
+        folded = omitted = 0
+
+        while True:
+            messages = self._render_turns(original_task, history, summary, folded, omitted,
+                                          preamble, tail)
+            if self._count_messages(messages) <= budget:
+                return messages
+
+            if folded < len(history):
+                folded = min(folded + block, len(history))
+            elif omitted < folded:
+                omitted = min(omitted + block, folded)
+            else:
+                self.logger.warning(
+                    f"Contexto de {role} excede o orçamento ({budget} tokens) mesmo compactado"
+                )
+                return messages
@@ -0,0 +1,71 @@
+"""
+Deadline - Prazo de Ponta a Ponta da Tarefa
+Instante limite de uma tarefa repassado como timeout a cada chamada (LLM,
+embedding, Qdrant e shell), para que a latência de run_task tenha um teto
+"""
+
+import time
+from typing import Optional, Union
+
+class DeadlineExceeded(Exception):
+    """Prazo da tarefa esgotado antes (ou durante) uma etapa"""
+
+    def __init__(self, what: str = "tarefa"):
+        super().__init__(f"Prazo da tarefa esgotado: {what}")
+        self.what = what
+
+class Deadline:
+    """Instante limite (relógio monotônico) de uma tarefa; sem segundos, não há prazo"""
+
+    def __init__(self, seconds: Optional[float] = None, min_call_seconds: float = 0.5):
+        self.seconds = seconds
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        # Abaixo disso não vale iniciar uma chamada
+        self.min_call_seconds = min_call_seconds
+
+    @classmethod
+    def coerce(cls, deadline: Union["Deadline", float, None],
+               min_call_seconds: float = 0.5) -> "Deadline":
+        """Aceita um Deadline pronto ou segundos a partir de agora"""
+        if isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline, min_call_seconds)
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        """True quando o que resta não cobre nem uma chamada mínima"""
+        remaining = self.remaining()
+        return remaining is not None and remaining < self.min_call_seconds
+
+    def covers(self, seconds: float) -> bool:
+        remaining = self.remaining()
+        return remaining is None or remaining >= seconds
+
+    def timeout(self, default: Optional[float] = None) -> Optional[float]:
+        """Timeout de uma chamada: o menor entre o padrão e o que resta do prazo"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return remaining if default is None else min(default, remaining)
+
+    def check(self, what: str = "tarefa"):
+        if self.expired():
+            raise DeadlineExceeded(what)
+
+# Menor timeout aceito pelo Qdrant (segundos inteiros)
+MIN_WHOLE_SECONDS = 1
+
+def whole_seconds(timeout: Optional[float], what: str = "qdrant") -> Optional[int]:
+    """Timeout em segundos inteiros (Qdrant), arredondado para baixo para não passar do prazo
+
+    Com menos de 1s restante não há timeout inteiro dentro do prazo: a chamada é pulada.
+    """
+    if timeout is None:
+        return None
+    if timeout < MIN_WHOLE_SECONDS:
+        raise DeadlineExceeded(what)
+    return int(timeout)
@@ -0,0 +1,237 @@
+"""
+Endpoint Pool - Réplicas de Servidores Llama.cpp por Papel
+Distribui as chamadas de um papel entre várias instâncias com power-of-two-choices
+(ou menor número de requisições em andamento), acompanha a latência de cada uma
+por EWMA e ejeta temporariamente instâncias lentas ou inacessíveis. Com afinidade,
+as rodadas de uma tarefa vão sempre para a mesma réplica (reuso do prefixo no KV cache)
+"""
+
+import time
+import zlib
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Any, Callable
+
+from openai import APIConnectionError, InternalServerError
+
+# Estratégias de balanceamento aceitas em LlamaConfig.balancing
+BALANCING_STRATEGIES = ("p2c", "least_outstanding")
+
+class Endpoint:
+    """Uma instância do servidor: cliente, requisições em andamento e latência EWMA"""
+
+    def __init__(self, url: str, client):
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.latency_ewma: Optional[float] = None
+        self.samples = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def load(self) -> float:
+        """Custo esperado de mais uma requisição: fila * latência típica"""
+        return (self.outstanding + 1) * (self.latency_ewma or 1.0)
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "latency_ewma": self.latency_ewma,
+            "samples": self.samples,
+            "failures": self.failures,
+            "ejected": not self.available(now)
+        }
+
+class _ReleasingStream:
+    """Stream que só devolve a réplica ao terminar ou ser fechado: a geração conta como carga"""
+
+    def __init__(self, stream, on_done: Callable[[Optional[float]], None]):
+        self._stream = stream
+        self._on_done = on_done
+        self._start = time.monotonic()
+        self._done = False
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        completed = False
+        try:
+            for chunk in self._stream:
+                yield chunk
+            completed = True
+        finally:
+            # Só a geração completa vira amostra de latência; interrompida ou com erro, não
+            self._finish(time.monotonic() - self._start if completed else None)
+
+    def _finish(self, latency: Optional[float]):
+        if self._done:
+            return
+        self._done = True
+        self._on_done(latency)
+
+    def close(self):
+        close = getattr(self._stream, "close", None)
+        if close:
+            close()
+        self._finish(None)
+
+class EndpointPool:
+    """Cliente compatível com OpenAI que balanceia um papel entre réplicas"""
+
+    def __init__(self, role: str, urls: List[str], client_factory: Callable[[str], Any],
+                 balancing: str = "p2c", ewma_alpha: float = 0.3,
+                 slow_endpoint_factor: float = 3.0, min_latency_samples: int = 5,
+                 ejection_seconds: float = 30.0):
+        if balancing not in BALANCING_STRATEGIES:
+            raise ValueError(
+                f"Balanceamento desconhecido: {balancing} (use {', '.join(BALANCING_STRATEGIES)})"
+            )
+
+        self.role = role
+        self.endpoints = [Endpoint(url, client_factory(url)) for url in urls]
+        self.balancing = balancing
+        self.ewma_alpha = ewma_alpha
+        self.slow_endpoint_factor = slow_endpoint_factor
+        self.min_latency_samples = min_latency_samples
+        self.ejection_seconds = ejection_seconds
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # Réplica que atendeu a última chamada de cada thread
+        self._local = threading.local()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _candidates(self, exclude: List[Endpoint]) -> List[Endpoint]:
+        now = time.monotonic()
+        remaining = [e for e in self.endpoints if e not in exclude]
+        available = [e for e in remaining if e.available(now)]
+        # Todas ejetadas: melhor tentar a que volta primeiro do que falhar sem tentar
+        return available or sorted(remaining, key=lambda e: e.ejected_until)[:1]
+
+    def _acquire(self, exclude: List[Endpoint]) -> Optional[Endpoint]:
+        with self._lock:
+            candidates = self._candidates(exclude)
+            if not candidates:
+                return None
+
+            key = getattr(self._local, "affinity_key", None)
+            if key is not None:
+                # Rendezvous hashing: mesma réplica para a chave enquanto estiver disponível
+                endpoint = max(candidates, key=lambda e: zlib.crc32(f"{key}|{e.url}".encode("utf-8")))
+            else:
+                if self.balancing == "p2c" and len(candidates) > 2:
+                    candidates = random.sample(candidates, 2)
+                endpoint = min(candidates, key=lambda e: (e.load(), e.outstanding))
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _eject(self, endpoint: Endpoint, reason: str):
+        # Chamado com o lock; nunca ejeta a última réplica disponível
+        now = time.monotonic()
+        others = [e for e in self.endpoints if e is not endpoint and e.available(now)]
+        if not others or not endpoint.available(now):
+            return
+        endpoint.ejected_until = now + self.ejection_seconds
+        self.logger.warning(
+            f"Réplica {endpoint.url} do {self.role} ejetada por {self.ejection_seconds:.0f}s: {reason}"
+        )
+
+    @contextmanager
+    def affinity(self, key: Optional[str]):
+        """Chamadas desta thread dentro do bloco vão para a réplica fixa da chave"""
+        previous = getattr(self._local, "affinity_key", None)
+        self._local.affinity_key = key
+        try:
+            yield self
+        finally:
+            self._local.affinity_key = previous
+
+    def _release(self, endpoint: Endpoint, latency: Optional[float], failed: bool = False):
+        """Devolve a réplica; latency None (stream interrompido) não gera amostra"""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                self._eject(endpoint, "erro de conexão/servidor")
+                return
+            if latency is None:
+                return
+
+            endpoint.samples += 1
+            if endpoint.latency_ewma is None:
+                endpoint.latency_ewma = latency
+            else:
+                endpoint.latency_ewma += self.ewma_alpha * (latency - endpoint.latency_ewma)
+            self._check_slow(endpoint)
+
+    def _check_slow(self, endpoint: Endpoint):
+        """Ejeta a réplica cuja latência EWMA passa de N vezes a mediana das demais"""
+        peers = sorted(
+            e.latency_ewma for e in self.endpoints
+            if e is not endpoint and e.samples >= self.min_latency_samples
+        )
+        if endpoint.samples < self.min_latency_samples or not peers:
+            return
+
+        median = peers[len(peers) // 2]
+        if endpoint.latency_ewma > self.slow_endpoint_factor * median:
+            self._eject(endpoint, f"latência {endpoint.latency_ewma:.2f}s vs mediana {median:.2f}s")
+            # Ao voltar, a réplica recomeça a medição
+            endpoint.latency_ewma = median
+            endpoint.samples = 0
+
+    def create(self, **kwargs):
+        """chat.completions.create na réplica menos carregada; erro de rede tenta a próxima"""
+        tried: List[Endpoint] = []
+        last_error: Optional[Exception] = None
+
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise last_error or RuntimeError(f"Nenhuma réplica do {self.role} disponível")
+            tried.append(endpoint)
+
+            start = time.monotonic()
+            try:
+                response = endpoint.client.chat.completions.create(**kwargs)
+            except (APIConnectionError, InternalServerError) as e:
+                self._release(endpoint, None, failed=True)
+                last_error = e
+                continue
+            except Exception:
+                self._release(endpoint, time.monotonic() - start)
+                raise
+
+            self._local.url = endpoint.url
+            if kwargs.get("stream"):
+                # Réplica ocupada até o fim da geração; latência medida na resposta inteira
+                return _ReleasingStream(
+                    response, lambda latency, endpoint=endpoint: self._release(endpoint, latency)
+                )
+            self._release(endpoint, time.monotonic() - start)
+            return response
+
+    def served_by(self) -> Optional[str]:
+        """URL da réplica que atendeu a última chamada desta thread"""
+        return getattr(self._local, "url", None)
+
+    def mark_health(self, url: str, healthy: bool):
+        """Resultado da sondagem de uma réplica; a ejeção expira sozinha"""
+        if healthy:
+            return
+        with self._lock:
+            for endpoint in self.endpoints:
+                if endpoint.url == url:
+                    self._eject(endpoint, "sondagem de saúde falhou")
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [endpoint.to_dict(now) for endpoint in self.endpoints]
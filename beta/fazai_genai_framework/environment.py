@@ -0,0 +1,51 @@
+"""
+Environment - Impressão Digital do Ambiente de Execução
+Identifica o host/sistema para que planos e falhas só sejam reaproveitados no mesmo contexto
+"""
+
+import os
+import getpass
+import hashlib
+import platform
+from functools import lru_cache
+from typing import Dict
+
+def _read_os_release() -> Dict[str, str]:
+    """Lê /etc/os-release (ID, VERSION_ID) quando disponível"""
+    info = {}
+    try:
+        with open("/etc/os-release", "r", encoding="utf-8") as f:
+            for line in f:
+                if "=" in line:
+                    key, value = line.strip().split("=", 1)
+                    info[key] = value.strip('"')
+    except OSError:
+        pass
+    return info
+
+@lru_cache(maxsize=1)
+def describe_environment() -> Dict[str, str]:
+    """Atributos estáveis do ambiente que afetam quais comandos funcionam"""
+    os_release = _read_os_release()
+
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = "unknown"
+
+    return {
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "distro": os_release.get("ID", ""),
+        "distro_version": os_release.get("VERSION_ID", ""),
+        "hostname": platform.node(),
+        "user": user,
+        "shell": os.path.basename(os.environ.get("SHELL", "")),
+    }
+
+@lru_cache(maxsize=1)
+def get_environment_fingerprint() -> str:
+    """Hash curto e estável do ambiente"""
+    description = describe_environment()
+    raw = "|".join(f"{key}={description[key]}" for key in sorted(description))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
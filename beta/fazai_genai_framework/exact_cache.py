@@ -0,0 +1,218 @@
+"""
+Exact Cache - Cache L1 de Correspondência Exata
+Cache em processo (LRU) na frente do GPTCache, com tier opcional em disco
+"""
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from sqlite_utils import connect_sqlite
+
+# Parâmetros que não alteram a resposta do modelo e não entram na chave
+# extra_body só leva dicas ao servidor (cache_prompt, id_slot), não muda a resposta
+_IGNORED_PARAMS = {"messages", "model", "stream", "stream_options", "timeout", "request_options",
+                   "extra_headers", "extra_body", "user"}
+
+def _normalize_text(text: Any) -> Any:
+    """Colapsa espaços para que diferenças de indentação não mudem a chave"""
+    if isinstance(text, str):
+        return " ".join(text.split())
+    return text
+
+class ExactMatchCache:
+    """Cache L1 por hash de (modelo, mensagens, parâmetros) com limites LRU"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024,
+                 disk_path: Optional[str] = None, disk_max_entries: int = 50000,
+                 shared: bool = False, busy_timeout_ms: int = 5000, write_batch_size: int = 1):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        # Tier em disco compartilhado entre processos (WAL)
+        self.shared = shared
+        self.busy_timeout_ms = busy_timeout_ms
+        # Atualizações de last_access acumuladas antes de um commit
+        self.write_batch_size = max(write_batch_size, 1)
+        self.logger = logging.getLogger(__name__)
+
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk = None
+        self._pending_touches: Dict[str, float] = {}
+        self._puts_since_trim = 0
+
+        if disk_path:
+            self._initialize_disk()
+
+    @staticmethod
+    def make_key(model: Optional[str], messages: Any, params: Optional[Dict[str, Any]] = None) -> str:
+        """Gera chave estável a partir do modelo, mensagens e parâmetros"""
+        if isinstance(messages, list):
+            messages = [
+                {k: _normalize_text(v) for k, v in message.items()}
+                if isinstance(message, dict) else _normalize_text(message)
+                for message in messages
+            ]
+        else:
+            messages = _normalize_text(messages)
+
+        params = {
+            k: v for k, v in (params or {}).items()
+            if k not in _IGNORED_PARAMS and v is not None
+        }
+
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _initialize_disk(self):
+        """Abre (ou cria) o tier SQLite compartilhado"""
+        try:
+            self._disk = connect_sqlite(self.disk_path, self.shared, self.busy_timeout_ms)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS l1_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._disk.commit()
+        except Exception as e:
+            self.logger.error(f"Erro ao abrir tier em disco do cache L1: {e}")
+            self._disk = None
+
+    def get(self, key: str) -> Optional[str]:
+        """Busca resposta pela chave exata"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+
+            if self._disk is None:
+                return None
+
+            try:
+                row = self._disk.execute(
+                    "SELECT value FROM l1_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._pending_touches[key] = time.time()
+                if len(self._pending_touches) >= self.write_batch_size:
+                    self._flush_touches()
+                    self._disk.commit()
+            except Exception as e:
+                self.logger.error(f"Erro ao ler tier em disco do cache L1: {e}")
+                return None
+
+            # Promove para memória
+            self._store_in_memory(key, row[0])
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """Armazena resposta na memória e, se configurado, em disco"""
+        with self._lock:
+            self._store_in_memory(key, value)
+
+            if self._disk is None:
+                return
+
+            try:
+                self._flush_touches()
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO l1_cache (key, value, last_access) VALUES (?, ?, ?)",
+                    (key, value, time.time())
+                )
+
+                # Poda do tier em disco a cada lote de gravações
+                self._puts_since_trim += 1
+                if self._puts_since_trim >= self.write_batch_size:
+                    self._puts_since_trim = 0
+                    self._disk.execute(
+                        "DELETE FROM l1_cache WHERE key IN ("
+                        "SELECT key FROM l1_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                        (self.disk_max_entries,)
+                    )
+                self._disk.commit()
+            except Exception as e:
+                self.logger.error(f"Erro ao gravar tier em disco do cache L1: {e}")
+
+    def _flush_touches(self):
+        """Grava os acessos pendentes em uma única instrução (chamar com o lock adquirido)"""
+        if not self._pending_touches:
+            return
+        self._disk.executemany(
+            "UPDATE l1_cache SET last_access = ? WHERE key = ?",
+            [(last_access, key) for key, last_access in self._pending_touches.items()]
+        )
+        self._pending_touches.clear()
+
+    def flush(self):
+        """Persiste acessos pendentes do tier em disco"""
+        with self._lock:
+            if self._disk is None:
+                return
+            try:
+                self._flush_touches()
+                self._disk.commit()
+            except Exception as e:
+                self.logger.error(f"Erro ao gravar tier em disco do cache L1: {e}")
+
+    def _store_in_memory(self, key: str, value: str):
+        """Insere na LRU em memória respeitando os limites de entradas e bytes"""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous.encode("utf-8"))
+
+        self._entries[key] = value
+        self._bytes += size
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.encode("utf-8"))
+
+    def delete(self, key: str):
+        """Remove uma entrada da memória e do disco"""
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._bytes -= len(value.encode("utf-8"))
+
+            if self._disk is not None:
+                try:
+                    self._disk.execute("DELETE FROM l1_cache WHERE key = ?", (key,))
+                    self._disk.commit()
+                except Exception as e:
+                    self.logger.error(f"Erro ao remover entrada do cache L1: {e}")
+
+    def clear(self):
+        """Limpa memória e disco"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._pending_touches.clear()
+
+            if self._disk is not None:
+                try:
+                    self._disk.execute("DELETE FROM l1_cache")
+                    self._disk.commit()
+                except Exception as e:
+                    self.logger.error(f"Erro ao limpar tier em disco do cache L1: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
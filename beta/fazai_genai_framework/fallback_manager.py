@@ -3,9 +3,14 @@ Fallback Manager - Sistema Hierárquico de Fallback
 Gerencia os níveis de escalação conforme definido no genai_engine.py original
 """
 
+import time
 import logging
-import json
-from typing import Dict, List, Optional, Any, Tuple
+import zlib
+import threading
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Any, Tuple, Deque, Callable
 from dataclasses import dataclass
 from datetime import datetime
 
@@ -14,16 +19,77 @@ import google.generativeai as genai
 
 from framework_config import FrameworkConfig, EscalationLevel
 from memory_manager import MemoryManager
-from cache_manager import CacheManager
+from cache_manager import CacheManager, CacheTicket
+from plan_cache import PlanCache
+from negative_cache import NegativeCache
+from context_builder import ContextBuilder
+from plan_parser import StreamingPlan, extract_plan
+from plan_schema import constrain_request
+from http_transport import create_http_client, role_timeout
+from endpoint_pool import EndpointPool
+from deadline import Deadline, DeadlineExceeded
+from llm_metrics import (
+    LLMCallMetrics, LLMMetricsAggregator, MeteredStream, chat_chunk_content, genai_chunk_content
+)
+from circuit_breaker import CircuitBreaker, CircuitOpenError, GuardedChatClient, HealthProber
+
+class LevelCancelled(Exception):
+    """Nível perdedor do hedging interrompido antes de terminar"""
+
+class CancelEvent(threading.Event):
+    """Cancelamento de um nível em hedging; ao ser acionado também fecha seus streams"""
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks: List[Callable[[], None]] = []
+        self._callbacks_lock = threading.Lock()
+
+    def on_set(self, callback: Callable[[], None]):
+        """Registra callback do cancelamento (chamado já, se o nível foi cancelado)"""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.getLogger(__name__).debug(f"Erro ao fechar stream cancelado: {e}")
+
+def _check_cancelled(cancel_event: Optional[threading.Event], what: str):
+    if cancel_event is not None and cancel_event.is_set():
+        raise LevelCancelled(f"{what} cancelado (hedging)")
+
+def _stream_text(stream, content_of, cancel_event: Optional[threading.Event] = None):
+    """Texto dos chunks; interrompe (com erro) assim que o nível é cancelado"""
+    for chunk in stream:
+        _check_cancelled(cancel_event, "Stream")
+        yield content_of(chunk) or ""
+    # Stream fechado pelo cancelamento pode terminar sem erro: resposta parcial não vale
+    _check_cancelled(cancel_event, "Stream")
 
 @dataclass
 class FallbackResult:
     """Resultado de uma tentativa de fallback"""
     success: bool
     level: EscalationLevel
-    response: Optional[Dict[str, Any]]
+    # Passo (dict), lista de passos ou StreamingPlan
+    response: Optional[Any]
     error: Optional[str]
     execution_time: float
+    plan_id: Optional[str] = None
+    # Respostas LLM que originaram o plano (admissão no cache por resultado)
+    cache_tickets: Optional[List[CacheTicket]] = None
+    # Níveis que falharam antes deste resultado na mesma cadeia: (nível, segundos)
+    failed_attempts: Optional[List[Tuple[EscalationLevel, float]]] = None
+    # Métricas de cada chamada de LLM feita pela cadeia até este resultado
+    llm_calls: Optional[List[LLMCallMetrics]] = None
 
 class FallbackManager:
     """Gerenciador do sistema hierárquico de fallback"""
@@ -35,25 +101,103 @@ class FallbackManager:
         self.cache_manager = cache_manager
         self.logger = logging.getLogger(__name__)
 
+        # Cache de planos (nível N1)
+        self.plan_cache = PlanCache(config, memory_manager)
+
+        # Contexto de histórico limitado ao orçamento de tokens de cada papel
+        self.context_builder = ContextBuilder(config.context)
+
+        # Falhas conhecidas (comandos que não devem ser repetidos)
+        self.negative_cache = NegativeCache.from_config(config)
+
+        # Latência e sucesso recentes por nível (prazo do hedging)
+        window = config.hedging.history_window
+        self._level_latencies: Dict[EscalationLevel, Deque[float]] = {
+            level: deque(maxlen=window) for level in EscalationLevel
+        }
+        self._level_outcomes: Dict[EscalationLevel, Deque[bool]] = {
+            level: deque(maxlen=window) for level in EscalationLevel
+        }
+        self._level_stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.hedging.max_workers, thread_name_prefix="fallback-hedge"
+        ) if config.hedging.enabled else None
+
         # Clientes LLM
         self.llm_clients = {}
         self.genai_model = None
+        self.http_client = None
+        # Pools de réplicas (papéis com mais de uma URL)
+        self.endpoint_pools: Dict[str, EndpointPool] = {}
+        # Tokens e latências por papel de todas as chamadas
+        self.llm_metrics = LLMMetricsAggregator()
+
+        # Disjuntor por papel dos servidores Llama.cpp
+        llama = config.llama
+        self.circuit_breakers: Dict[str, CircuitBreaker] = {
+            role: CircuitBreaker(role, llama.breaker_failure_threshold, llama.breaker_recovery_seconds)
+            for role in llama.urls
+        }
+        self.health_prober = None
 
         self._initialize_clients()
 
+        if llama.health_probe_interval_seconds and self.circuit_breakers:
+            self.health_prober = HealthProber(
+                {role: llama.endpoints(role) for role in llama.urls}, self.circuit_breakers,
+                interval_seconds=llama.health_probe_interval_seconds,
+                timeout_seconds=llama.health_probe_timeout_seconds,
+                path=llama.health_probe_path,
+                on_endpoint=self._on_endpoint_health,
+                failure_threshold=llama.health_probe_failure_threshold
+            ).start()
+
+    def close(self):
+        """Para a sondagem de saúde e o executor do hedging"""
+        if self.health_prober:
+            self.health_prober.stop()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
     def _initialize_clients(self):
         """Inicializa todos os clientes LLM"""
         try:
-            # Inicializar clientes Llama.cpp locais
-            for role, url in self.config.llama.urls.items():
-                client = OpenAI(base_url=url, api_key="local")
+            # Inicializar clientes Llama.cpp locais (um transporte HTTP para todos)
+            llama = self.config.llama
+            if llama.urls:
+                self.http_client = create_http_client(llama)
+
+            for role in llama.urls:
+                urls = llama.endpoints(role)
+                client_factory = lambda url, role=role: OpenAI(
+                    base_url=url, api_key="local", http_client=self.http_client,
+                    timeout=role_timeout(llama, role), max_retries=llama.max_retries
+                )
+
+                if len(urls) > 1:
+                    # Réplicas: balanceamento por carga/latência com ejeção das lentas
+                    client = EndpointPool(
+                        role, urls, client_factory, balancing=llama.balancing,
+                        ewma_alpha=llama.latency_ewma_alpha,
+                        slow_endpoint_factor=llama.slow_endpoint_factor,
+                        min_latency_samples=llama.min_latency_samples,
+                        ejection_seconds=llama.ejection_seconds
+                    )
+                    self.endpoint_pools[role] = client
+                else:
+                    client = client_factory(urls[0])
+
+                # Disjuntor abaixo do cache: acertos continuam sendo servidos
+                client = GuardedChatClient(client, self.circuit_breakers[role])
 
                 # Aplicar cache se habilitado
                 if self.cache_manager.is_enabled():
-                    client = self.cache_manager.wrap_openai_client(client)
+                    client = self.cache_manager.wrap_openai_client(
+                        client, role=role, model=self.config.llama.models.get(role)
+                    )
 
                 self.llm_clients[role] = client
-                self.logger.info(f"Cliente {role} inicializado em {url}")
+                self.logger.info(f"Cliente {role} inicializado em {', '.join(urls)}")
 
             # Inicializar Google GenAI
             if self.config.genai.api_key:
@@ -62,7 +206,10 @@ class FallbackManager:
 
                 # Aplicar cache se habilitado
                 if self.cache_manager.is_enabled():
-                    model = self.cache_manager.wrap_genai_model(model)
+                    model = self.cache_manager.wrap_genai_model(
+                        model, role="supervisor",
+                        model_name=self.config.genai.supervisor_model
+                    )
 
                 self.genai_model = model
                 self.logger.info("Modelo GenAI supervisor inicializado")
@@ -71,14 +218,140 @@ class FallbackManager:
             self.logger.error(f"Erro ao inicializar clientes: {e}")
             raise
 
-    def _get_personality_prompt(self) -> str:
+    def _llm_client(self, role: str):
+        """Cliente do papel; falha na hora se não existe ou se o circuito está aberto"""
+        client = self.llm_clients.get(role)
+        if not client:
+            raise Exception(f"Cliente {role} não disponível")
+
+        breaker = self.circuit_breakers.get(role)
+        if breaker and breaker.is_open():
+            raise CircuitOpenError(role)
+        return client
+
+    def _on_endpoint_health(self, role: str, url: str, healthy: bool):
+        pool = self.endpoint_pools.get(role)
+        if pool:
+            pool.mark_health(url, healthy)
+
+    def get_circuit_status(self) -> Dict[str, Dict[str, Any]]:
+        """Estado do disjuntor de cada papel e das suas réplicas"""
+        status = {role: breaker.to_dict() for role, breaker in self.circuit_breakers.items()}
+        for role, pool in self.endpoint_pools.items():
+            status[role]["endpoints"] = pool.get_stats()
+        return status
+
+    def get_llm_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Tokens, tempo até o primeiro token e latência agregados por papel"""
+        return self.llm_metrics.get_stats()
+
+    def _served_endpoint(self, role: str) -> Optional[str]:
+        if role == "supervisor":
+            return "google-genai"
+        pool = self.endpoint_pools.get(role)
+        if pool:
+            return pool.served_by()
+        urls = self.config.llama.endpoints(role)
+        return urls[0] if urls else None
+
+    def _metered_call(self, role: str, level: EscalationLevel, calls: List[LLMCallMetrics],
+                      model: Optional[str], call, stream: bool = False, content_of=None,
+                      cancel_event: Optional[threading.Event] = None):
+        """Executa uma chamada de LLM registrando suas métricas em calls"""
+        _check_cancelled(cancel_event, level.name)
+        metrics = LLMCallMetrics(role=role, model=model, level=level.name, streaming=stream)
+        calls.append(metrics)
+        start = time.perf_counter()
+        try:
+            response = call()
+        except Exception as e:
+            metrics.finish(start, str(e))
+            self.llm_metrics.record(metrics)
+            raise
+
+        metrics.observe(response)
+        if not metrics.cache_hit:
+            metrics.endpoint = self._served_endpoint(role)
+
+        if stream:
+            # Métricas fecham quando o stream termina (primeiro token marcado no caminho)
+            metered = MeteredStream(response, metrics, start, content_of,
+                                    on_finish=self.llm_metrics.record)
+            if isinstance(cancel_event, CancelEvent):
+                # Perdedor do hedging: conexão fechada sem esperar o próximo chunk
+                cancel_event.on_set(metered.close)
+            return metered
+
+        metrics.finish(start)
+        self.llm_metrics.record(metrics)
+        # Resposta que chegou depois de o nível perder o hedging é descartada
+        _check_cancelled(cancel_event, level.name)
+        return response
+
+    def _chat(self, role: str, level: EscalationLevel, calls: List[LLMCallMetrics],
+              client, request: Dict[str, Any], stream: bool = False,
+              deadline: Optional[Deadline] = None,
+              cancel_event: Optional[threading.Event] = None,
+              affinity_key: Optional[str] = None):
+        """chat.completions.create medido; em streaming pede o uso de tokens no último chunk
+
+        Com prompt_cache e réplicas, affinity_key (a chave do slot da tarefa) fixa a
+        réplica para as rodadas da tarefa reaproveitarem o prefixo no KV cache.
+        """
+        if stream:
+            request = {**request, "stream": True, "stream_options": {"include_usage": True}}
+        if deadline is not None:
+            # Conexão e leitura limitadas ao que resta do prazo da tarefa
+            deadline.check(role)
+            request = {**request, "timeout": role_timeout(self.config.llama, role, deadline)}
+        pool = self.endpoint_pools.get(role)
+        if pool is not None and affinity_key and self.config.llama.prompt_cache:
+            affinity = pool.affinity(affinity_key)
+        else:
+            affinity = nullcontext()
+        with affinity:
+            return self._metered_call(
+                role, level, calls, request.get("model"),
+                lambda: client.chat.completions.create(**request), stream, chat_chunk_content,
+                cancel_event
+            )
+
+    def _ticket(self, role: str, answer: str, response: Any = None) -> CacheTicket:
+        """Ticket da resposta de um papel, usado para commit/reject no cache"""
+        if role == "supervisor":
+            model = self.config.genai.supervisor_model
+        else:
+            model = self.config.llama.models.get(role)
+        return CacheTicket(role, model, answer, getattr(response, "cache_level", None),
+                           getattr(response, "exact_key", None))
+
+    def commit_cached_responses(self, tickets: Optional[List[CacheTicket]]):
+        """Admite no cache as respostas de um plano cujo primeiro comando teve sucesso"""
+        if not tickets or not self.cache_manager.is_enabled():
+            return
+        for ticket in tickets:
+            self.cache_manager.commit_response(ticket)
+
+    def reject_cached_responses(self, tickets: Optional[List[CacheTicket]]):
+        """Remove do cache respostas que levaram a falha"""
+        if not tickets or not self.cache_manager.is_enabled():
+            return
+        for ticket in tickets:
+            self.cache_manager.reject_response(ticket)
+
+    @staticmethod
+    def _timeout(deadline: Optional[Deadline], default: Optional[float] = None) -> Optional[float]:
+        return deadline.timeout(default) if deadline is not None else default
+
+    def _get_personality_prompt(self, deadline: Optional[Deadline] = None) -> str:
         """Obtém prompt de personalidade da memória"""
         try:
             # Busca personalidade na memória
             memories = self.memory_manager.search_memories(
                 query="personalidade sistema comportamento",
                 memory_type="personality",
-                limit=1
+                limit=1,
+                timeout=self._timeout(deadline)
             )
 
             if memories:
@@ -97,63 +370,166 @@ class FallbackManager:
             self.logger.error(f"Erro ao obter personalidade: {e}")
             return "Você é um assistente prestativo."
 
-    def _build_context_from_history(self, task_id: str, original_task: str) -> str:
-        """Constrói contexto baseado no histórico da tarefa"""
+    def _load_history(self, task_id: str,
+                      deadline: Optional[Deadline] = None) -> Tuple[List[Dict[str, Any]], str]:
+        """Histórico da tarefa e resumo das falhas conhecidas para os prompts"""
+        history = self.memory_manager.get_task_history(task_id, timeout=self._timeout(deadline))
+        return history, self.known_failures()
+
+    def known_failures(self) -> str:
+        """Resumo das falhas conhecidas (cache negativo) incluído nos prompts"""
+        if not self.negative_cache:
+            return ""
+        return self.negative_cache.format_known_failures(
+            self.config.cache.negative_cache_prompt_limit
+        )
+
+    def _build_context_from_history(self, task_id: str, original_task: str,
+                                    role: str = "gerente", deadline: Optional[Deadline] = None) -> str:
+        """Constrói contexto baseado no histórico da tarefa, no orçamento de tokens do papel"""
         try:
-            history = self.memory_manager.get_task_history(task_id)
+            history, known_failures = self._load_history(task_id, deadline)
+            return self.context_builder.build(original_task, history, role, known_failures)
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self.logger.error(f"Erro ao construir contexto: {e}")
+            return f"Tarefa Original: {original_task}\n"
 
-            context = f"Tarefa Original: {original_task}\n\n"
-            context += "Histórico de Tentativas:\n"
+    def format_history_context(self, original_task: str, history: List[Dict[str, Any]],
+                               role: str = "gerente") -> str:
+        """Formata o contexto a partir de um histórico já carregado"""
+        return self.context_builder.build(original_task, history, role)
+
+    def _prompt_cache_options(self, role: str, slot_key: str) -> Optional[Dict[str, Any]]:
+        """extra_body do llama.cpp: reusa o KV cache do prefixo, no slot fixo da tarefa se configurado
+
+        Sem o número de slots do papel, fixar id_slot mandaria todas as tarefas para o
+        slot 0 (serializadas, uma evictando o prefixo da outra): o servidor escolhe o slot.
+        """
+        llama = self.config.llama
+        if not llama.prompt_cache:
+            return None
+
+        slots = llama.server_slots.get(role)
+        if not slots or slots < 1:
+            return {"cache_prompt": True}
+        return {"cache_prompt": True, "id_slot": zlib.crc32(slot_key.encode("utf-8")) % slots}
+
+    def build_level_2_request(self, original_task: str, history: List[Dict[str, Any]],
+                              system_prompt: Optional[str] = None, task_id: Optional[str] = None,
+                              known_failures: str = "") -> Dict[str, Any]:
+        """Monta a requisição do gerente (usada também pelo warm-up do cache)
+
+        Prefixo estável (personalidade, tarefa, passos já executados) e só o último
+        turno muda a cada rodada, para o llama.cpp processar apenas os tokens novos.
+        """
+        system_prompt = system_prompt or self._get_personality_prompt()
+
+        tail = (
+            f"\n\n{known_failures}"
+            "Com base no histórico, qual é o próximo passo para completar a tarefa?\n"
+            "Responda APENAS com o JSON no formato especificado."
+        )
+        turns = self.context_builder.build_turns(original_task, history, 'gerente', tail=tail)
+
+        request = {
+            "model": self.config.llama.models['gerente'],
+            "messages": [{"role": "system", "content": system_prompt}] + turns,
+            "temperature": 0.0
+        }
+
+        extra_body = self._prompt_cache_options('gerente', task_id or original_task)
+        if extra_body:
+            request["extra_body"] = extra_body
+        return constrain_request(request, "step", self.config.llama.constrained_decoding)
+
+    def _execute_level_1(self, task_id: str, original_task: str,
+                         deadline: Optional[Deadline] = None) -> FallbackResult:
+        """Nível 1: Plano completo em cache local (sem LLM)"""
+        start_time = datetime.now()
+
+        try:
+            self.logger.info("Executando Nível 1: Cache de Planos")
 
-            if not history:
-                context += "Nenhuma tentativa registrada ainda.\n"
-                return context
+            plan = self.plan_cache.lookup(original_task, timeout=self._timeout(deadline))
+            if not plan:
+                raise Exception("Nenhum plano em cache para esta tarefa")
 
-            for i, log_entry in enumerate(history):
-                context += f"Passo {i+1} ({log_entry.get('level', 'N/A')}):\n"
-                context += f"  - Descrição: {log_entry.get('step_desc', 'N/A')}\n"
-                context += f"  - Comando: {log_entry.get('command', 'N/A')}\n"
-                context += f"  - Resultado: {'SUCESSO' if log_entry.get('success') else 'FALHA'}\n"
-                context += f"  - Output: {log_entry.get('output', '')[:200]}...\n\n"
+            steps = [dict(step) for step in plan["steps"]]
+            steps.append({
+                "descricao": "Plano em cache concluído",
+                "comando": None,
+                "finalizado": True
+            })
 
-            return context
+            execution_time = (datetime.now() - start_time).total_seconds()
+
+            return FallbackResult(
+                success=True,
+                level=EscalationLevel.N1_CACHE_LOCAL,
+                response=steps,
+                error=None,
+                execution_time=execution_time,
+                plan_id=plan["id"]
+            )
 
         except Exception as e:
-            self.logger.error(f"Erro ao construir contexto: {e}")
-            return f"Tarefa Original: {original_task}\n"
+            execution_time = (datetime.now() - start_time).total_seconds()
+            self.logger.info(f"Nível 1 sem plano: {e}")
 
-    def _execute_level_2(self, task_id: str, original_task: str) -> FallbackResult:
+            return FallbackResult(
+                success=False,
+                level=EscalationLevel.N1_CACHE_LOCAL,
+                response=None,
+                error=str(e),
+                execution_time=execution_time
+            )
+
+    def record_successful_plan(self, original_task: str, steps: List[Dict[str, Any]],
+                               timeout: Optional[float] = None):
+        """Armazena a sequência de comandos de uma tarefa bem-sucedida para o nível 1"""
+        self.plan_cache.store(original_task, steps, timeout=timeout)
+
+    def invalidate_plan(self, plan_id: Optional[str]):
+        """Descarta plano em cache cuja reexecução falhou"""
+        if plan_id:
+            self.plan_cache.invalidate(plan_id)
+
+    def _execute_level_2(self, task_id: str, original_task: str,
+                         deadline: Optional[Deadline] = None,
+                         cancel_event: Optional[threading.Event] = None) -> FallbackResult:
         """Nível 2: Gerente Local + Memória Qdrant"""
         start_time = datetime.now()
+        calls: List[LLMCallMetrics] = []
 
         try:
             self.logger.info("Executando Nível 2: Gerente Local + Memória")
 
-            system_prompt = self._get_personality_prompt()
-            context = self._build_context_from_history(task_id, original_task)
-
-            user_prompt = f"""
-            {context}
+            client = self._llm_client('gerente')
 
-            Com base no histórico, qual é o próximo passo para completar a tarefa?
-            Responda APENAS com o JSON no formato especificado.
-            """
+            history, known_failures = self._load_history(task_id, deadline)
+            request = self.build_level_2_request(
+                original_task, history, self._get_personality_prompt(deadline),
+                task_id=task_id, known_failures=known_failures
+            )
 
-            client = self.llm_clients.get('gerente')
-            if not client:
-                raise Exception("Cliente gerente não disponível")
-
-            response = client.chat.completions.create(
-                model=self.config.llama.models['gerente'],
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.0
+            response = self._chat(
+                'gerente', EscalationLevel.N2_LOCAL_MEMORIA, calls, client, request,
+                deadline=deadline, cancel_event=cancel_event,
+                affinity_key=task_id or original_task
             )
 
-            result = json.loads(response.choices[0].message.content)
+            ticket = self._ticket('gerente', response.choices[0].message.content, response)
+            try:
+                steps = extract_plan(ticket.answer)
+            except (TypeError, ValueError):
+                # Saída irrecuperável nunca deve ser servida pelo cache
+                self.reject_cached_responses([ticket])
+                raise
+            result = steps[0] if len(steps) == 1 else steps
+
             execution_time = (datetime.now() - start_time).total_seconds()
 
             return FallbackResult(
@@ -161,7 +537,9 @@ class FallbackManager:
                 level=EscalationLevel.N2_LOCAL_MEMORIA,
                 response=result,
                 error=None,
-                execution_time=execution_time
+                execution_time=execution_time,
+                cache_tickets=[ticket],
+                llm_calls=calls
             )
 
         except Exception as e:
@@ -173,39 +551,50 @@ class FallbackManager:
                 level=EscalationLevel.N2_LOCAL_MEMORIA,
                 response=None,
                 error=str(e),
-                execution_time=execution_time
+                execution_time=execution_time,
+                llm_calls=calls
             )
 
-    def _execute_level_3(self, task_id: str, original_task: str) -> FallbackResult:
+    def _execute_level_3(self, task_id: str, original_task: str,
+                         cancel_event: Optional[threading.Event] = None,
+                         deadline: Optional[Deadline] = None) -> FallbackResult:
         """Nível 3: Equipe de Especialistas Local (Analista + Programador)"""
         start_time = datetime.now()
+        calls: List[LLMCallMetrics] = []
 
         try:
             self.logger.info("Executando Nível 3: Equipe de Especialistas")
 
-            context = self._build_context_from_history(task_id, original_task)
+            # Os dois servidores são necessários: pula o nível sem consultar o analista
+            analista_client = self._llm_client('analista')
+            programador_client = self._llm_client('programador')
 
-            # Passo A: Consultar Analista
-            analista_prompt = f"""
-            Você é um analista de sistemas. Um agente está com dificuldades.
+            history, known_failures = self._load_history(task_id, deadline)
 
-            {context}
-
-            Analise o histórico de falhas e forneça um diagnóstico e plano 
-            de correção em linguagem natural. Não escreva código.
-            """
+            # Passo A: Consultar Analista (mesma conversa incremental do gerente)
+            analista_turns = self.context_builder.build_turns(
+                original_task, history, 'analista',
+                preamble="Você é um analista de sistemas. Um agente está com dificuldades. "
+                         "A seguir, a tarefa e os passos que ele executou.\n\n",
+                tail=f"\n\n{known_failures}"
+                     "Analise o histórico de falhas e forneça um diagnóstico e plano "
+                     "de correção em linguagem natural. Não escreva código."
+            )
 
-            analista_client = self.llm_clients.get('analista')
-            if not analista_client:
-                raise Exception("Cliente analista não disponível")
-
-            analista_response = analista_client.chat.completions.create(
-                model=self.config.llama.models['analista'],
-                messages=[
-                    {"role": "system", "content": "Você é um analista de sistemas especializado em diagnóstico."},
-                    {"role": "user", "content": analista_prompt}
-                ],
-                temperature=0.1
+            analista_request = {
+                "model": self.config.llama.models['analista'],
+                "messages": [
+                    {"role": "system", "content": "Você é um analista de sistemas especializado em diagnóstico."}
+                ] + analista_turns,
+                "temperature": 0.1
+            }
+            extra_body = self._prompt_cache_options('analista', task_id)
+            if extra_body:
+                analista_request["extra_body"] = extra_body
+
+            analista_response = self._chat(
+                'analista', EscalationLevel.N3_EQUIPE_LOCAL, calls, analista_client, analista_request,
+                deadline=deadline, cancel_event=cancel_event, affinity_key=task_id
             )
 
             plano_analista = analista_response.choices[0].message.content
@@ -220,31 +609,52 @@ class FallbackManager:
             Plano do Analista: "{plano_analista}"
 
             Responda APENAS com a lista JSON.
-            Formato: [{"descricao": "...", "comando": "..."}, ...]
+            Formato: [{{"descricao": "...", "comando": "..."}}, ...]
             """
 
-            programador_client = self.llm_clients.get('programador')
-            if not programador_client:
-                raise Exception("Cliente programador não disponível")
-
-            programador_response = programador_client.chat.completions.create(
-                model=self.config.llama.models['programador'],
-                messages=[
+            programador_request = {
+                "model": self.config.llama.models['programador'],
+                "messages": [
                     {"role": "system", "content": "Você é um expert em shell que SÓ responde com JSON."},
                     {"role": "user", "content": programador_prompt}
-                ],
-                response_format={"type": "json_object"}
+                ]
+            }
+            extra_body = self._prompt_cache_options('programador', task_id)
+            if extra_body:
+                programador_request["extra_body"] = extra_body
+            constrain_request(programador_request, "plan", self.config.llama.constrained_decoding)
+
+            if self.config.enable_streaming:
+                stream = self._chat(
+                    'programador', EscalationLevel.N3_EQUIPE_LOCAL, calls,
+                    programador_client, programador_request, stream=True, deadline=deadline,
+                    cancel_event=cancel_event, affinity_key=task_id
+                )
+                return self._streaming_result(
+                    EscalationLevel.N3_EQUIPE_LOCAL, start_time, 'programador', stream,
+                    _stream_text(stream, chat_chunk_content, cancel_event),
+                    [self._ticket('analista', plano_analista, analista_response)], calls
+                )
+
+            programador_response = self._chat(
+                'programador', EscalationLevel.N3_EQUIPE_LOCAL, calls,
+                programador_client, programador_request, deadline=deadline,
+                cancel_event=cancel_event, affinity_key=task_id
             )
 
-            result_raw = json.loads(programador_response.choices[0].message.content)
+            tickets = [
+                self._ticket('analista', plano_analista, analista_response),
+                self._ticket(
+                    'programador', programador_response.choices[0].message.content,
+                    programador_response
+                )
+            ]
 
-            # Normalizar resultado para lista
-            if isinstance(result_raw, dict):
-                result = result_raw.get("plan", [result_raw])
-            elif isinstance(result_raw, list):
-                result = result_raw
-            else:
-                raise ValueError("Programador retornou formato inválido")
+            try:
+                result = extract_plan(tickets[1].answer)
+            except (TypeError, ValueError):
+                self.reject_cached_responses(tickets[1:])
+                raise
 
             execution_time = (datetime.now() - start_time).total_seconds()
 
@@ -253,7 +663,9 @@ class FallbackManager:
                 level=EscalationLevel.N3_EQUIPE_LOCAL,
                 response=result,
                 error=None,
-                execution_time=execution_time
+                execution_time=execution_time,
+                cache_tickets=tickets,
+                llm_calls=calls
             )
 
         except Exception as e:
@@ -265,12 +677,50 @@ class FallbackManager:
                 level=EscalationLevel.N3_EQUIPE_LOCAL,
                 response=None,
                 error=str(e),
-                execution_time=execution_time
+                execution_time=execution_time,
+                llm_calls=calls
             )
 
-    def _execute_level_4(self, task_id: str, original_task: str) -> FallbackResult:
+    def _streaming_result(self, level: EscalationLevel, start_time: datetime, role: str,
+                          stream: Any, chunks, tickets: List[CacheTicket],
+                          calls: Optional[List[LLMCallMetrics]] = None) -> FallbackResult:
+        """Plano em streaming: sucesso assim que o primeiro passo completo é validado"""
+        tickets = list(tickets)
+
+        def _on_complete(text: str):
+            # Resposta completa e válida: ticket para admissão no cache
+            tickets.append(self._ticket(role, text, stream))
+
+        plan = StreamingPlan(
+            chunks, on_complete=_on_complete, close=getattr(stream, "close", None)
+        ).start()
+
+        # Bloqueia só até o primeiro passo (ou o fim do stream)
+        if not plan:
+            self.reject_cached_responses([self._ticket(role, plan.raw_text, stream)])
+            raise ValueError(plan.error or f"Resposta do {role} sem passos válidos")
+
+        execution_time = (datetime.now() - start_time).total_seconds()
+        self.logger.info(f"Primeiro passo do {role} recebido em {execution_time:.2f}s (streaming)")
+
+        return FallbackResult(
+            success=True,
+            level=level,
+            response=plan,
+            error=None,
+            execution_time=execution_time,
+            cache_tickets=tickets,
+            llm_calls=calls
+        )
+
+    def _execute_level_4(self, task_id: str, original_task: str,
+                         deadline: Optional[Deadline] = None,
+                         cancel_event: Optional[threading.Event] = None) -> FallbackResult:
         """Nível 4: Supervisor Online (Google GenAI)"""
         start_time = datetime.now()
+        calls: List[LLMCallMetrics] = []
+        level = EscalationLevel.N4_SUPERVISOR_ONLINE
+        model = self.config.genai.supervisor_model
 
         try:
             self.logger.info("Executando Nível 4: Supervisor Online")
@@ -278,7 +728,7 @@ class FallbackManager:
             if not self.genai_model:
                 raise Exception("Modelo GenAI não disponível")
 
-            context = self._build_context_from_history(task_id, original_task)
+            context = self._build_context_from_history(task_id, original_task, 'supervisor', deadline)
 
             supervisor_prompt = f"""
             Você é um Engenheiro Sênior de DevOps.
@@ -289,17 +739,38 @@ class FallbackManager:
 
             Forneça o plano de correção definitivo, passo a passo, em JSON.
             Responda APENAS com uma lista JSON de passos no formato:
-            [{"descricao": "...", "comando": "..."}, ...]
+            [{{"descricao": "...", "comando": "..."}}, ...]
             """
 
-            response = self.genai_model.generate_content(supervisor_prompt)
-
-            # Limpar resposta (remover markdown se presente)
-            json_text = response.text.strip().lstrip("```json").rstrip("```")
-            result = json.loads(json_text)
+            options = {}
+            if deadline is not None:
+                deadline.check("supervisor")
+                options["request_options"] = {"timeout": deadline.timeout()}
+
+            if self.config.enable_streaming:
+                stream = self._metered_call(
+                    'supervisor', level, calls, model,
+                    lambda: self.genai_model.generate_content(supervisor_prompt, stream=True, **options),
+                    stream=True, content_of=genai_chunk_content, cancel_event=cancel_event
+                )
+                return self._streaming_result(
+                    level, start_time, 'supervisor', stream,
+                    _stream_text(stream, genai_chunk_content, cancel_event), [], calls
+                )
+
+            response = self._metered_call(
+                'supervisor', level, calls, model,
+                lambda: self.genai_model.generate_content(supervisor_prompt, **options),
+                cancel_event=cancel_event
+            )
 
-            if not isinstance(result, list):
-                raise ValueError("Supervisor não retornou lista JSON válida")
+            ticket = self._ticket('supervisor', response.text, response)
+            try:
+                # Cercas markdown, texto em volta e defeitos comuns são reparados
+                result = extract_plan(response.text)
+            except (TypeError, ValueError):
+                self.reject_cached_responses([ticket])
+                raise
 
             execution_time = (datetime.now() - start_time).total_seconds()
 
@@ -308,7 +779,9 @@ class FallbackManager:
                 level=EscalationLevel.N4_SUPERVISOR_ONLINE,
                 response=result,
                 error=None,
-                execution_time=execution_time
+                execution_time=execution_time,
+                cache_tickets=[ticket],
+                llm_calls=calls
             )
 
         except Exception as e:
@@ -320,39 +793,239 @@ class FallbackManager:
                 level=EscalationLevel.N4_SUPERVISOR_ONLINE,
                 response=None,
                 error=str(e),
-                execution_time=execution_time
+                execution_time=execution_time,
+                llm_calls=calls
             )
 
+    def _run_level(self, level: EscalationLevel, task_id: str, original_task: str,
+                   cancel_event: Optional[threading.Event] = None,
+                   deadline: Optional[Deadline] = None) -> Optional[FallbackResult]:
+        """Executa um nível e registra latência/sucesso para o hedging"""
+        if level == EscalationLevel.N1_CACHE_LOCAL:
+            return self._execute_level_1(task_id, original_task, deadline)
+        elif level == EscalationLevel.N2_LOCAL_MEMORIA:
+            result = self._execute_level_2(task_id, original_task, deadline, cancel_event)
+        elif level == EscalationLevel.N3_EQUIPE_LOCAL:
+            result = self._execute_level_3(task_id, original_task, cancel_event, deadline)
+        elif level == EscalationLevel.N4_SUPERVISOR_ONLINE:
+            result = self._execute_level_4(task_id, original_task, deadline, cancel_event)
+        else:
+            return None
+
+        with self._level_stats_lock:
+            self._level_latencies[level].append(result.execution_time)
+            self._level_outcomes[level].append(result.success)
+        return result
+
+    def _hedge_deadline(self) -> float:
+        """Segundos de espera por N2 antes de iniciar os níveis seguintes"""
+        hedging = self.config.hedging
+        with self._level_stats_lock:
+            outcomes = list(self._level_outcomes[EscalationLevel.N2_LOCAL_MEMORIA])
+            latencies = sorted(self._level_latencies[EscalationLevel.N2_LOCAL_MEMORIA])
+
+        if len(outcomes) < hedging.min_samples:
+            return hedging.default_deadline_seconds
+
+        # Histórico indica que N2 raramente resolve: não vale esperar
+        if outcomes.count(True) / len(outcomes) < hedging.low_success_threshold:
+            return 0.0
+
+        index = min(int(hedging.deadline_percentile * len(latencies)), len(latencies) - 1)
+        return max(latencies[index], hedging.min_deadline_seconds)
+
+    def _estimated_level_seconds(self, level: EscalationLevel) -> float:
+        """Latência mediana recente do nível (0 sem histórico)"""
+        with self._level_stats_lock:
+            latencies = sorted(self._level_latencies[level])
+        return latencies[len(latencies) // 2] if latencies else 0.0
+
+    def _fits_deadline(self, level: EscalationLevel, deadline: Optional[Deadline]) -> bool:
+        """O que resta do prazo cobre a latência típica do nível?"""
+        if deadline is None:
+            return True
+        return not deadline.expired() and deadline.covers(self._estimated_level_seconds(level))
+
+    @staticmethod
+    def _deadline_result(failed_attempts: List[Tuple[EscalationLevel, float]],
+                         llm_calls: List[LLMCallMetrics]) -> FallbackResult:
+        return FallbackResult(
+            success=False,
+            level=EscalationLevel.DESISTIR,
+            response=None,
+            error=str(DeadlineExceeded("nenhum nível restante cabe no prazo")),
+            execution_time=0.0,
+            failed_attempts=failed_attempts,
+            llm_calls=llm_calls
+        )
+
+    def _execute_hedged_chain(self, task_id: str, original_task: str,
+                              deadline: Optional[Deadline] = None) -> FallbackResult:
+        """N2 com N3 (e opcionalmente N4) especulativos: vence o primeiro plano válido"""
+        hedging = self.config.hedging
+        hedge_levels = [EscalationLevel.N3_EQUIPE_LOCAL]
+        if hedging.include_supervisor:
+            hedge_levels.append(EscalationLevel.N4_SUPERVISOR_ONLINE)
+
+        # Um evento por nível: o vencedor continua seu stream, os perdedores são fechados
+        cancel_events = {
+            level: CancelEvent() for level in [EscalationLevel.N2_LOCAL_MEMORIA] + hedge_levels
+        }
+        hedge_at = time.monotonic() + self._hedge_deadline()
+        futures = {
+            self._executor.submit(
+                self._run_level, EscalationLevel.N2_LOCAL_MEMORIA, task_id, original_task,
+                cancel_events[EscalationLevel.N2_LOCAL_MEMORIA], deadline
+            ): EscalationLevel.N2_LOCAL_MEMORIA
+        }
+        hedged = False
+        failed_attempts: List[Tuple[EscalationLevel, float]] = []
+        llm_calls: List[LLMCallMetrics] = []
+
+        while futures:
+            timeout = None if hedged else max(hedge_at - time.monotonic(), 0.0)
+            if deadline is not None:
+                timeout = deadline.timeout(timeout)
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            # Prazo da tarefa esgotado: descarta os níveis em execução
+            if not done and deadline is not None and deadline.expired():
+                for pending, pending_level in futures.items():
+                    pending.cancel()
+                    cancel_events[pending_level].set()
+                self.logger.warning("Hedging: prazo da tarefa esgotado antes de um plano válido")
+                return self._deadline_result(failed_attempts, llm_calls)
+
+            # N2 passou do prazo ou falhou: inicia os níveis seguintes em paralelo
+            if not hedged and (not done or any(not f.result().success for f in done)):
+                hedged = True
+                levels = [level for level in hedge_levels if self._fits_deadline(level, deadline)]
+                self.logger.info(
+                    f"Hedging: iniciando {', '.join(level.name for level in levels) or 'nenhum nível'} em paralelo"
+                )
+                for level in levels:
+                    futures[self._executor.submit(
+                        self._run_level, level, task_id, original_task, cancel_events[level], deadline
+                    )] = level
+
+            for future in done:
+                level = futures.pop(future)
+                result = future.result()
+
+                if result.success:
+                    # Perdedores: cancelados se não começaram, interrompidos se em execução
+                    for pending, pending_level in futures.items():
+                        pending.cancel()
+                        cancel_events[pending_level].set()
+                    self.logger.info(f"Hedging: plano do nível {level.name} venceu")
+                    result.failed_attempts = failed_attempts
+                    result.llm_calls = llm_calls + (result.llm_calls or [])
+                    return result
+
+                self.logger.warning(f"Falha no nível {level.name}: {result.error}")
+                failed_attempts.append((level, result.execution_time))
+                llm_calls.extend(result.llm_calls or [])
+
+        if not hedging.include_supervisor:
+            result = self._execute_sequential_chain(
+                task_id, original_task, EscalationLevel.N4_SUPERVISOR_ONLINE, deadline=deadline
+            )
+            result.failed_attempts = failed_attempts + (result.failed_attempts or [])
+            result.llm_calls = llm_calls + (result.llm_calls or [])
+            return result
+
+        if deadline is not None and deadline.expired():
+            return self._deadline_result(failed_attempts, llm_calls)
+
+        return FallbackResult(
+            success=False,
+            level=EscalationLevel.DESISTIR,
+            response=None,
+            error="Todos os níveis de fallback falharam",
+            execution_time=0.0,
+            failed_attempts=failed_attempts,
+            llm_calls=llm_calls
+        )
+
     def execute_fallback_chain(self, task_id: str, original_task: str, 
-                             start_level: EscalationLevel = EscalationLevel.N2_LOCAL_MEMORIA) -> FallbackResult:
-        """Executa a cadeia de fallback a partir do nível especificado"""
+                             start_level: EscalationLevel = EscalationLevel.N2_LOCAL_MEMORIA,
+                             llm_start_level: EscalationLevel = EscalationLevel.N2_LOCAL_MEMORIA,
+                             deadline: Optional[Deadline] = None) -> FallbackResult:
+        """Executa a cadeia de fallback a partir do nível especificado
+
+        llm_start_level: primeiro nível com LLM após o cache de planos (roteamento)
+        deadline: prazo da tarefa; níveis que não cabem no que resta são pulados
+        """
+        hedge_from_n2 = llm_start_level == EscalationLevel.N2_LOCAL_MEMORIA
+
+        if self.config.hedging.enabled and hedge_from_n2 and start_level == EscalationLevel.N2_LOCAL_MEMORIA:
+            return self._execute_hedged_chain(task_id, original_task, deadline)
+
+        if self.config.hedging.enabled and hedge_from_n2 and start_level == EscalationLevel.N1_CACHE_LOCAL:
+            result = self._run_level(start_level, task_id, original_task, deadline=deadline)
+            if result.success:
+                return result
+            self.logger.info(f"Nível 1 sem plano: {result.error}")
+            chained = self._execute_hedged_chain(task_id, original_task, deadline)
+            chained.failed_attempts = [(result.level, result.execution_time)] + (chained.failed_attempts or [])
+            return chained
+
+        return self._execute_sequential_chain(
+            task_id, original_task, start_level, llm_start_level, deadline
+        )
+
+    @staticmethod
+    def _escalate(level: EscalationLevel, llm_start_level: EscalationLevel) -> EscalationLevel:
+        if level == EscalationLevel.N1_CACHE_LOCAL:
+            return llm_start_level
+        elif level == EscalationLevel.N2_LOCAL_MEMORIA:
+            return EscalationLevel.N3_EQUIPE_LOCAL
+        elif level == EscalationLevel.N3_EQUIPE_LOCAL:
+            return EscalationLevel.N4_SUPERVISOR_ONLINE
+        return EscalationLevel.DESISTIR
+
+    def _execute_sequential_chain(self, task_id: str, original_task: str,
+                                  start_level: EscalationLevel,
+                                  llm_start_level: EscalationLevel = EscalationLevel.N2_LOCAL_MEMORIA,
+                                  deadline: Optional[Deadline] = None) -> FallbackResult:
+        """Cadeia clássica: um nível por vez, escalando a cada falha"""
 
         current_level = start_level
+        failed_attempts: List[Tuple[EscalationLevel, float]] = []
+        llm_calls: List[LLMCallMetrics] = []
+        skipped = False
 
         while current_level != EscalationLevel.DESISTIR:
+            # Nível cuja latência típica não cabe no prazo: tenta o seguinte
+            if not self._fits_deadline(current_level, deadline):
+                self.logger.warning(
+                    f"Prazo insuficiente para o nível {current_level.name} "
+                    f"({deadline.remaining():.1f}s restantes): pulando"
+                )
+                skipped = True
+                current_level = self._escalate(current_level, llm_start_level)
+                continue
+
             self.logger.info(f"Tentando nível {current_level.name}")
 
-            if current_level == EscalationLevel.N2_LOCAL_MEMORIA:
-                result = self._execute_level_2(task_id, original_task)
-            elif current_level == EscalationLevel.N3_EQUIPE_LOCAL:
-                result = self._execute_level_3(task_id, original_task)
-            elif current_level == EscalationLevel.N4_SUPERVISOR_ONLINE:
-                result = self._execute_level_4(task_id, original_task)
-            else:
+            result = self._run_level(current_level, task_id, original_task, deadline=deadline)
+            if result is None:
                 break
 
             if result.success:
                 self.logger.info(f"Sucesso no nível {current_level.name}")
+                result.failed_attempts = failed_attempts
+                result.llm_calls = llm_calls + (result.llm_calls or [])
                 return result
             else:
                 self.logger.warning(f"Falha no nível {current_level.name}: {result.error}")
+                failed_attempts.append((current_level, result.execution_time))
+                llm_calls.extend(result.llm_calls or [])
                 # Escalar para próximo nível
-                if current_level == EscalationLevel.N2_LOCAL_MEMORIA:
-                    current_level = EscalationLevel.N3_EQUIPE_LOCAL
-                elif current_level == EscalationLevel.N3_EQUIPE_LOCAL:
-                    current_level = EscalationLevel.N4_SUPERVISOR_ONLINE
-                elif current_level == EscalationLevel.N4_SUPERVISOR_ONLINE:
-                    current_level = EscalationLevel.DESISTIR
+                current_level = self._escalate(current_level, llm_start_level)
+
+        if skipped or (deadline is not None and deadline.expired()):
+            return self._deadline_result(failed_attempts, llm_calls)
 
         # Todos os níveis falharam
         return FallbackResult(
@@ -360,5 +1033,7 @@ class FallbackManager:
             level=EscalationLevel.DESISTIR,
             response=None,
             error="Todos os níveis de fallback falharam",
-            execution_time=0.0
+            execution_time=0.0,
+            failed_attempts=failed_attempts,
+            llm_calls=llm_calls
         )
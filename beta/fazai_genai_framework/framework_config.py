@@ -4,7 +4,7 @@ Baseado no código genai_engine.py fornecido, com melhorias e automação
 """
 
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 from dataclasses import dataclass
 from enum import Enum
 
@@ -16,16 +16,55 @@ class QdrantConfig:
     collection_logs: str = "fazai_logs_execucao"
     collection_memories: str = "fz_memories"
     collection_personality: str = "fazai_personalidade"
+    collection_plans: str = "fazai_planos"
     embedding_model: str = "models/text-embedding-004"
     embedding_dim: int = 768
 
 @dataclass
 class LlamaConfig:
     """Configurações dos servidores Llama.cpp"""
-    urls: Dict[str, str] = None
+    # URL por papel, ou lista de URLs de réplicas balanceadas
+    urls: Dict[str, Union[str, List[str]]] = None
     models: Dict[str, str] = None
+    # Réplicas: p2c (power-of-two-choices) ou least_outstanding; ejeção de réplicas lentas
+    balancing: str = "p2c"
+    latency_ewma_alpha: float = 0.3
+    slow_endpoint_factor: float = 3.0
+    min_latency_samples: int = 5
+    ejection_seconds: float = 30.0
+    # Sondagem de saúde (0 desativa) e disjuntor por papel
+    health_probe_interval_seconds: float = 10.0
+    health_probe_timeout_seconds: float = 2.0
+    health_probe_path: str = "/health"
+    # Sondagens seguidas com falha até marcar réplica/papel como fora
+    health_probe_failure_threshold: int = 3
+    breaker_failure_threshold: int = 3
+    breaker_recovery_seconds: float = 30.0
+    # Transporte HTTP compartilhado por todos os papéis
+    connect_timeout_seconds: float = 2.0
+    read_timeout_seconds: float = 120.0
+    # Timeout de leitura por papel (sobrepõe read_timeout_seconds)
+    role_read_timeouts: Dict[str, float] = None
+    max_connections: int = 16
+    max_keepalive_connections: int = 8
+    keepalive_expiry_seconds: float = 30.0
+    # HTTP/2 só é usado se o pacote h2 estiver instalado
+    http2: bool = True
+    max_retries: int = 1
+    # Reuso do prefixo do prompt no KV cache do llama.cpp, com cada tarefa fixa em um slot
+    prompt_cache: bool = True
+    # Slots por servidor (--parallel do llama.cpp); papel ausente: o servidor escolhe o slot
+    server_slots: Dict[str, int] = None
+    # Saída dos planejadores restrita ao formato de passo: json_schema, grammar (GBNF) ou none
+    constrained_decoding: str = "json_schema"
 
     def __post_init__(self):
+        if self.server_slots is None:
+            self.server_slots = {}
+        if self.role_read_timeouts is None:
+            self.role_read_timeouts = {
+                "gerente": 60.0
+            }
         if self.urls is None:
             self.urls = {
                 "gerente": "http://localhost:8000/v1",
@@ -39,6 +78,11 @@ class LlamaConfig:
                 "programador": "CodeGemma-7B.gguf"
             }
 
+    def endpoints(self, role: str) -> List[str]:
+        """URLs das réplicas do papel"""
+        urls = self.urls.get(role) or []
+        return [urls] if isinstance(urls, str) else list(urls)
+
 @dataclass
 class GenAIConfig:
     """Configurações do Google GenAI"""
@@ -50,8 +94,176 @@ class GenAIConfig:
 class CacheConfig:
     """Configurações do GPTCache"""
     db_file: str = "fazai_cache.db"
+    data_dir: str = "."
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
     similarity_threshold: float = 0.98
+    # Thresholds por papel (gerente, analista, programador, supervisor)
+    role_thresholds: Dict[str, float] = None
+
+    # Chaves de cache sobre a forma canônica do prompt (sem partes voláteis)
+    canonicalize_prompts: bool = True
+
+    # Store vetorial: "faiss_flat" (FAISS plano, busca exaustiva), "hnswlib" ou "faiss" (HNSW persistido)
+    vector_store: str = "faiss_flat"
+    ann_max_elements: int = 100000
+    ann_ef_search: int = 64
+    # Índice FAISS existente é carregado via mmap (partida rápida)
+    ann_mmap: bool = True
+    # Reconstrói o índice ANN quando removidos >= ratio * armazenados
+    ann_rebuild_ratio: float = 0.2
+
+    # Modo compartilhado: vários processos usam os mesmos arquivos (SQLite em WAL)
+    shared_mode: bool = False
+    sqlite_busy_timeout_ms: int = 5000
+    shared_write_batch_size: int = 32
+
+    # Admissão por resultado: só entra no cache resposta que parseou e cujo
+    # primeiro comando teve sucesso; provisórias sem desfecho expiram
+    outcome_admission: bool = True
+    provisional_ttl_seconds: float = 600.0
+
+    # Ajuste online do threshold por papel a partir do desfecho dos acertos semânticos
+    threshold_autotune: bool = True
+    autotune_min_threshold: float = 0.90
+    autotune_max_threshold: float = 0.995
+    autotune_step: float = 0.005
+    autotune_window: int = 50
+    autotune_min_samples: int = 20
+    # Banda morta (histerese): sobe acima de high, desce abaixo de low
+    autotune_false_hit_low: float = 0.01
+    autotune_false_hit_high: float = 0.05
+
+    # Cache L1 de correspondência exata (na frente do GPTCache)
+    l1_enabled: bool = True
+    l1_max_entries: int = 1024
+    l1_max_bytes: int = 16 * 1024 * 1024
+    l1_disk_tier: bool = False
+
+    # Persistência das estatísticas (hits, latências) entre reinícios
+    stats_file: str = "fazai_cache_stats.json"
+    stats_save_interval: int = 50
+
+    # Warm-up a partir do histórico de execuções bem-sucedidas
+    warmup_on_start: bool = False
+    warmup_max_tasks: int = 1000
+    warmup_batch_size: int = 100
+
+    # Nível N1: cache de planos completos (sem chamadas LLM)
+    plan_cache_enabled: bool = True
+    plan_similarity_threshold: float = 0.95
+
+    # Cache negativo: comandos que falharam neste ambiente
+    negative_cache_enabled: bool = True
+    negative_cache_file: str = "fazai_negative_cache.db"
+    negative_cache_ttl_seconds: Optional[float] = 24 * 3600.0
+    # Falhas conhecidas exibidas no contexto dos planejadores
+    negative_cache_prompt_limit: int = 10
+
+    # Limites do cache semântico (por namespace), TTL e evicção
+    max_entries: Optional[int] = 10000
+    max_bytes: Optional[int] = 64 * 1024 * 1024
+    eviction_policy: str = "lru"  # "lru", "lfu" ou "cost_aware"
+    ttl_seconds: Optional[float] = None
+    role_ttls: Dict[str, float] = None
+    # Peso do custo por papel na política cost_aware
+    cost_weights: Dict[str, float] = None
+    # Recompacta o store quando removidas >= ratio * vivas
+    compaction_ratio: float = 0.25
+    vacuum_interval_seconds: Optional[float] = 3600.0
+    # Varredura periódica de TTL/limites/VACUUM em segundo plano (None desativa)
+    maintenance_interval_seconds: Optional[float] = 300.0
+    # Acessos ao índice (last_access/hits) gravados em lote, fora do caminho do acerto
+    index_write_batch_size: int = 32
+
+    def __post_init__(self):
+        if self.role_thresholds is None:
+            self.role_thresholds = {}
+        if self.role_ttls is None:
+            self.role_ttls = {}
+        if self.cost_weights is None:
+            self.cost_weights = {
+                "gerente": 1.0,
+                "analista": 2.0,
+                "programador": 2.0,
+                "supervisor": 10.0
+            }
+
+    def threshold_for(self, role: str) -> float:
+        """Threshold de similaridade efetivo para um papel"""
+        return self.role_thresholds.get(role, self.similarity_threshold)
+
+@dataclass
+class HedgingConfig:
+    """Execução especulativa (hedging) entre níveis de escalação"""
+    enabled: bool = False
+    # N3 começa em paralelo se N2 não responder até este percentil da sua latência
+    deadline_percentile: float = 0.9
+    default_deadline_seconds: float = 10.0
+    min_deadline_seconds: float = 1.0
+    min_samples: int = 20
+    # Taxa de sucesso recente de N2 abaixo da qual N3 começa imediatamente
+    low_success_threshold: float = 0.3
+    # Incluir o supervisor online (N4) no hedge
+    include_supervisor: bool = False
+    history_window: int = 200
+    max_workers: int = 3
+
+@dataclass
+class RoutingConfig:
+    """Roteamento adaptativo do nível inicial a partir de tarefas similares"""
+    enabled: bool = True
+    neighbors: int = 20
+    min_similarity: float = 0.85
+    # Peso mínimo (soma das similaridades) de tarefas similares para sair do padrão
+    min_samples: float = 5.0
+    min_savings_seconds: float = 1.0
+    # Suavização bayesiana da taxa de sucesso por nível
+    prior_success: float = 0.5
+    prior_weight: float = 1.0
+    # Latência assumida de um nível sem histórico
+    default_level_seconds: Dict[str, float] = None
+    # Custo atribuído a desistir após o último nível
+    failure_penalty_seconds: float = 120.0
+    # Começar direto no supervisor online (N4) gasta cota paga
+    allow_supervisor_start: bool = False
+
+    def __post_init__(self):
+        if self.default_level_seconds is None:
+            self.default_level_seconds = {
+                "N2_LOCAL_MEMORIA": 5.0,
+                "N3_EQUIPE_LOCAL": 20.0,
+                "N4_SUPERVISOR_ONLINE": 15.0
+            }
+
+@dataclass
+class ContextConfig:
+    """Orçamento de tokens do contexto de histórico enviado aos papéis"""
+    # Tokens do bloco de contexto por papel (servidores locais rodam com n_ctx 4096)
+    role_budgets: Dict[str, int] = None
+    default_budget_tokens: int = 1800
+    # Passos finais e falhas mais recentes mantidos na íntegra
+    recent_steps_verbatim: int = 3
+    recent_failures_verbatim: int = 2
+    output_chars: int = 200
+    min_output_chars: int = 60
+    summary_output_chars: int = 80
+    # Passos resumidos em blocos para o prefixo da conversa mudar raramente (KV cache)
+    summary_block_steps: int = 5
+    # tokenizer.json (HF) ou modelo .gguf (vocab_only); sem ele, estimativa por caracteres
+    tokenizer_path: Optional[str] = None
+    chars_per_token: float = 3.5
+    summary_cache_size: int = 256
+
+    def __post_init__(self):
+        if self.role_budgets is None:
+            self.role_budgets = {
+                "gerente": 1800,
+                "analista": 1800,
+                "supervisor": 6000
+            }
+
+    def budget_for(self, role: str) -> int:
+        return self.role_budgets.get(role, self.default_budget_tokens)
 
 @dataclass  
 class ClaudeConfig:
@@ -76,13 +288,23 @@ class FrameworkConfig:
     genai: GenAIConfig = None
     cache: CacheConfig = None
     claude: ClaudeConfig = None
+    hedging: HedgingConfig = None
+    context: ContextConfig = None
+    routing: RoutingConfig = None
 
     # Configurações gerais
     max_steps: int = 30
     timeout_seconds: int = 30
+    # Prazo de ponta a ponta de run_task (None: sem prazo) e tempo mínimo para iniciar uma chamada
+    task_deadline_seconds: Optional[float] = None
+    deadline_min_call_seconds: float = 0.5
+    # Gravação do desfecho e do plano na memória: timeout próprio, fora do prazo da tarefa
+    persistence_timeout_seconds: float = 10.0
     log_level: str = "INFO"
     enable_cache: bool = True
     enable_fallback: bool = True
+    # Planos de programador/supervisor lidos em streaming, passo a passo
+    enable_streaming: bool = True
 
     def __post_init__(self):
         if self.qdrant is None:
@@ -93,8 +315,14 @@ class FrameworkConfig:
             self.genai = GenAIConfig()
         if self.cache is None:
             self.cache = CacheConfig()
+        if self.context is None:
+            self.context = ContextConfig()
+        if self.routing is None:
+            self.routing = RoutingConfig()
         if self.claude is None:
             self.claude = ClaudeConfig()
+        if self.hedging is None:
+            self.hedging = HedgingConfig()
 
     @classmethod
     def from_env(cls) -> 'FrameworkConfig':
@@ -110,6 +338,27 @@ class FrameworkConfig:
 
         # Cache
         config.cache.db_file = os.getenv('CACHE_DB_FILE', 'fazai_cache.db')
+        config.cache.data_dir = os.getenv('CACHE_DATA_DIR', '.')
+        config.cache.l1_disk_tier = os.getenv('CACHE_L1_DISK', 'false').lower() == 'true'
+        config.cache.shared_mode = os.getenv('CACHE_SHARED_MODE', 'false').lower() == 'true'
+        config.cache.warmup_on_start = os.getenv('CACHE_WARMUP_ON_START', 'false').lower() == 'true'
+        config.cache.eviction_policy = os.getenv('CACHE_EVICTION_POLICY', 'lru')
+        config.cache.vector_store = os.getenv('CACHE_VECTOR_STORE', 'faiss_flat')
+        if os.getenv('CACHE_TTL_SECONDS'):
+            config.cache.ttl_seconds = float(os.getenv('CACHE_TTL_SECONDS'))
+        if os.getenv('CACHE_MAINTENANCE_INTERVAL'):
+            config.cache.maintenance_interval_seconds = float(os.getenv('CACHE_MAINTENANCE_INTERVAL'))
+
+        # Sondagem de saúde dos servidores Llama.cpp
+        if os.getenv('LLAMA_HEALTH_PROBE_INTERVAL'):
+            config.llama.health_probe_interval_seconds = float(os.getenv('LLAMA_HEALTH_PROBE_INTERVAL'))
+
+        # Prazo de ponta a ponta das tarefas
+        if os.getenv('TASK_DEADLINE_SECONDS'):
+            config.task_deadline_seconds = float(os.getenv('TASK_DEADLINE_SECONDS'))
+
+        # Hedging entre níveis
+        config.hedging.enabled = os.getenv('HEDGING_ENABLED', 'false').lower() == 'true'
 
         return config
 
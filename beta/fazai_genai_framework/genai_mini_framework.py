@@ -4,14 +4,17 @@ Framework completo com integração Qdrant, GPTCache, Claude, llama.cpp e Google
 Baseado no genai_engine.py original com melhorias e automação
 """
 
+import atexit
 import subprocess
 import json
 import uuid
 import os
 import logging
-from typing import Dict, List, Optional, Any, Tuple
+import threading
+import time
+from typing import Dict, List, Optional, Any, Tuple, Union
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 
 # Imports do framework
 from framework_config import FrameworkConfig, EscalationLevel
@@ -19,6 +22,11 @@ from memory_manager import MemoryManager
 from cache_manager import CacheManager
 from fallback_manager import FallbackManager
 from claude_integration import ClaudeIntegration
+from cache_warmup import CacheWarmer
+from plan_parser import StreamingPlan
+from level_router import LevelRouter, RoutingDecision, record_level_attempt
+from llm_metrics import LLMCallMetrics
+from deadline import Deadline, DeadlineExceeded
 
 @dataclass
 class TaskResult:
@@ -29,6 +37,12 @@ class TaskResult:
     final_level: EscalationLevel
     execution_time: float
     error: Optional[str] = None
+    # Decisão do roteador (nível inicial, estimativas e economia esperada)
+    routing: Optional[Dict[str, Any]] = None
+    # Tentativas, sucessos e segundos por nível nesta execução
+    level_stats: Optional[Dict[str, Dict[str, float]]] = None
+    # Métricas de cada chamada de LLM (tokens, TTFT, prefill/decode, cache, réplica)
+    llm_calls: Optional[List[Dict[str, Any]]] = None
 
 class GenAIMiniFramework:
     """Framework principal - versão melhorada do FazAIAgent"""
@@ -46,6 +60,7 @@ class GenAIMiniFramework:
         self.memory_manager = None
         self.cache_manager = None  
         self.fallback_manager = None
+        self.level_router = None
         self.claude_integration = None
 
         # Estado
@@ -80,6 +95,11 @@ class GenAIMiniFramework:
                 self.memory_manager, 
                 self.cache_manager
             )
+            # Sondagem de saúde e executor do hedging param ao sair
+            atexit.register(self.shutdown)
+
+            # Roteamento do nível inicial a partir de tarefas similares
+            self.level_router = LevelRouter(self.config, self.memory_manager)
 
             # 4. Claude Integration
             self.logger.info("Inicializando Claude Integration...")
@@ -91,12 +111,20 @@ class GenAIMiniFramework:
             self.initialized = True
             self.logger.info("=== Framework inicializado com sucesso ===")
 
+            # 5. Warm-up do cache em segundo plano (opcional)
+            if self.config.cache.warmup_on_start and self.cache_manager.is_enabled():
+                self.logger.info("Iniciando warm-up do cache em segundo plano...")
+                threading.Thread(
+                    target=self.warm_up_cache, name="cache-warmup", daemon=True
+                ).start()
+
         except Exception as e:
             self.logger.error(f"Erro ao inicializar framework: {e}")
             raise
 
-    def _execute_command(self, command: str) -> Tuple[bool, str]:
-        """Executa comando no sistema com segurança melhorada"""
+    def _execute_command(self, command: str, timeout: Optional[float] = None) -> Tuple[bool, str]:
+        """Executa comando no sistema com segurança melhorada (timeout: padrão timeout_seconds)"""
+        timeout = self.config.timeout_seconds if timeout is None else timeout
         self.logger.info(f"Executando: {command}")
 
         try:
@@ -116,7 +144,7 @@ class GenAIMiniFramework:
                 shell=True,
                 capture_output=True,
                 text=True,
-                timeout=self.config.timeout_seconds,
+                timeout=timeout,
                 check=False
             )
 
@@ -130,7 +158,7 @@ class GenAIMiniFramework:
                 return False, output
 
         except subprocess.TimeoutExpired:
-            error_msg = f"Comando excedeu timeout de {self.config.timeout_seconds}s"
+            error_msg = f"Comando excedeu timeout de {timeout:.0f}s"
             self.logger.error(error_msg)
             return False, error_msg
 
@@ -139,12 +167,54 @@ class GenAIMiniFramework:
             self.logger.error(error_msg)
             return False, error_msg
 
-    def run_task(self, task_description: str, max_steps: Optional[int] = None) -> TaskResult:
-        """Executa uma tarefa usando o sistema hierárquico"""
+    def run_task(self, task_description: str, max_steps: Optional[int] = None,
+                 deadline: Union[Deadline, float, None] = None) -> TaskResult:
+        """Executa uma tarefa usando o sistema hierárquico
+
+        deadline: segundos (ou Deadline) para a tarefa inteira; padrão task_deadline_seconds.
+        O que resta do prazo vira o timeout de cada chamada de LLM, embedding, Qdrant e shell.
+        """
 
         if not self.initialized:
             raise RuntimeError("Framework não foi inicializado")
 
+        deadline = Deadline.coerce(
+            self.config.task_deadline_seconds if deadline is None else deadline,
+            self.config.deadline_min_call_seconds
+        )
+
+        try:
+            routing = self.level_router.route(task_description, timeout=deadline.timeout())
+        except Exception as e:
+            self.logger.warning(f"Roteamento indisponível, iniciando no nível padrão: {e}")
+            routing = RoutingDecision(EscalationLevel.N2_LOCAL_MEMORIA.name, reason=f"erro: {e}")
+        level_stats: Dict[str, Dict[str, float]] = {}
+        llm_calls: List[LLMCallMetrics] = []
+
+        result = self._run_task(task_description, max_steps, routing.level, level_stats, llm_calls,
+                                deadline)
+        result.routing = asdict(routing)
+        result.level_stats = level_stats
+        result.llm_calls = [metrics.to_dict() for metrics in llm_calls]
+
+        # Resultado final alimenta warm-up do cache, estatísticas por tarefa e o roteador;
+        # tarefas que estouraram o prazo também são registradas (timeout próprio)
+        self.memory_manager.store_task_outcome(
+            result.task_id, task_description, result.success,
+            result.final_level, result.steps_executed, result.execution_time,
+            level_stats=level_stats, routing=result.routing,
+            timeout=self.config.persistence_timeout_seconds
+        )
+
+        return result
+
+    def _run_task(self, task_description: str, max_steps: Optional[int],
+                  start_level: EscalationLevel = EscalationLevel.N2_LOCAL_MEMORIA,
+                  level_stats: Optional[Dict[str, Dict[str, float]]] = None,
+                  llm_calls: Optional[List[LLMCallMetrics]] = None,
+                  deadline: Optional[Deadline] = None) -> TaskResult:
+        """Laço principal de planejamento e execução de uma tarefa"""
+
         task_id = f"task_{uuid.uuid4().hex[:8]}"
         start_time = datetime.now()
         max_steps = max_steps or self.config.max_steps
@@ -152,13 +222,36 @@ class GenAIMiniFramework:
         self.logger.info(f"=== Iniciando tarefa {task_id} ===")
         self.logger.info(f"Descrição: {task_description}")
 
-        # Fila de comandos e estado
+        if level_stats is None:
+            level_stats = {}
+        if llm_calls is None:
+            llm_calls = []
+        if deadline is None:
+            deadline = Deadline()
+
+        # Fila de comandos e estado; start_level é o primeiro nível com LLM (roteador)
         task_queue = []
-        current_level = EscalationLevel.N2_LOCAL_MEMORIA
+        if self.fallback_manager.plan_cache.is_enabled():
+            current_level = EscalationLevel.N1_CACHE_LOCAL
+        else:
+            current_level = start_level
         steps_executed = 0
 
+        # Passos bem-sucedidos (alimentam o cache de planos) e plano em reexecução
+        successful_steps = []
+        last_success_at = None
+        replaying_plan_id = None
+
+        # Respostas LLM do plano atual, admitidas no cache após o primeiro sucesso
+        plan_tickets = None
+        plan_committed = False
+        # Desfecho do plano atual ainda não contabilizado nas estatísticas do nível
+        plan_outcome_pending = False
+
         try:
             while steps_executed < max_steps:
+                # Sem tempo para mais um passo: falha rápida em vez de estourar o prazo
+                deadline.check(f"{steps_executed} passos executados")
                 steps_executed += 1
 
                 # Se fila vazia, precisa de novo plano
@@ -166,9 +259,13 @@ class GenAIMiniFramework:
                     self.logger.info(f"Solicitando plano do nível {current_level.name}")
 
                     fallback_result = self.fallback_manager.execute_fallback_chain(
-                        task_id, task_description, current_level
+                        task_id, task_description, current_level, start_level, deadline
                     )
 
+                    for failed_level, seconds in fallback_result.failed_attempts or []:
+                        record_level_attempt(level_stats, failed_level, seconds, success=False)
+                    llm_calls.extend(fallback_result.llm_calls or [])
+
                     if not fallback_result.success:
                         if fallback_result.level == EscalationLevel.DESISTIR:
                             # Todos os níveis falharam
@@ -179,24 +276,42 @@ class GenAIMiniFramework:
                                 steps_executed=steps_executed,
                                 final_level=fallback_result.level,
                                 execution_time=execution_time,
-                                error="Todos os níveis de fallback falharam"
+                                error=fallback_result.error or "Todos os níveis de fallback falharam"
                             )
                         else:
                             # Escalar nível
-                            current_level = self._get_next_level(current_level)
+                            current_level = self._get_next_level(current_level, start_level)
                             continue
 
+                    # Plano do cache (N1) ou de LLM a partir do nível que respondeu
+                    current_level = fallback_result.level
+                    replaying_plan_id = fallback_result.plan_id
+                    plan_tickets = fallback_result.cache_tickets
+                    plan_committed = False
+                    record_level_attempt(level_stats, current_level, fallback_result.execution_time)
+                    plan_outcome_pending = True
+
                     # Processar resposta do fallback
                     response = fallback_result.response
-                    if isinstance(response, list):
+                    if isinstance(response, (list, StreamingPlan)):
+                        # Plano em streaming: passos chegam enquanto os primeiros executam
                         task_queue = response
                     elif isinstance(response, dict):
                         task_queue = [response]
                     else:
                         self.logger.error(f"Resposta inválida do fallback: {type(response)}")
-                        current_level = self._get_next_level(current_level)
+                        record_level_attempt(level_stats, current_level, success=False)
+                        plan_outcome_pending = False
+                        current_level = self._get_next_level(current_level, start_level)
                         continue
 
+                # Plano em streaming: espera o próximo passo só até o fim do prazo
+                if (isinstance(task_queue, StreamingPlan) and deadline.remaining() is not None
+                        and not task_queue.wait_for_step(deadline.timeout())
+                        and not task_queue.finished):
+                    task_queue.clear()
+                    raise DeadlineExceeded("aguardando o plano em streaming")
+
                 # Executar próximo passo da fila
                 if not task_queue:
                     continue
@@ -210,6 +325,21 @@ class GenAIMiniFramework:
                     execution_time = (datetime.now() - start_time).total_seconds()
                     self.logger.info(f"=== Tarefa {task_id} concluída com sucesso ===")
 
+                    if plan_outcome_pending:
+                        record_level_attempt(level_stats, current_level, success=True)
+
+                    if not plan_committed:
+                        if isinstance(task_queue, StreamingPlan):
+                            task_queue.wait(self.config.timeout_seconds)
+                        self._commit_plan(plan_tickets, task_queue)
+
+                    # Plano reexecutado do cache já está armazenado
+                    if current_level != EscalationLevel.N1_CACHE_LOCAL:
+                        self.fallback_manager.record_successful_plan(
+                            task_description, successful_steps,
+                            timeout=self.config.persistence_timeout_seconds
+                        )
+
                     return TaskResult(
                         task_id=task_id,
                         success=True,
@@ -218,22 +348,67 @@ class GenAIMiniFramework:
                         execution_time=execution_time
                     )
 
-                # Executar comando
-                success, output = self._execute_command(command)
+                # Comando que já falhou nesta tarefa só é reexecutado após outro passo de sucesso
+                negative_cache = self.fallback_manager.negative_cache
+                known_failure = negative_cache.lookup(
+                    command, task_id=task_id, since=last_success_at
+                ) if negative_cache else None
+
+                if known_failure:
+                    self.logger.info(f"Comando com falha conhecida ignorado: {command}")
+                    success = False
+                    output = f"[Falha conhecida] {known_failure['error']}"
+                else:
+                    # Executar comando
+                    command_start = datetime.now()
+                    success, output = self._execute_command(
+                        command, deadline.timeout(self.config.timeout_seconds)
+                    )
+                    record_level_attempt(
+                        level_stats, current_level,
+                        (datetime.now() - command_start).total_seconds()
+                    )
+
+                    if negative_cache:
+                        if success:
+                            negative_cache.forget(command)
+                        else:
+                            negative_cache.record_failure(command, output, task_id)
 
                 # Registrar resultado na memória
                 self.memory_manager.store_execution_log(
-                    task_id, step_desc, command, success, output, current_level
+                    task_id, step_desc, command, success, output, current_level,
+                    original_task=task_description,
+                    timeout=deadline.timeout(self.config.persistence_timeout_seconds)
                 )
 
+                if plan_outcome_pending:
+                    # Primeiro comando decide se o plano do nível funcionou
+                    record_level_attempt(level_stats, current_level, success=success)
+                    plan_outcome_pending = False
+
                 if success:
-                    # Sucesso - se fila vazia, volta ao nível 2
+                    successful_steps.append(current_step)
+                    last_success_at = time.time()
+                    # Primeiro comando do plano funcionou: respostas entram no cache
+                    if not plan_committed:
+                        plan_committed = self._commit_plan(plan_tickets, task_queue)
+                    # Sucesso - se fila vazia, volta ao nível inicial (N2 ou o roteado)
                     if not task_queue:
-                        current_level = EscalationLevel.N2_LOCAL_MEMORIA
+                        current_level = start_level
                 else:
+                    # Plano do cache falhou na reexecução: descarta e segue para N2
+                    if current_level == EscalationLevel.N1_CACHE_LOCAL:
+                        self.fallback_manager.invalidate_plan(replaying_plan_id)
+                        replaying_plan_id = None
+
+                    # Respostas que levaram a falha saem do cache (provisórias ou não)
+                    self.fallback_manager.reject_cached_responses(plan_tickets)
+                    plan_tickets = None
+
                     # Falha - limpar fila e escalar nível
                     task_queue.clear()
-                    current_level = self._get_next_level(current_level)
+                    current_level = self._get_next_level(current_level, start_level)
 
             # Limite de passos atingido
             execution_time = (datetime.now() - start_time).total_seconds()
@@ -250,6 +425,10 @@ class GenAIMiniFramework:
             execution_time = (datetime.now() - start_time).total_seconds()
             self.logger.error(f"Erro durante execução da tarefa: {e}")
 
+            # Interrompe a geração de um plano em streaming ainda em andamento
+            if isinstance(task_queue, StreamingPlan):
+                task_queue.clear()
+
             return TaskResult(
                 task_id=task_id,
                 success=False,
@@ -259,9 +438,19 @@ class GenAIMiniFramework:
                 error=str(e)
             )
 
-    def _get_next_level(self, current_level: EscalationLevel) -> EscalationLevel:
-        """Retorna o próximo nível de escalação"""
-        if current_level == EscalationLevel.N2_LOCAL_MEMORIA:
+    def _commit_plan(self, plan_tickets, task_queue) -> bool:
+        """Admite as respostas do plano no cache; em streaming, só após o fim da geração"""
+        if isinstance(task_queue, StreamingPlan) and not task_queue.finished:
+            return False
+        self.fallback_manager.commit_cached_responses(plan_tickets)
+        return True
+
+    def _get_next_level(self, current_level: EscalationLevel,
+                        start_level: EscalationLevel = EscalationLevel.N2_LOCAL_MEMORIA) -> EscalationLevel:
+        """Retorna o próximo nível de escalação (após o cache de planos, o nível inicial roteado)"""
+        if current_level == EscalationLevel.N1_CACHE_LOCAL:
+            return start_level
+        elif current_level == EscalationLevel.N2_LOCAL_MEMORIA:
             return EscalationLevel.N3_EQUIPE_LOCAL
         elif current_level == EscalationLevel.N3_EQUIPE_LOCAL:
             return EscalationLevel.N4_SUPERVISOR_ONLINE
@@ -297,6 +486,16 @@ class GenAIMiniFramework:
 
         return self.memory_manager.search_memories(query, memory_type, limit)
 
+    def warm_up_cache(self, max_tasks: Optional[int] = None) -> Dict[str, Any]:
+        """Pré-aquece o cache com as execuções bem-sucedidas do histórico"""
+        if not self.initialized:
+            raise RuntimeError("Framework não foi inicializado")
+
+        warmer = CacheWarmer(
+            self.config, self.memory_manager, self.cache_manager, self.fallback_manager
+        )
+        return warmer.warm_up(max_tasks=max_tasks)
+
     def get_cache_stats(self) -> Dict[str, Any]:
         """Retorna estatísticas do cache"""
         if not self.initialized:
@@ -311,6 +510,16 @@ class GenAIMiniFramework:
 
         self.cache_manager.clear_cache()
 
+        if self.fallback_manager.negative_cache:
+            self.fallback_manager.negative_cache.clear()
+
+    def shutdown(self):
+        """Encerra threads de fundo (sondagem de saúde, hedging, manutenção do cache) e persiste estatísticas"""
+        if self.fallback_manager:
+            self.fallback_manager.close()
+        if self.cache_manager:
+            self.cache_manager.close()
+
     def get_framework_status(self) -> Dict[str, Any]:
         """Retorna status geral do framework"""
         return {
@@ -321,7 +530,9 @@ class GenAIMiniFramework:
             "qdrant_port": self.config.qdrant.port,
             "max_steps": self.config.max_steps,
             "timeout_seconds": self.config.timeout_seconds,
-            "cache_stats": self.get_cache_stats() if self.initialized else None
+            "cache_stats": self.get_cache_stats() if self.initialized else None,
+            "circuit_breakers": self.fallback_manager.get_circuit_status() if self.fallback_manager else None,
+            "llm_metrics": self.fallback_manager.get_llm_metrics() if self.fallback_manager else None
         }
 
 # Função utilitária para inicialização rápida
@@ -378,3 +589,6 @@ if __name__ == "__main__":
 
     except Exception as e:
         print(f"Erro: {e}")
+    finally:
+        if 'framework' in locals():
+            framework.shutdown()
@@ -0,0 +1,43 @@
+"""
+HTTP Transport - Cliente HTTP Compartilhado dos Servidores Llama.cpp
+Um único httpx.Client com pool keep-alive, timeouts de conexão/leitura e
+HTTP/2 (quando disponível) usado por todos os clientes OpenAI dos papéis
+"""
+
+import logging
+import importlib.util
+from typing import Optional
+
+import httpx
+
+from framework_config import LlamaConfig
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+def role_timeout(config: LlamaConfig, role: str, deadline: Optional[Deadline] = None) -> httpx.Timeout:
+    """Timeout do papel: conexão curta, leitura conforme o tamanho típico da resposta
+
+    Com prazo, nenhum dos dois passa do que resta da tarefa.
+    """
+    read = config.role_read_timeouts.get(role, config.read_timeout_seconds)
+    connect = config.connect_timeout_seconds
+    if deadline is not None:
+        read, connect = deadline.timeout(read), deadline.timeout(connect)
+    return httpx.Timeout(read, connect=connect)
+
+def create_http_client(config: LlamaConfig) -> httpx.Client:
+    """Cliente compartilhado; o pool cobre as tarefas concorrentes e o hedging"""
+    http2 = config.http2 and importlib.util.find_spec("h2") is not None
+    if config.http2 and not http2:
+        logger.info("Pacote h2 não instalado: usando HTTP/1.1")
+
+    return httpx.Client(
+        http2=http2,
+        timeout=httpx.Timeout(config.read_timeout_seconds, connect=config.connect_timeout_seconds),
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry_seconds
+        )
+    )
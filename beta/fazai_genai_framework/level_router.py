@@ -0,0 +1,137 @@
+"""
+Level Router - Roteamento Adaptativo do Nível Inicial
+Busca tarefas similares na collection de logs e, com as estatísticas por nível
+de cada uma, escolhe o nível de partida com menor tempo esperado até o sucesso
+"""
+
+import logging
+from typing import Dict, List, Optional, Any
+from dataclasses import dataclass, field
+
+from framework_config import FrameworkConfig, EscalationLevel
+
+# Níveis com LLM candidatos a ponto de partida, em ordem de escalação
+ROUTABLE_LEVELS = [
+    EscalationLevel.N2_LOCAL_MEMORIA,
+    EscalationLevel.N3_EQUIPE_LOCAL,
+    EscalationLevel.N4_SUPERVISOR_ONLINE
+]
+
+@dataclass
+class RoutingDecision:
+    """Nível escolhido para começar a tarefa e a estimativa que o justificou"""
+    start_level: str
+    default_level: str = EscalationLevel.N2_LOCAL_MEMORIA.name
+    similar_tasks: int = 0
+    samples: float = 0.0
+    expected_seconds: Dict[str, float] = field(default_factory=dict)
+    success_rates: Dict[str, float] = field(default_factory=dict)
+    estimated_savings_seconds: float = 0.0
+    reason: str = ""
+
+    @property
+    def level(self) -> EscalationLevel:
+        return EscalationLevel[self.start_level]
+
+def record_level_attempt(level_stats: Dict[str, Dict[str, float]], level: EscalationLevel,
+                         seconds: float = 0.0, success: Optional[bool] = None):
+    """Acumula uma tentativa (success None: só tempo; True/False: desfecho do plano do nível)"""
+    stats = level_stats.setdefault(level.name, {"attempts": 0, "successes": 0, "seconds": 0.0})
+    stats["seconds"] += seconds
+    if success is not None:
+        stats["attempts"] += 1
+        stats["successes"] += int(success)
+
+class LevelRouter:
+    """Estima, por nível, sucesso e latência em tarefas similares e escolhe onde começar"""
+
+    def __init__(self, config: FrameworkConfig, memory_manager):
+        self.config = config
+        self.routing_config = config.routing
+        self.memory_manager = memory_manager
+        self.logger = logging.getLogger(__name__)
+
+    def _aggregate(self, outcomes: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+        """Soma as estatísticas por nível ponderadas pela similaridade"""
+        totals = {level.name: {"attempts": 0.0, "successes": 0.0, "seconds": 0.0}
+                  for level in ROUTABLE_LEVELS}
+
+        for outcome in outcomes:
+            weight = outcome.get("score", 1.0)
+            for name, stats in (outcome.get("level_stats") or {}).items():
+                if name not in totals:
+                    continue
+                totals[name]["attempts"] += weight * stats.get("attempts", 0)
+                totals[name]["successes"] += weight * stats.get("successes", 0)
+                totals[name]["seconds"] += weight * stats.get("seconds", 0.0)
+        return totals
+
+    def _expected_seconds(self, totals: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+        """E[L] = t(L) + (1 - p(L)) * E[próximo nível], do último nível para o primeiro"""
+        config = self.routing_config
+        expected: Dict[str, float] = {}
+        success_rates: Dict[str, float] = {}
+        next_expected = config.failure_penalty_seconds
+
+        for level in reversed(ROUTABLE_LEVELS):
+            stats = totals[level.name]
+            attempts = stats["attempts"]
+            p_success = (stats["successes"] + config.prior_success * config.prior_weight) / (
+                attempts + config.prior_weight
+            )
+            seconds = (stats["seconds"] / attempts if attempts
+                       else config.default_level_seconds.get(level.name, 0.0))
+
+            expected[level.name] = seconds + (1.0 - p_success) * next_expected
+            success_rates[level.name] = p_success
+            next_expected = expected[level.name]
+
+        return {"expected": expected, "success_rates": success_rates}
+
+    def route(self, task_description: str, timeout: Optional[float] = None) -> RoutingDecision:
+        """Nível inicial para a tarefa; N2 sem histórico suficiente ou economia relevante"""
+        config = self.routing_config
+        default_level = EscalationLevel.N2_LOCAL_MEMORIA.name
+        decision = RoutingDecision(start_level=default_level)
+
+        if not config.enabled:
+            decision.reason = "roteamento desabilitado"
+            return decision
+
+        outcomes = [
+            outcome for outcome in self.memory_manager.search_task_outcomes(
+                task_description, limit=config.neighbors, score_threshold=config.min_similarity,
+                timeout=timeout
+            )
+            if outcome.get("level_stats")
+        ]
+        decision.similar_tasks = len(outcomes)
+        decision.samples = sum(outcome.get("score", 1.0) for outcome in outcomes)
+
+        if decision.samples < config.min_samples:
+            decision.reason = f"histórico insuficiente ({decision.samples:.1f} < {config.min_samples})"
+            return decision
+
+        estimate = self._expected_seconds(self._aggregate(outcomes))
+        decision.expected_seconds = estimate["expected"]
+        decision.success_rates = estimate["success_rates"]
+
+        candidates = [level.name for level in ROUTABLE_LEVELS
+                      if config.allow_supervisor_start or level != EscalationLevel.N4_SUPERVISOR_ONLINE]
+        best = min(candidates, key=lambda name: decision.expected_seconds[name])
+        savings = decision.expected_seconds[default_level] - decision.expected_seconds[best]
+
+        if best != default_level and savings >= config.min_savings_seconds:
+            decision.start_level = best
+            decision.estimated_savings_seconds = savings
+            decision.reason = (
+                f"{decision.similar_tasks} tarefas similares: sucesso em "
+                f"{default_level} {decision.success_rates[default_level]:.0%}"
+            )
+            self.logger.info(
+                f"Roteamento: iniciando em {best} (economia estimada de {savings:.1f}s)"
+            )
+        else:
+            decision.reason = "nível padrão tem o menor tempo esperado"
+
+        return decision
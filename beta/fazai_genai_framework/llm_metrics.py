@@ -0,0 +1,173 @@
+"""
+LLM Metrics - Métricas por Chamada de LLM
+Registra tokens, tempo até o primeiro token, prefill/decode (timings do llama.cpp),
+tempo total, acerto de cache e réplica de cada chamada feita nos níveis N2-N4,
+e agrega por papel para o status do framework
+"""
+
+import time
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional, Any, Callable
+
+def _token_count(usage: Any, name: str, default: Optional[int]) -> Optional[int]:
+    value = getattr(usage, name, None)
+    return value if isinstance(value, int) and value > 0 else default
+
+def chat_chunk_content(chunk) -> Optional[str]:
+    choices = getattr(chunk, "choices", None)
+    return choices[0].delta.content if choices else None
+
+def genai_chunk_content(chunk) -> Optional[str]:
+    try:
+        return chunk.text
+    except ValueError:
+        # Chunk só com metadados (sem partes de texto)
+        return None
+
+@dataclass
+class LLMCallMetrics:
+    """Uma chamada de LLM (ou acerto de cache) feita por um papel"""
+    role: str
+    model: Optional[str] = None
+    level: Optional[str] = None
+    streaming: bool = False
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    ttft_seconds: Optional[float] = None
+    prefill_seconds: Optional[float] = None
+    decode_seconds: Optional[float] = None
+    total_seconds: float = 0.0
+    cache_hit: bool = False
+    cache_level: Optional[str] = None
+    endpoint: Optional[str] = None
+    success: bool = True
+    error: Optional[str] = None
+
+    def observe(self, payload: Any):
+        """Lê uso de tokens e timings de uma resposta ou chunk (OpenAI, llama.cpp ou GenAI)"""
+        if getattr(payload, "cached", False) is True:
+            self.cache_hit = True
+            self.cache_level = getattr(payload, "cache_level", None)
+
+        usage = getattr(payload, "usage", None)
+        if usage is not None:
+            self.prompt_tokens = _token_count(usage, "prompt_tokens", self.prompt_tokens)
+            self.completion_tokens = _token_count(usage, "completion_tokens", self.completion_tokens)
+
+        usage_metadata = getattr(payload, "usage_metadata", None)
+        if usage_metadata is not None:
+            self.prompt_tokens = _token_count(usage_metadata, "prompt_token_count", self.prompt_tokens)
+            self.completion_tokens = _token_count(
+                usage_metadata, "candidates_token_count", self.completion_tokens
+            )
+
+        # Campo extra do llama.cpp: {"prompt_ms": ..., "predicted_ms": ...}
+        timings = getattr(payload, "timings", None)
+        if isinstance(timings, dict):
+            if timings.get("prompt_ms") is not None:
+                self.prefill_seconds = timings["prompt_ms"] / 1000.0
+            if timings.get("predicted_ms") is not None:
+                self.decode_seconds = timings["predicted_ms"] / 1000.0
+
+    def finish(self, start: float, error: Optional[str] = None):
+        self.total_seconds = time.perf_counter() - start
+        if error:
+            self.success = False
+            self.error = error[:200]
+        # Sem streaming o primeiro token chega junto com a resposta; descontado o decode
+        if self.ttft_seconds is None and not self.streaming and self.success:
+            self.ttft_seconds = max(self.total_seconds - (self.decode_seconds or 0.0), 0.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+class MeteredStream:
+    """Stream que marca o primeiro token e fecha as métricas ao terminar (ou ser fechado)"""
+
+    def __init__(self, stream, metrics: LLMCallMetrics, start: float,
+                 content_of: Callable[[Any], Optional[str]],
+                 on_finish: Optional[Callable[[LLMCallMetrics], None]] = None):
+        self._stream = stream
+        self.metrics = metrics
+        self._start = start
+        self._content_of = content_of
+        self._on_finish = on_finish
+        self._finished = False
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        error = None
+        try:
+            for chunk in self._stream:
+                if self.metrics.ttft_seconds is None and self._content_of(chunk):
+                    self.metrics.ttft_seconds = time.perf_counter() - self._start
+                self.metrics.observe(chunk)
+                yield chunk
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._finish(error)
+
+    def _finish(self, error: Optional[str] = None):
+        if self._finished:
+            return
+        self._finished = True
+        self.metrics.finish(self._start, error)
+        if self._on_finish:
+            self._on_finish(self.metrics)
+
+    def close(self):
+        close = getattr(self._stream, "close", None)
+        if close:
+            close()
+        self._finish()
+
+class LLMMetricsAggregator:
+    """Totais e médias por papel das chamadas registradas desde o início"""
+
+    def __init__(self):
+        self._roles: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, metrics: LLMCallMetrics):
+        with self._lock:
+            totals = self._roles.setdefault(metrics.role, {
+                "calls": 0, "errors": 0, "cache_hits": 0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "total_seconds": 0.0, "ttft_seconds": 0.0, "ttft_samples": 0,
+                "prefill_seconds": 0.0, "decode_seconds": 0.0
+            })
+            totals["calls"] += 1
+            totals["errors"] += int(not metrics.success)
+            totals["cache_hits"] += int(metrics.cache_hit)
+            totals["prompt_tokens"] += metrics.prompt_tokens or 0
+            totals["completion_tokens"] += metrics.completion_tokens or 0
+            totals["total_seconds"] += metrics.total_seconds
+            totals["prefill_seconds"] += metrics.prefill_seconds or 0.0
+            totals["decode_seconds"] += metrics.decode_seconds or 0.0
+            if metrics.ttft_seconds is not None:
+                totals["ttft_seconds"] += metrics.ttft_seconds
+                totals["ttft_samples"] += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            stats = {}
+            for role, totals in self._roles.items():
+                calls = totals["calls"]
+                stats[role] = {
+                    "calls": calls,
+                    "errors": totals["errors"],
+                    "cache_hit_rate": totals["cache_hits"] / calls if calls else 0.0,
+                    "prompt_tokens": totals["prompt_tokens"],
+                    "completion_tokens": totals["completion_tokens"],
+                    "avg_total_seconds": totals["total_seconds"] / calls if calls else 0.0,
+                    "avg_ttft_seconds": (totals["ttft_seconds"] / totals["ttft_samples"]
+                                         if totals["ttft_samples"] else None),
+                    "prefill_seconds": totals["prefill_seconds"],
+                    "decode_seconds": totals["decode_seconds"]
+                }
+            return stats
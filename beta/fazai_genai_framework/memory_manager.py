@@ -6,7 +6,7 @@ Integração com collections fz_memories, personalidade e logs de execução
 import json
 import uuid
 import logging
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Iterator
 from dataclasses import dataclass, asdict
 from datetime import datetime
 
@@ -14,6 +14,7 @@ from qdrant_client import QdrantClient, models
 import google.generativeai as genai
 
 from framework_config import FrameworkConfig, EscalationLevel
+from deadline import Deadline, DeadlineExceeded, whole_seconds
 
 @dataclass
 class MemoryEntry:
@@ -55,7 +56,8 @@ class MemoryManager:
         collections = [
             self.config.qdrant.collection_memories,
             self.config.qdrant.collection_personality, 
-            self.config.qdrant.collection_logs
+            self.config.qdrant.collection_logs,
+            self.config.qdrant.collection_plans
         ]
 
         for collection_name in collections:
@@ -74,8 +76,12 @@ class MemoryManager:
                 )
                 self.logger.info(f"Collection '{collection_name}' criada")
 
-    def _generate_embedding(self, text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> List[float]:
-        """Gera embedding usando Google GenAI"""
+    # Tarefa comparada com tarefa (planos, resultados): embedding simétrico, não consulta/documento
+    TASK_SIMILARITY = "SEMANTIC_SIMILARITY"
+
+    def _generate_embedding(self, text: str, task_type: str = "RETRIEVAL_DOCUMENT",
+                            timeout: Optional[float] = None) -> List[float]:
+        """Gera embedding usando Google GenAI (timeout: o que resta do prazo da tarefa)"""
         try:
             if not self.config.genai.api_key:
                 raise ValueError("Google API Key não configurada")
@@ -85,7 +91,8 @@ class MemoryManager:
             result = genai.embed_content(
                 model=self.config.qdrant.embedding_model,
                 content=text,
-                task_type=task_type
+                task_type=task_type,
+                request_options={"timeout": timeout} if timeout is not None else None
             )
 
             return result['embedding']
@@ -143,11 +150,13 @@ class MemoryManager:
             return memory_id
 
     def search_memories(self, query: str, memory_type: Optional[str] = None, 
-                       limit: int = 5) -> List[Dict[str, Any]]:
+                       limit: int = 5, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
         """Busca memórias similares"""
+        # Prazo medido desde a entrada: o embedding consome parte dele
+        deadline = Deadline.coerce(timeout)
         try:
             # Gera embedding da query
-            query_embedding = self._generate_embedding(query, "RETRIEVAL_QUERY")
+            query_embedding = self._generate_embedding(query, "RETRIEVAL_QUERY", deadline.timeout())
             if not query_embedding:
                 return []
 
@@ -169,7 +178,8 @@ class MemoryManager:
                 query_vector=query_embedding,
                 query_filter=query_filter,
                 limit=limit,
-                with_payload=True
+                with_payload=True,
+                timeout=whole_seconds(deadline.timeout(), "busca de memórias")
             )
 
             # Formata resultados
@@ -192,8 +202,10 @@ class MemoryManager:
             return []
 
     def store_execution_log(self, task_id: str, step_desc: str, command: str, 
-                          success: bool, output: str, level: EscalationLevel):
+                          success: bool, output: str, level: EscalationLevel,
+                          original_task: Optional[str] = None, timeout: Optional[float] = None):
         """Armazena log de execução para aprendizado"""
+        deadline = Deadline.coerce(timeout)
         log_content = f"""
         Nível: {level.name}
         Tarefa: {step_desc}
@@ -202,13 +214,14 @@ class MemoryManager:
         Output: {output}
         """
 
-        embedding = self._generate_embedding(log_content)
+        embedding = self._generate_embedding(log_content, timeout=deadline.timeout())
         if not embedding:
             return
 
         try:
             self.qdrant.upsert(
                 collection_name=self.config.qdrant.collection_logs,
+                timeout=whole_seconds(deadline.timeout(), "log de execução"),
                 points=[
                     models.PointStruct(
                         id=str(uuid.uuid4()),
@@ -220,6 +233,7 @@ class MemoryManager:
                             "success": success,
                             "output": output,
                             "level": level.name,
+                            "original_task": original_task,
                             "timestamp": datetime.now().isoformat()
                         }
                     )
@@ -229,7 +243,162 @@ class MemoryManager:
         except Exception as e:
             self.logger.error(f"Erro ao armazenar log: {e}")
 
-    def get_task_history(self, task_id: str) -> List[Dict[str, Any]]:
+    def store_task_outcome(self, task_id: str, original_task: str, success: bool,
+                           final_level: EscalationLevel, steps_executed: int,
+                           execution_time: float,
+                           level_stats: Optional[Dict[str, Dict[str, float]]] = None,
+                           routing: Optional[Dict[str, Any]] = None,
+                           timeout: Optional[float] = None):
+        """Armazena o resultado final de uma tarefa na collection de logs"""
+        deadline = Deadline.coerce(timeout)
+        embedding = self._generate_embedding(original_task, self.TASK_SIMILARITY, deadline.timeout())
+        if not embedding:
+            return
+
+        try:
+            self.qdrant.upsert(
+                collection_name=self.config.qdrant.collection_logs,
+                timeout=whole_seconds(deadline.timeout(), "resultado da tarefa"),
+                points=[
+                    models.PointStruct(
+                        id=str(uuid.uuid4()),
+                        vector=embedding,
+                        payload={
+                            # Sem "task_id" para não aparecer no histórico de passos
+                            "record_type": "task_outcome",
+                            "outcome_of": task_id,
+                            "original_task": original_task,
+                            "success": success,
+                            "final_level": final_level.name,
+                            "steps_executed": steps_executed,
+                            "execution_time": execution_time,
+                            # Tentativas, sucessos e tempo por nível (roteamento adaptativo)
+                            "level_stats": level_stats or {},
+                            "routing": routing,
+                            "timestamp": datetime.now().isoformat()
+                        }
+                    )
+                ]
+            )
+
+        except Exception as e:
+            self.logger.error(f"Erro ao armazenar resultado da tarefa: {e}")
+
+    def search_task_outcomes(self, task_description: str, limit: int = 20,
+                             score_threshold: Optional[float] = None,
+                             timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Resultados de tarefas passadas similares à descrição, com o score da similaridade"""
+        deadline = Deadline.coerce(timeout)
+        query_embedding = self._generate_embedding(task_description, self.TASK_SIMILARITY, deadline.timeout())
+        if not query_embedding:
+            return []
+
+        try:
+            search_result = self.qdrant.search(
+                collection_name=self.config.qdrant.collection_logs,
+                query_vector=query_embedding,
+                query_filter=models.Filter(
+                    must=[
+                        models.FieldCondition(
+                            key="record_type",
+                            match=models.MatchValue(value="task_outcome")
+                        )
+                    ]
+                ),
+                score_threshold=score_threshold,
+                limit=limit,
+                with_payload=True,
+                timeout=whole_seconds(deadline.timeout(), "busca de resultados de tarefas")
+            )
+
+            return [{"score": hit.score, **hit.payload} for hit in search_result]
+
+        except Exception as e:
+            self.logger.error(f"Erro ao buscar resultados de tarefas: {e}")
+            return []
+
+    def store_plan(self, normalized_task: str, original_task: str, fingerprint: str,
+                   steps: List[Dict[str, Any]], timeout: Optional[float] = None) -> Optional[str]:
+        """Armazena plano bem-sucedido (um por tarefa normalizada e ambiente)"""
+        deadline = Deadline.coerce(timeout)
+        embedding = self._generate_embedding(normalized_task, self.TASK_SIMILARITY, deadline.timeout())
+        if not embedding:
+            return None
+
+        plan_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{fingerprint}|{normalized_task}"))
+
+        try:
+            self.qdrant.upsert(
+                collection_name=self.config.qdrant.collection_plans,
+                timeout=whole_seconds(deadline.timeout(), "plano"),
+                points=[
+                    models.PointStruct(
+                        id=plan_id,
+                        vector=embedding,
+                        payload={
+                            "normalized_task": normalized_task,
+                            "original_task": original_task,
+                            "env_fingerprint": fingerprint,
+                            "steps": steps,
+                            "timestamp": datetime.now().isoformat()
+                        }
+                    )
+                ]
+            )
+            self.logger.info(f"Plano armazenado: {plan_id} ({len(steps)} passos)")
+            return plan_id
+
+        except Exception as e:
+            self.logger.error(f"Erro ao armazenar plano: {e}")
+            return None
+
+    def search_plan(self, normalized_task: str, fingerprint: str,
+                    score_threshold: float, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Busca o plano mais similar no mesmo ambiente acima do threshold"""
+        deadline = Deadline.coerce(timeout)
+        query_embedding = self._generate_embedding(normalized_task, self.TASK_SIMILARITY, deadline.timeout())
+        if not query_embedding:
+            return None
+
+        try:
+            search_result = self.qdrant.search(
+                collection_name=self.config.qdrant.collection_plans,
+                query_vector=query_embedding,
+                query_filter=models.Filter(
+                    must=[
+                        models.FieldCondition(
+                            key="env_fingerprint",
+                            match=models.MatchValue(value=fingerprint)
+                        )
+                    ]
+                ),
+                score_threshold=score_threshold,
+                limit=1,
+                with_payload=True,
+                timeout=whole_seconds(deadline.timeout(), "busca de plano")
+            )
+
+            if not search_result:
+                return None
+
+            hit = search_result[0]
+            return {"id": str(hit.id), "score": hit.score, **hit.payload}
+
+        except Exception as e:
+            self.logger.error(f"Erro ao buscar plano: {e}")
+            return None
+
+    def delete_plan(self, plan_id: str):
+        """Remove um plano do cache de planos"""
+        try:
+            self.qdrant.delete(
+                collection_name=self.config.qdrant.collection_plans,
+                points_selector=models.PointIdsList(points=[plan_id])
+            )
+        except Exception as e:
+            self.logger.error(f"Erro ao remover plano: {e}")
+
+    def get_task_history(self, task_id: str, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
         """Recupera histórico de uma tarefa específica"""
         try:
             search_result = self.qdrant.scroll(
@@ -243,7 +412,8 @@ class MemoryManager:
                     ]
                 ),
                 limit=50,
-                with_payload=True
+                with_payload=True,
+                timeout=whole_seconds(timeout, "histórico da tarefa")
             )
 
             history = []
@@ -256,10 +426,77 @@ class MemoryManager:
 
             return history
 
+        except DeadlineExceeded:
+            # Sem histórico o nível replanejaria a tarefa do zero: falha o nível
+            raise
         except Exception as e:
             self.logger.error(f"Erro ao recuperar histórico: {e}")
             return []
 
+    def _scroll_logs(self, conditions: List[Any], batch_size: int = 256,
+                     limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Payloads dos logs que satisfazem as condições, percorrendo todas as páginas"""
+        payloads: List[Dict[str, Any]] = []
+        offset = None
+        while True:
+            points, offset = self.qdrant.scroll(
+                collection_name=self.config.qdrant.collection_logs,
+                scroll_filter=models.Filter(must=conditions),
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            payloads.extend(point.payload for point in points)
+            if offset is None or (limit is not None and len(payloads) >= limit):
+                return payloads
+
+    def iter_task_histories(self, batch_size: int = 256,
+                            max_tasks: Optional[int] = None
+                            ) -> Iterator[Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """Percorre a collection de logs em lotes e retorna (histórico, resultado) de cada tarefa
+
+        Cada tarefa é carregada inteira (filtro por task_id) ao ser encontrada: em memória
+        ficam só o lote atual e os ids já devolvidos, limitados por max_tasks.
+        """
+        seen = set()
+        offset = None
+
+        try:
+            while True:
+                # Só o task_id: passos e resultado vêm da consulta filtrada da tarefa
+                points, offset = self.qdrant.scroll(
+                    collection_name=self.config.qdrant.collection_logs,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=["task_id"],
+                    with_vectors=False
+                )
+
+                for point in points:
+                    task_id = (point.payload or {}).get("task_id")
+                    if not task_id or task_id in seen:
+                        continue
+                    if max_tasks is not None and len(seen) >= max_tasks:
+                        return
+                    seen.add(task_id)
+
+                    history = self._scroll_logs([
+                        models.FieldCondition(key="task_id", match=models.MatchValue(value=task_id))
+                    ], batch_size)
+                    history.sort(key=lambda x: x.get('timestamp', ''))
+                    outcomes = self._scroll_logs([
+                        models.FieldCondition(key="record_type", match=models.MatchValue(value="task_outcome")),
+                        models.FieldCondition(key="outcome_of", match=models.MatchValue(value=task_id))
+                    ], limit=1)
+                    yield history, outcomes[0] if outcomes else None
+
+                if offset is None:
+                    break
+
+        except Exception as e:
+            self.logger.error(f"Erro ao percorrer logs de execução: {e}")
+
     def import_claude_conversations(self, claude_json_path: str) -> int:
         """Importa conversas do Claude a partir de arquivo JSON"""
         try:
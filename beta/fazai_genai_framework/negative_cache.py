@@ -0,0 +1,165 @@
+"""
+Negative Cache - Cache de Falhas Conhecidas
+Registra comandos que falharam neste ambiente para que não sejam propostos
+novamente pelos planejadores enquanto a falha for válida (TTL), nem reexecutados
+na mesma tarefa antes que outro passo mude o estado
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Any
+
+from framework_config import FrameworkConfig
+from environment import get_environment_fingerprint
+from sqlite_utils import connect_sqlite
+
+# Tamanho do resumo do erro guardado e exibido aos planejadores
+ERROR_SUMMARY_CHARS = 120
+
+def normalize_command(command: str) -> str:
+    """Normaliza o comando: espaços colapsados e sem ';' / '&&' finais"""
+    text = " ".join(command.split())
+    return text.rstrip("; &")
+
+def _summarize_error(output: str) -> str:
+    """Primeira linha não vazia do erro, truncada"""
+    for line in (output or "").splitlines():
+        if line.strip():
+            return line.strip()[:ERROR_SUMMARY_CHARS]
+    return ""
+
+class NegativeCache:
+    """Falhas por (ambiente, comando normalizado), com expiração"""
+
+    def __init__(self, db_path: str, ttl_seconds: Optional[float] = 86400.0,
+                 fingerprint: Optional[str] = None, shared: bool = False,
+                 busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.fingerprint = fingerprint or get_environment_fingerprint()
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        self._db = connect_sqlite(db_path, shared, busy_timeout_ms)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS known_failures ("
+            "fingerprint TEXT NOT NULL, command TEXT NOT NULL, error TEXT NOT NULL, "
+            "failures INTEGER NOT NULL DEFAULT 1, last_failure REAL NOT NULL, expires_at REAL, "
+            "task_id TEXT, PRIMARY KEY (fingerprint, command))"
+        )
+        # Bancos criados antes da coluna task_id
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(known_failures)")]
+        if "task_id" not in columns:
+            self._db.execute("ALTER TABLE known_failures ADD COLUMN task_id TEXT")
+        self._db.commit()
+
+    @classmethod
+    def from_config(cls, config: FrameworkConfig) -> Optional["NegativeCache"]:
+        """Cria o cache de falhas configurado, ou None se desabilitado"""
+        cache_config = config.cache
+        if not cache_config.negative_cache_enabled:
+            return None
+
+        os.makedirs(cache_config.data_dir, exist_ok=True)
+        return cls(
+            os.path.join(cache_config.data_dir, cache_config.negative_cache_file),
+            ttl_seconds=cache_config.negative_cache_ttl_seconds,
+            shared=cache_config.shared_mode,
+            busy_timeout_ms=cache_config.sqlite_busy_timeout_ms
+        )
+
+    def record_failure(self, command: str, output: str, task_id: Optional[str] = None):
+        """Registra (ou renova) a falha de um comando, na tarefa em que ocorreu"""
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO known_failures (fingerprint, command, error, last_failure, expires_at, "
+                "task_id) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (fingerprint, command) DO UPDATE SET "
+                "error = excluded.error, failures = failures + 1, "
+                "last_failure = excluded.last_failure, expires_at = excluded.expires_at, "
+                "task_id = excluded.task_id",
+                (self.fingerprint, normalize_command(command), _summarize_error(output),
+                 now, expires_at, task_id)
+            )
+            self._db.commit()
+
+    def lookup(self, command: str, task_id: Optional[str] = None,
+               since: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Falha ainda válida para o comando neste ambiente
+
+        task_id restringe a falhas registradas pela tarefa; since, a falhas posteriores
+        a esse instante (ex.: último passo bem-sucedido, que pode ter mudado o estado).
+        """
+        query = (
+            "SELECT command, error, failures, last_failure FROM known_failures "
+            "WHERE fingerprint = ? AND command = ? AND (expires_at IS NULL OR expires_at > ?)"
+        )
+        params = [self.fingerprint, normalize_command(command), time.time()]
+        if task_id is not None:
+            query += " AND task_id = ?"
+            params.append(task_id)
+        if since is not None:
+            query += " AND last_failure > ?"
+            params.append(since)
+
+        with self._lock:
+            row = self._db.execute(query, params).fetchone()
+
+        if row is None:
+            return None
+        return {"command": row[0], "error": row[1], "failures": row[2], "last_failure": row[3]}
+
+    def forget(self, command: str):
+        """Remove a falha de um comando que voltou a funcionar"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM known_failures WHERE fingerprint = ? AND command = ?",
+                (self.fingerprint, normalize_command(command))
+            )
+            self._db.commit()
+
+    def known_failures(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Falhas válidas mais recentes deste ambiente"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT command, error, failures, last_failure FROM known_failures "
+                "WHERE fingerprint = ? AND (expires_at IS NULL OR expires_at > ?) "
+                "ORDER BY last_failure DESC LIMIT ?",
+                (self.fingerprint, time.time(), limit)
+            ).fetchall()
+
+        return [
+            {"command": row[0], "error": row[1], "failures": row[2], "last_failure": row[3]}
+            for row in rows
+        ]
+
+    def format_known_failures(self, limit: int = 10) -> str:
+        """Resumo compacto para os prompts dos planejadores ('' se não há falhas)"""
+        failures = self.known_failures(limit)
+        if not failures:
+            return ""
+
+        context = "Falhas Conhecidas (não repita estes comandos):\n"
+        for failure in failures:
+            context += f"  - {failure['command']} ({failure['failures']}x): {failure['error']}\n"
+        return context
+
+    def purge_expired(self) -> int:
+        """Remove falhas expiradas; retorna quantas foram removidas"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM known_failures WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),)
+            )
+            self._db.commit()
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM known_failures")
+            self._db.commit()
@@ -0,0 +1,69 @@
+"""
+Plan Cache - Cache de Planos Completos (Nível N1_CACHE_LOCAL)
+Reaproveita a sequência de comandos de tarefas bem-sucedidas sem consultar LLMs
+"""
+
+import re
+import logging
+from typing import Dict, List, Optional, Any
+
+from framework_config import FrameworkConfig
+from memory_manager import MemoryManager
+from environment import get_environment_fingerprint
+
+def normalize_task_description(description: str) -> str:
+    """Normaliza a descrição para que variações triviais gerem o mesmo embedding"""
+    text = description.strip().lower()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip(".!;: ")
+
+class PlanCache:
+    """Cache de planos indexado por embedding da tarefa + ambiente"""
+
+    def __init__(self, config: FrameworkConfig, memory_manager: MemoryManager):
+        self.config = config
+        self.memory_manager = memory_manager
+        self.logger = logging.getLogger(__name__)
+
+    def is_enabled(self) -> bool:
+        return self.config.cache.plan_cache_enabled
+
+    def lookup(self, task_description: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Busca plano de tarefa similar já resolvida neste ambiente"""
+        if not self.is_enabled():
+            return None
+
+        plan = self.memory_manager.search_plan(
+            normalize_task_description(task_description),
+            get_environment_fingerprint(),
+            score_threshold=self.config.cache.plan_similarity_threshold,
+            timeout=timeout
+        )
+
+        if plan and plan.get("steps"):
+            self.logger.info(
+                f"Plano em cache encontrado (score={plan['score']:.3f}, "
+                f"{len(plan['steps'])} passos)"
+            )
+            return plan
+        return None
+
+    def store(self, task_description: str, steps: List[Dict[str, Any]],
+              timeout: Optional[float] = None) -> Optional[str]:
+        """Armazena a sequência de comandos bem-sucedida de uma tarefa"""
+        if not self.is_enabled() or not steps:
+            return None
+
+        return self.memory_manager.store_plan(
+            normalize_task_description(task_description),
+            task_description,
+            get_environment_fingerprint(),
+            [{"descricao": step.get("descricao"), "comando": step.get("comando")} for step in steps],
+            timeout=timeout
+        )
+
+    def invalidate(self, plan_id: str):
+        """Remove plano cuja reexecução falhou"""
+        if plan_id:
+            self.memory_manager.delete_plan(plan_id)
+            self.logger.info(f"Plano em cache {plan_id} invalidado")
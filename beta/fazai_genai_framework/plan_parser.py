@@ -0,0 +1,338 @@
+"""
+Plan Parser - Leitura Incremental e Extração Tolerante de Planos JSON
+Extrai os passos de um plano (lista JSON) à medida que o LLM os gera, para que
+o primeiro comando seja executado enquanto o restante ainda está em streaming,
+e recupera planos de saídas com cercas markdown, texto em volta ou JSON defeituoso
+"""
+
+import re
+import ast
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+def validate_step(step: Any) -> bool:
+    """Passo válido: objeto com descrição e comando (texto ou null)"""
+    if not isinstance(step, dict) or "comando" not in step:
+        return False
+    command = step.get("comando")
+    return command is None or isinstance(command, str)
+
+# Chaves usadas para embrulhar a lista de passos
+_PLAN_KEYS = ("plan", "plano", "steps", "passos")
+# Sinônimos aceitos nos campos do passo
+_STEP_ALIASES = {"description": "descricao", "descrição": "descricao", "command": "comando",
+                 "finished": "finalizado", "done": "finalizado"}
+
+_FENCE_RE = re.compile(r"```[a-zA-Z]*\s*(.*?)(?:```|$)", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+def _json_span(text: str) -> Optional[str]:
+    """Primeiro valor JSON embutido no texto; truncado, é fechado após o último passo completo"""
+    start = next((i for i, char in enumerate(text) if char in "[{"), None)
+    if start is None:
+        return None
+
+    stack: List[str] = []
+    in_string = escape = False
+    # (posição, pilha) após o último elemento completo dentro da raiz
+    last_complete = None
+
+    for position in range(start, len(text)):
+        char = text[position]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "[{":
+            stack.append("]" if char == "[" else "}")
+        elif char in "]}":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                return text[start:position + 1]
+            if char == "}" and stack[-1] == "]":
+                last_complete = (position, list(stack))
+
+    # Truncado: descarta o passo incompleto e fecha as listas/objetos abertos.
+    # Sem nenhum passo completo não há reparo seguro (o comando pode estar cortado)
+    if last_complete is None:
+        return None
+    position, pending = last_complete
+    return text[start:position + 1] + "".join(reversed(pending))
+
+def _loads_lenient(text: str) -> Any:
+    """json.loads com reparos: vírgulas finais e aspas simples (sintaxe Python)"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    repaired = _TRAILING_COMMA_RE.sub(r"\1", text)
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        pass
+
+    # {'descricao': 'x', 'comando': None}: literal Python
+    python_text = re.sub(r"\bnull\b", "None", re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", repaired)))
+    try:
+        return ast.literal_eval(python_text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError(f"JSON irrecuperável: {text[:100]}")
+
+def extract_json(text: str) -> Any:
+    """Valor JSON de uma resposta de LLM: direto, em cerca markdown ou embutido em texto"""
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("Resposta vazia")
+
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    candidates = [match.group(1) for match in _FENCE_RE.finditer(text)] + [text]
+    error = None
+    for candidate in candidates:
+        span = _json_span(candidate)
+        if span is None:
+            continue
+        try:
+            return _loads_lenient(span)
+        except ValueError as e:
+            error = e
+
+    raise error or ValueError(f"Nenhum JSON encontrado na resposta: {text[:100]}")
+
+def normalize_step(step: Any) -> Any:
+    """Passo com sinônimos dos campos (description, command...) trocados pelos nomes canônicos"""
+    if isinstance(step, dict):
+        return {_STEP_ALIASES.get(key, key): value for key, value in step.items()}
+    return step
+
+def normalize_plan(data: Any) -> List[Dict[str, Any]]:
+    """Passo, lista de passos ou {"plan": [...]} -> lista de passos válidos"""
+    if isinstance(data, dict):
+        wrapped = next((data[key] for key in _PLAN_KEYS if isinstance(data.get(key), list)), None)
+        steps = wrapped if wrapped is not None else [data]
+    elif isinstance(data, list):
+        steps = data
+    else:
+        raise ValueError(f"Formato de plano inválido: {type(data).__name__}")
+
+    plan = []
+    for step in steps:
+        step = normalize_step(step)
+        if validate_step(step):
+            plan.append(step)
+
+    if not plan:
+        raise ValueError("Resposta não contém passos válidos")
+    return plan
+
+def extract_plan(text: str) -> List[Dict[str, Any]]:
+    """Lista de passos de uma resposta de LLM, reparando defeitos recuperáveis"""
+    return normalize_plan(extract_json(text))
+
+class IncrementalPlanParser:
+    """Parser de caracteres que emite cada elemento do primeiro array JSON assim que fecha
+
+    Elementos passam pelos mesmos reparos de extract_plan (vírgulas finais, aspas simples).
+    """
+
+    def __init__(self):
+        self._text: List[str] = []
+        self._length = 0
+        self._depth = 0
+        # Aspa que abriu a string atual (" ou ' de literais Python); None fora de strings
+        self._quote: Optional[str] = None
+        self._escape = False
+        self._started = False
+        self._array_depth: Optional[int] = None
+        self._element_start: Optional[int] = None
+        self._root_start: Optional[int] = None
+        self._root_end: Optional[int] = None
+        self.emitted = 0
+        self.closed = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._text)
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consome um trecho e retorna os elementos completados por ele"""
+        if not chunk or self.closed:
+            return []
+
+        base = self._length
+        self._text.append(chunk)
+        self._length += len(chunk)
+        elements = []
+        text = None
+
+        for offset, char in enumerate(chunk):
+            position = base + offset
+
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+                continue
+
+            if not self._started:
+                # Ignora texto fora do JSON (ex.: cercas ```json do supervisor)
+                if char not in "[{":
+                    continue
+                self._started = True
+                self._root_start = position
+
+            if char in "\"'":
+                self._quote = char
+            elif char in "[{":
+                self._depth += 1
+                if char == "[" and self._array_depth is None:
+                    self._array_depth = self._depth
+                elif (char == "{" and self._array_depth is not None
+                      and self._depth == self._array_depth + 1):
+                    self._element_start = position
+            elif char in "]}":
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if char == "}" and self._element_start is not None and self._depth == self._array_depth:
+                        text = text or self.text
+                        elements.append(_loads_lenient(text[self._element_start:position + 1]))
+                        self._element_start = None
+                    elif char == "]" and self._depth == self._array_depth - 1:
+                        self.closed = True
+                        break
+                if self._depth == 0:
+                    self._root_end = position + 1
+                    self.closed = True
+                    break
+
+        self.emitted += len(elements)
+        return elements
+
+    def finish(self) -> List[Any]:
+        """Fim do stream: sem array, o objeto raiz é o único passo"""
+        if self._array_depth is None and self._root_end is not None:
+            root = _loads_lenient(self.text[self._root_start:self._root_end])
+            if isinstance(root, dict):
+                self.emitted += 1
+                return [root]
+        if not self.emitted:
+            # Nada fechou durante o stream (JSON defeituoso/truncado): tenta o reparo
+            steps = extract_plan(self.text)
+            self.emitted += len(steps)
+            return steps
+        return []
+
+class StreamingPlan:
+    """Fila de passos alimentada por um stream; usada pelo executor como a lista de passos"""
+
+    def __init__(self, chunks: Iterable[str], on_complete: Optional[Callable[[str], None]] = None,
+                 close: Optional[Callable[[], None]] = None):
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._close = close
+        self._parser = IncrementalPlanParser()
+        self._steps: Deque[Dict[str, Any]] = deque()
+        self._condition = threading.Condition()
+        self._finished = False
+        self._cancelled = False
+        self.error: Optional[str] = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self) -> "StreamingPlan":
+        threading.Thread(target=self._consume, name="plan-stream", daemon=True).start()
+        return self
+
+    def _consume(self):
+        try:
+            for chunk in self._chunks:
+                if self._cancelled:
+                    break
+                for step in self._parser.feed(chunk):
+                    self._push(step)
+
+            if not self._cancelled:
+                for step in self._parser.finish():
+                    self._push(step)
+                if self._on_complete:
+                    self._on_complete(self._parser.text)
+
+        except Exception as e:
+            self.error = str(e)
+            self.logger.error(f"Erro no plano em streaming: {e}")
+            if self._close:
+                self._close()
+
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    def _push(self, step: Any):
+        step = normalize_step(step)
+        if not validate_step(step):
+            raise ValueError(f"Passo inválido no plano: {str(step)[:100]}")
+        with self._condition:
+            self._steps.append(step)
+            self._condition.notify_all()
+
+    def wait_for_step(self, timeout: Optional[float] = None) -> bool:
+        """Aguarda o próximo passo; False se o stream terminou ou o timeout venceu sem passo"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._steps or self._finished, timeout)
+            return bool(self._steps)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Aguarda o fim do stream; retorna True se terminou"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._finished, timeout)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    @property
+    def raw_text(self) -> str:
+        return self._parser.text
+
+    # Interface de lista usada pelo laço de execução (task_queue)
+    def pop(self, index: int = 0) -> Dict[str, Any]:
+        """Próximo passo; bloqueia até ele ser gerado ou o stream terminar"""
+        if not self.wait_for_step():
+            raise IndexError("pop from empty plan")
+        with self._condition:
+            return self._steps.popleft()
+
+    def clear(self):
+        """Descarta passos pendentes e interrompe o stream"""
+        with self._condition:
+            self._steps.clear()
+            already_finished = self._finished
+            self._cancelled = True
+        if not already_finished and self._close:
+            self._close()
+
+    def __bool__(self) -> bool:
+        return self.wait_for_step()
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._steps)
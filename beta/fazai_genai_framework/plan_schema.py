@@ -0,0 +1,58 @@
+"""
+Plan Schema - Formato dos Passos para Decodificação Restrita
+JSON schema e gramática GBNF do passo ({descricao, comando, finalizado}) e do
+plano (lista de passos), enviados ao llama.cpp para que a saída do gerente e do
+programador seja sempre JSON válido já na primeira tentativa
+"""
+
+from typing import Dict, Any
+
+# Modos de restrição aceitos em LlamaConfig.constrained_decoding
+CONSTRAINT_MODES = ("json_schema", "grammar", "none")
+
+STEP_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "descricao": {"type": "string"},
+        "comando": {"type": ["string", "null"]},
+        "finalizado": {"type": "boolean"}
+    },
+    "required": ["descricao", "comando"],
+    "additionalProperties": False
+}
+
+PLAN_SCHEMA: Dict[str, Any] = {
+    "type": "array",
+    "items": STEP_SCHEMA,
+    "minItems": 1
+}
+
+_GBNF_COMMON = r'''
+step   ::= "{" ws "\"descricao\"" ws ":" ws string ws "," ws "\"comando\"" ws ":" ws (string | "null") (ws "," ws "\"finalizado\"" ws ":" ws ("true" | "false"))? ws "}"
+string ::= "\"" ([^"\\\x7F\x00-\x1F] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F]))* "\""
+ws     ::= [ \t\n]{0,20}
+'''
+
+STEP_GRAMMAR = "root   ::= step" + _GBNF_COMMON
+
+PLAN_GRAMMAR = 'root   ::= "[" ws step (ws "," ws step)* ws "]"' + _GBNF_COMMON
+
+_SCHEMAS = {"step": STEP_SCHEMA, "plan": PLAN_SCHEMA}
+_GRAMMARS = {"step": STEP_GRAMMAR, "plan": PLAN_GRAMMAR}
+
+def constrain_request(request: Dict[str, Any], kind: str, mode: str = "json_schema") -> Dict[str, Any]:
+    """Aplica a restrição de saída ("step" ou "plan") a uma requisição de chat do llama.cpp"""
+    if kind not in _SCHEMAS:
+        raise ValueError(f"Formato de saída desconhecido: {kind}")
+    if mode not in CONSTRAINT_MODES:
+        raise ValueError(f"Modo de restrição desconhecido: {mode} (use {', '.join(CONSTRAINT_MODES)})")
+
+    if mode == "json_schema":
+        # llama.cpp converte o schema em gramática no servidor
+        request["response_format"] = {"type": "json_object", "schema": _SCHEMAS[kind]}
+    elif mode == "grammar":
+        request.pop("response_format", None)
+        request["extra_body"] = {**request.get("extra_body", {}), "grammar": _GRAMMARS[kind]}
+    else:
+        request["response_format"] = {"type": "json_object"}
+    return request
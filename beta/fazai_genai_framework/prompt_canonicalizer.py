@@ -0,0 +1,88 @@
+"""
+Prompt Canonicalizer - Forma Canônica dos Prompts para Chaves de Cache
+Remove partes voláteis (timestamps, ids, caminhos temporários, outputs longos)
+dos outputs de comandos no histórico para que requisições equivalentes gerem a
+mesma chave. Tarefa e comandos são mantidos: fazem parte do que foi pedido.
+O prompt original continua sendo enviado ao LLM em caso de falta.
+"""
+
+import re
+from typing import Any, Dict, List
+
+# Tamanho máximo da assinatura de um output de comando
+OUTPUT_SIGNATURE_CHARS = 80
+
+# "  - Output: ..." (contexto em texto) ou "Output: ..." (turnos de passo do ContextBuilder)
+_OUTPUT_LINE = re.compile(r"^(\s*(?:-\s*)?Output:\s*)(.*)$")
+_TASK_LINE = re.compile(r"^(\s*Tarefa Original:\s*)(.*)$")
+# Linha de resumo do histórico: "  3. [N2_LOCAL_MEMORIA] comando -> FALHA: erro"
+_SUMMARY_FAILURE = re.compile(r"^(\s*\d+\.\s*\[[^\]]*\]\s.*->\s*FALHA:\s*)(.*)$")
+
+# (padrão, substituição), aplicados em ordem
+_VOLATILE_PATTERNS = [
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?\b"), "<ts>"),
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}\b"), "<date>"),
+    (re.compile(r"\b\d{1,2}:\d{2}:\d{2}(?:\.\d+)?\b"), "<time>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<uuid>"),
+    (re.compile(r"\btask_[0-9a-f]{8}\b"), "<task>"),
+    (re.compile(r"/tmp/[^\s/'\"]+"), "/tmp/<tmp>"),
+    (re.compile(r"/home/[^\s/'\"]+"), "~"),
+    (re.compile(r"/root\b"), "~"),
+    (re.compile(r"/proc/\d+"), "/proc/<pid>"),
+    (re.compile(r"\b(?:pid|PID)[ =:]+\d+\b"), "pid <pid>"),
+    (re.compile(r"\b[0-9a-f]{12,}\b"), "<hex>"),
+]
+
+def _mask_volatile(text: str) -> str:
+    for pattern, replacement in _VOLATILE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def _output_signature(output: str) -> str:
+    """Assinatura estável de um output: números mascarados e tamanho limitado"""
+    signature = re.sub(r"\d+", "<n>", output.strip())
+    signature = " ".join(signature.split())
+    return signature[:OUTPUT_SIGNATURE_CHARS]
+
+def canonicalize_prompt(text: str) -> str:
+    """Forma canônica de um prompt para uso como chave de cache"""
+    lines = []
+    in_output = False
+
+    for raw_line in text.splitlines():
+        # Outputs multilinha terminam na próxima linha em branco
+        if in_output:
+            if raw_line.strip():
+                continue
+            in_output = False
+
+        line = raw_line
+        output_match = _OUTPUT_LINE.match(line)
+        summary_match = _SUMMARY_FAILURE.match(line)
+        task_match = _TASK_LINE.match(line)
+
+        # Só outputs são mascarados; caminhos e pids da tarefa ou dos comandos distinguem pedidos
+        if output_match:
+            line = f"{output_match.group(1).strip()} {_output_signature(_mask_volatile(output_match.group(2)))}"
+            in_output = True
+        elif summary_match:
+            line = summary_match.group(1) + _mask_volatile(summary_match.group(2))
+        elif task_match:
+            line = f"Tarefa Original: {task_match.group(2).strip().lower()}"
+
+        # Indentação das strings com aspas triplas e espaços múltiplos
+        line = " ".join(line.split())
+        if line:
+            lines.append(line)
+
+    return "\n".join(lines)
+
+def canonicalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Aplica a forma canônica ao conteúdo textual de mensagens de chat"""
+    canonical = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            message = {**message, "content": canonicalize_prompt(content)}
+        canonical.append(message)
+    return canonical
@@ -0,0 +1,33 @@
+"""
+SQLite Utils - Conexões SQLite Compartilhadas entre Processos
+Modo WAL com espera em lock (busy timeout) para que vários workers do FazAI
+leiam e gravem os mesmos arquivos de cache sem erros de "database is locked"
+"""
+
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+def connect_sqlite(path: str, shared: bool = False, busy_timeout_ms: int = 5000) -> sqlite3.Connection:
+    """Abre conexão SQLite; em modo compartilhado usa WAL e busy timeout"""
+    connection = sqlite3.connect(
+        path, check_same_thread=False, timeout=busy_timeout_ms / 1000.0
+    )
+
+    if shared:
+        connection.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        # Leitores não bloqueiam o escritor e vice-versa
+        connection.execute("PRAGMA journal_mode = WAL")
+        # Em WAL, NORMAL é seguro contra corrupção e evita fsync por commit
+        connection.execute("PRAGMA synchronous = NORMAL")
+
+    return connection
+
+def enable_wal(path: str, busy_timeout_ms: int = 5000):
+    """Ativa WAL em um arquivo aberto por terceiros (ex.: store do GPTCache); o modo persiste no arquivo"""
+    try:
+        connection = connect_sqlite(path, shared=True, busy_timeout_ms=busy_timeout_ms)
+        connection.close()
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao ativar WAL em {path}: {e}")
@@ -3,16 +3,68 @@ Testes Básicos - GenAI Mini Framework
 Suite de testes para validar funcionalidades principais
 """
 
+import time
 import unittest
 import tempfile
 import json
 import os
+import sys
+import zlib
+import sqlite3
+import subprocess
+import io
+import urllib.error
+from dataclasses import asdict
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
 
+import numpy as np
+
 from genai_mini_framework import GenAIMiniFramework, FrameworkConfig, TaskResult
 from memory_manager import MemoryManager
-from cache_manager import CacheManager
+from cache_manager import CacheManager, CacheStats, CacheNamespace, CacheTicket, chat_cache_keys
 from claude_integration import ClaudeIntegration
+from exact_cache import ExactMatchCache
+from cache_warmup import CacheWarmer
+from cache_eviction import CacheEntryIndex, EvictionPolicy
+from plan_cache import PlanCache, normalize_task_description
+from prompt_canonicalizer import canonicalize_prompt
+from ann_vector_store import create_vector_store
+from gptcache.manager.vector_data.base import VectorData
+from negative_cache import NegativeCache
+from cache_benchmark import BenchmarkResult, CacheBenchmark, load_replay_log, recommend
+from threshold_tuner import ThresholdTuner
+from framework_config import CacheConfig, ContextConfig, EscalationLevel
+from fallback_manager import FallbackManager, FallbackResult, LevelCancelled, _stream_text
+from plan_parser import IncrementalPlanParser, StreamingPlan, extract_plan
+from circuit_breaker import CircuitBreaker, CircuitState, HealthProber, health_url
+from http_transport import role_timeout
+from context_builder import ContextBuilder
+from plan_schema import PLAN_SCHEMA, STEP_SCHEMA, constrain_request
+from level_router import LevelRouter, record_level_attempt
+from endpoint_pool import EndpointPool
+from llm_metrics import LLMCallMetrics, MeteredStream, chat_chunk_content
+from deadline import Deadline, DeadlineExceeded, whole_seconds
+
+def _make_fallback_manager(config=None, memory_manager=None, health_probe_interval=0):
+    """FallbackManager sem cache nem cache negativo, com transporte HTTP já fechado
+
+    Clientes LLM são substituídos pelos testes; a sondagem de saúde fica desligada.
+    """
+    config = config or FrameworkConfig()
+    config.cache.negative_cache_enabled = False
+    config.llama.health_probe_interval_seconds = health_probe_interval
+    cache_manager = MagicMock()
+    cache_manager.is_enabled.return_value = False
+    if memory_manager is None:
+        memory_manager = MagicMock()
+        memory_manager.get_task_history.return_value = []
+        memory_manager.search_memories.return_value = []
+
+    manager = FallbackManager(config, memory_manager, cache_manager)
+    if manager.http_client:
+        manager.http_client.close()
+    return manager
 
 class TestFrameworkConfig(unittest.TestCase):
     """Testes da configuração do framework"""
@@ -68,6 +120,78 @@ class TestMemoryManager(unittest.TestCase):
         self.assertTrue(isinstance(result, str))
         self.assertTrue(mock_client.upsert.called)
 
+    @patch('memory_manager.QdrantClient')
+    @patch('memory_manager.genai')
+    def test_search_timeout_stays_within_deadline(self, mock_genai, mock_qdrant):
+        """Testa que o timeout do Qdrant não passa do prazo e que a busca é pulada abaixo de 1s"""
+        mock_genai.embed_content.return_value = {'embedding': [0.1, 0.2, 0.3]}
+        mock_client = MagicMock()
+        mock_client.search.return_value = []
+        mock_qdrant.return_value = mock_client
+        memory_manager = MemoryManager(self.config)
+
+        memory_manager.search_memories("listar arquivos", timeout=2.7)
+        self.assertLessEqual(mock_client.search.call_args.kwargs["timeout"], 2)
+
+        mock_client.search.reset_mock()
+        self.assertEqual(memory_manager.search_memories("listar arquivos", timeout=0.5), [])
+        mock_client.search.assert_not_called()
+
+    @patch('memory_manager.QdrantClient')
+    @patch('memory_manager.genai')
+    def test_task_histories_are_streamed_per_task(self, mock_genai, mock_qdrant):
+        """Testa que cada tarefa é carregada pelo filtro e que max_tasks encerra a varredura"""
+        def point(**payload):
+            return SimpleNamespace(payload=payload)
+
+        logs = {
+            "t1": [point(task_id="t1", timestamp="2"), point(task_id="t1", timestamp="1")],
+            "t2": [point(task_id="t2", timestamp="1")],
+        }
+
+        def scroll(collection_name, limit, offset=None, scroll_filter=None, **kwargs):
+            if scroll_filter is None:
+                # Varredura em lotes de um ponto
+                ids = ["t1", "t1", None, "t2"]
+                index = offset or 0
+                return [point(task_id=ids[index])], (index + 1 if index + 1 < len(ids) else None)
+            values = {c.key: c.match.value for c in scroll_filter.must}
+            if "outcome_of" in values:
+                return [point(outcome_of=values["outcome_of"], success=True)], None
+            return logs[values["task_id"]], None
+
+        mock_client = MagicMock()
+        mock_client.scroll.side_effect = scroll
+        mock_qdrant.return_value = mock_client
+        memory_manager = MemoryManager(self.config)
+
+        tasks = memory_manager.iter_task_histories(batch_size=1, max_tasks=1)
+        history, outcome = next(tasks)
+        self.assertEqual([entry["timestamp"] for entry in history], ["1", "2"])
+        self.assertEqual(outcome["outcome_of"], "t1")
+        self.assertEqual(list(tasks), [])
+        all_tasks = memory_manager.iter_task_histories(batch_size=1)
+        self.assertEqual([history[0]["task_id"] for history, _ in all_tasks], ["t1", "t2"])
+
+    @patch('memory_manager.QdrantClient')
+    @patch('memory_manager.genai')
+    def test_task_lookups_use_symmetric_embeddings(self, mock_genai, mock_qdrant):
+        """Testa que tarefa comparada com tarefa usa SEMANTIC_SIMILARITY nos dois lados"""
+        mock_genai.embed_content.return_value = {'embedding': [0.1, 0.2, 0.3]}
+        mock_client = MagicMock()
+        mock_client.search.return_value = []
+        mock_qdrant.return_value = mock_client
+        memory_manager = MemoryManager(self.config)
+
+        memory_manager.store_plan("listar arquivos", "Listar arquivos", "fp", [{"comando": "ls"}])
+        memory_manager.search_plan("listar arquivos", "fp", 0.95)
+        memory_manager.store_task_outcome("t1", "Listar arquivos", True,
+                                          EscalationLevel.N2_LOCAL_MEMORIA, 1, 0.5)
+        memory_manager.search_task_outcomes("listar arquivos", score_threshold=0.85)
+
+        task_types = [call.kwargs["task_type"] for call in mock_genai.embed_content.call_args_list]
+        self.assertEqual(task_types, ["SEMANTIC_SIMILARITY"] * 4)
+
 class TestClaudeIntegration(unittest.TestCase):
     """Testes da integração com Claude"""
 
@@ -128,6 +252,1302 @@ class TestClaudeIntegration(unittest.TestCase):
             self.claude_integration._is_personality_content(non_personality)
         )
 
+class TestExactMatchCache(unittest.TestCase):
+    """Testes do cache L1 de correspondência exata"""
+
+    def test_key_ignores_whitespace_and_volatile_params(self):
+        """Testa normalização da chave"""
+        key_a = ExactMatchCache.make_key(
+            "gemma", [{"role": "user", "content": "  listar\n   arquivos "}],
+            {"temperature": 0.0, "timeout": 10}
+        )
+        key_b = ExactMatchCache.make_key(
+            "gemma", [{"role": "user", "content": "listar arquivos"}],
+            {"temperature": 0.0}
+        )
+        key_c = ExactMatchCache.make_key(
+            "gemma", [{"role": "user", "content": "listar arquivos"}],
+            {"temperature": 0.7}
+        )
+
+        self.assertEqual(key_a, key_b)
+        self.assertNotEqual(key_b, key_c)
+
+    def test_lru_bounds(self):
+        """Testa limites de entradas e bytes"""
+        l1 = ExactMatchCache(max_entries=2, max_bytes=1024)
+        l1.put("a", "1")
+        l1.put("b", "2")
+        l1.get("a")
+        l1.put("c", "3")
+
+        self.assertEqual(l1.get("a"), "1")
+        self.assertIsNone(l1.get("b"))
+        self.assertEqual(len(l1), 2)
+
+        l1.put("grande", "x" * 2048)
+        self.assertIsNone(l1.get("grande"))
+
+    def test_disk_tier_shared(self):
+        """Testa tier em disco compartilhado entre instâncias"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "l1.db")
+            ExactMatchCache(disk_path=path).put("chave", "resposta")
+
+            self.assertEqual(ExactMatchCache(disk_path=path).get("chave"), "resposta")
+
+class TestPromptCanonicalizer(unittest.TestCase):
+    """Testes da forma canônica dos prompts"""
+
+    def test_volatile_output_is_removed(self):
+        """Testa que timestamps, pids e caminhos nos outputs não mudam a chave"""
+        template = """
+            Tarefa Original: Listar arquivos em /home/{user}/proj
+
+            Passo 1 (N2_LOCAL_MEMORIA):
+              - Comando: {command}
+              - Output: {output}
+            {extra}
+
+            Resumo dos Passos Anteriores:
+              1. [N2_LOCAL_MEMORIA] make -> FALHA: {error}
+
+            Com base no histórico, qual é o próximo passo?
+            """
+        fields = dict(user="joao", command="date", output="Mon 10:11:12 pid=4412 /tmp/tmpab12",
+                      extra="linha 1", error="erro em /tmp/tmpab12 (pid 4412)")
+        prompt_a = template.format(**fields)
+        prompt_b = template.format(**dict(fields, output="Mon 09:00:01 pid=77 /tmp/tmpzz",
+                                          extra="linha 2", error="erro em /tmp/tmpzz (pid 77)"))
+        self.assertEqual(canonicalize_prompt(prompt_a), canonicalize_prompt(prompt_b))
+
+    def test_task_and_commands_are_kept(self):
+        """Testa que tarefas e comandos diferentes não colidem"""
+        template = """
+            Tarefa Original: {task}
+
+            Passo 1 (N2_LOCAL_MEMORIA):
+              - Comando: {command}
+              - Output: ok
+            """
+        fields = dict(task="Listar arquivos em /home/joao/proj", command="kill 4412")
+        canonical = canonicalize_prompt(template.format(**fields))
+
+        for changed in (dict(task="Listar arquivos em /home/maria/proj"),
+                        dict(task="Apagar /tmp/x"),
+                        dict(command="kill 77"),
+                        dict(command="rm -rf /tmp/build-a")):
+            self.assertNotEqual(canonicalize_prompt(template.format(**dict(fields, **changed))),
+                                canonical)
+        self.assertNotEqual(canonicalize_prompt("Tarefa Original: Apagar /tmp/x"),
+                            canonicalize_prompt("Tarefa Original: Apagar /tmp/y"))
+
+    def test_step_turn_output_is_masked(self):
+        """Testa a linha de output dos turnos de passo, sem o '- ' do contexto em texto"""
+        turn = "Passo 1 (N2_LOCAL_MEMORIA): SUCESSO\nOutput: {}\n\nQual é o próximo passo?"
+        canonical = canonicalize_prompt(turn.format("Mon 10:11:12 pid=4412 /tmp/tmpab12"))
+        self.assertEqual(canonical, canonicalize_prompt(turn.format("Mon 09:00:01 pid=77 /tmp/tmpzz")))
+        self.assertIn("Output: Mon <time> pid <pid> /tmp/<tmp>", canonical)
+        self.assertIn("Qual é o próximo passo?", canonical)
+
+    def test_builder_turns_share_cache_key(self):
+        """Testa que turnos do ContextBuilder com outputs voláteis geram a mesma chave"""
+        builder = ContextBuilder(ContextConfig())
+
+        def request(output):
+            history = [{"task_id": "t1", "timestamp": "2024-01-01T00:00", "level": "N2_LOCAL_MEMORIA",
+                        "step_desc": "Ver data", "command": "date", "success": True, "output": output}]
+            turns = builder.build_turns("tarefa", history, tail="\n\nPróximo passo?")
+            return {"model": "gerente", "messages": turns}
+
+        key_a, _ = chat_cache_keys(request("2024-01-01 10:11:12 backup concluído"))
+        key_b, _ = chat_cache_keys(request("2024-03-05 09:00:01 backup concluído"))
+        self.assertEqual(key_a, key_b)
+        key_c, _ = chat_cache_keys(dict(request("2024-01-01 10:11:12 backup concluído"), model="outro"))
+        self.assertNotEqual(key_a, key_c)
+
+class TestCacheStats(unittest.TestCase):
+    """Testes da instrumentação do cache"""
+
+    def test_record_and_restore(self):
+        """Testa contagem por nível, economia estimada e persistência"""
+        stats = CacheStats()
+        stats.llm_latency.observe(2.0)
+        stats.record_miss(0.010)
+        stats.record_hit("l1", 0.0001)
+        stats.record_hit("semantic", 0.020)
+
+        self.assertEqual(stats.total_requests, 3)
+        self.assertEqual(stats.l1_hits, 1)
+        self.assertEqual(stats.semantic_hits, 1)
+        self.assertAlmostEqual(stats.hit_rate, 2 / 3)
+        self.assertGreater(stats.latency_saved_seconds, 3.9)
+
+        restored = CacheStats.from_dict(json.loads(json.dumps(asdict(stats))))
+        self.assertEqual(restored.hits, 2)
+        self.assertEqual(restored.lookup_latency.samples, 3)
+
+class TestCacheEviction(unittest.TestCase):
+    """Testes dos limites, TTL e políticas de evicção"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def _index(self, name, **kwargs):
+        return CacheEntryIndex(os.path.join(self.temp_dir.name, name), **kwargs)
+
+    def test_lfu_keeps_frequent_entries(self):
+        """Testa política LFU com limite de entradas"""
+        index = self._index("lfu.db", policy=EvictionPolicy.LFU, max_entries=2)
+        index.add("p1", "a1")
+        index.add("p2", "a2")
+        index.touch_answer("a1")
+        index.add("p3", "a3")
+
+        removed = index.evict()
+        self.assertEqual([entry.prompt for entry in removed], ["p2"])
+        self.assertEqual(index.count(), 2)
+
+    def test_cost_aware_keeps_expensive_answers(self):
+        """Testa que respostas caras (supervisor) sobrevivem à evicção"""
+        index = self._index("cost.db", policy=EvictionPolicy.COST_AWARE, max_entries=2)
+        index.add("barato", "x", cost=0.1)
+        index.add("supervisor", "y", cost=50.0)
+        index.add("medio", "z", cost=1.0)
+
+        self.assertEqual([entry.prompt for entry in index.evict()], ["barato"])
+
+    def test_ttl_expiration(self):
+        """Testa expiração por TTL"""
+        index = self._index("ttl.db", ttl_seconds=60)
+        index.add("p", "a", ttl_seconds=-1)
+
+        self.assertFalse(index.touch_answer("a"))
+        self.assertEqual(len(index.evict()), 1)
+        self.assertTrue(index.needs_compaction(0.25))
+
+    def test_touches_are_written_in_batches(self):
+        """Testa que acessos ficam em memória até o lote e chegam à evicção"""
+        index = self._index("batch.db", policy=EvictionPolicy.LFU, max_entries=1,
+                            write_batch_size=3)
+        index.add("p1", "a1")
+        index.add("p2", "a2")
+        self.assertTrue(index.touch_answer("a1"))
+        self.assertTrue(index.touch_answer("a1"))
+
+        hits = lambda: index._db.execute(
+            "SELECT hits FROM cache_entries WHERE prompt = 'p1'").fetchone()[0]
+        self.assertEqual(hits(), 0)
+        index.touch_answer("a1")
+        self.assertEqual(hits(), 3)
+
+        index.touch_answer("a1")
+        self.assertEqual([entry.prompt for entry in index.evict()], ["p2"])
+        self.assertEqual(hits(), 4)
+
+class TestCacheWarmer(unittest.TestCase):
+    """Testes do warm-up do cache a partir do histórico"""
+
+    def test_warm_up_successful_level_2_steps(self):
+        """Testa que só passos N2 de tarefas bem-sucedidas são aquecidos"""
+        history = [
+            {"task_id": "t1", "step_desc": "listar", "command": "ls", "success": True,
+             "level": "N2_LOCAL_MEMORIA", "original_task": "listar arquivos", "output": "a.py"},
+            {"task_id": "t1", "step_desc": "contar", "command": "ls | wc -l", "success": True,
+             "level": "N3_EQUIPE_LOCAL", "original_task": "listar arquivos", "output": "1"},
+        ]
+        failed = [dict(history[0], task_id="t2", success=False)]
+
+        memory_manager = MagicMock()
+        memory_manager.iter_task_histories.return_value = iter([
+            (history, {"success": True, "final_level": "N2_LOCAL_MEMORIA",
+                       "original_task": "listar arquivos"}),
+            (failed, None)
+        ])
+        fallback_manager = MagicMock()
+        fallback_manager.known_failures.return_value = "Falhas conhecidas: rm -rf\n"
+        fallback_manager.build_level_2_request.side_effect = lambda task, steps, system, **kwargs: {
+            "model": "gemma", "messages": [{"role": "user", "content": f"{task} {len(steps)}"}]
+        }
+        cache_manager = MagicMock()
+        cache_manager.warm_chat.return_value = True
+
+        warmer = CacheWarmer(FrameworkConfig(), memory_manager, cache_manager, fallback_manager)
+        stats = warmer.warm_up(max_tasks=10, batch_size=1)
+
+        self.assertEqual(stats["tasks_scanned"], 2)
+        self.assertEqual(stats["tasks_successful"], 1)
+        # Passo N2 + encerramento pelo gerente
+        self.assertEqual(stats["entries_warmed"], 2)
+        first_call = fallback_manager.build_level_2_request.call_args_list[0]
+        self.assertEqual(first_call[0][1], [])
+        # Mesmo prompt das chamadas reais, com as falhas conhecidas e o slot da tarefa
+        self.assertEqual(first_call[1], {"task_id": "t1", "known_failures": "Falhas conhecidas: rm -rf\n"})
+
+class TestAnnVectorStore(unittest.TestCase):
+    """Testes da seleção do store vetorial"""
+
+    def test_flat_store_uses_default_manager(self):
+        """Testa que o índice plano (e o nome antigo "sqlite") não cria índice ANN"""
+        self.assertIsNone(create_vector_store("faiss_flat", "unused.index", 384))
+        self.assertIsNone(create_vector_store("sqlite", "unused.index", 384))
+
+    def test_unknown_store_is_rejected(self):
+        """Testa erro para backend desconhecido"""
+        with self.assertRaises(ValueError):
+            create_vector_store("annoy", "unused.index", 384)
+
+    def test_faiss_rebuilds_after_tombstones(self):
+        """Testa que removidos acima do limite são descartados do índice FAISS"""
+        path = os.path.join(tempfile.mkdtemp(), "cache.faiss.index")
+        store = create_vector_store("faiss", path, 4, rebuild_ratio=0.25)
+        vectors = np.eye(4, dtype="float32").repeat(2, axis=0)
+        store.mul_add([VectorData(id=index, data=vector) for index, vector in enumerate(vectors)])
+
+        store.delete([0])
+        self.assertEqual((store._count_raw(), len(store._deleted)), (8, 1))
+        store.delete([1])
+        self.assertEqual((store._count_raw(), len(store._deleted)), (6, 0))
+        self.assertNotIn(store.search(vectors[0], top_k=1)[0][1], (0, 1))
+
+        store.flush()
+        reloaded = create_vector_store("faiss", path, 4)
+        self.assertEqual(reloaded.count(), 6)
+        self.assertIn(reloaded.search(vectors[2], top_k=1)[0][1], (2, 3))
+
+class TestNegativeCache(unittest.TestCase):
+    """Testes do cache de falhas conhecidas"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = NegativeCache(os.path.join(self.temp_dir, "negative.db"), fingerprint="env-a")
+
+    def test_failure_is_known_until_forgotten(self):
+        """Testa registro, normalização do comando e remoção após sucesso"""
+        self.cache.record_failure("apt  install foo ;", "E: Unable to locate package foo\n...")
+
+        failure = self.cache.lookup("apt install foo")
+        self.assertIsNotNone(failure)
+        self.assertEqual(failure["error"], "E: Unable to locate package foo")
+        self.assertIn("apt install foo (1x)", self.cache.format_known_failures())
+
+        self.cache.forget("apt install foo")
+        self.assertIsNone(self.cache.lookup("apt install foo"))
+        self.assertEqual(self.cache.format_known_failures(), "")
+
+    def test_failures_are_scoped_by_environment_and_ttl(self):
+        """Testa que falhas não vazam entre ambientes e expiram"""
+        self.cache.record_failure("make", "erro")
+        other = NegativeCache(self.cache.db_path, fingerprint="env-b")
+        self.assertIsNone(other.lookup("make"))
+
+        expired = NegativeCache(self.cache.db_path, ttl_seconds=-1, fingerprint="env-c")
+        expired.record_failure("make", "erro")
+        self.assertIsNone(expired.lookup("make"))
+        self.assertEqual(expired.purge_expired(), 1)
+
+    def _run_task(self, plans, outcomes):
+        """Executa run_task com planos e resultados de comandos pré-definidos"""
+        with patch.object(GenAIMiniFramework, '_initialize_components'):
+            framework = GenAIMiniFramework(FrameworkConfig())
+        framework.memory_manager = MagicMock()
+        framework.fallback_manager = MagicMock()
+        framework.fallback_manager.negative_cache = self.cache
+        framework.fallback_manager.plan_cache.is_enabled.return_value = False
+        framework.fallback_manager.execute_fallback_chain.side_effect = [
+            FallbackResult(True, EscalationLevel.N2_LOCAL_MEMORIA, plan, None, 0.1)
+            for plan in plans
+        ]
+        framework._execute_command = MagicMock(side_effect=outcomes)
+
+        result = framework._run_task("compilar o projeto", max_steps=10)
+        executed = [call.args[0] for call in framework._execute_command.call_args_list]
+        return result, executed
+
+    def test_known_failure_is_skipped_in_the_same_task(self):
+        """Testa que o comando que falhou não é reexecutado sem progresso na tarefa"""
+        finish = [{"descricao": "fim", "comando": None}]
+        result, executed = self._run_task(
+            [[{"comando": "make"}], [{"comando": "make"}], finish],
+            [(False, "make: *** erro")]
+        )
+        self.assertTrue(result.success)
+        self.assertEqual(executed, ["make"])
+
+    def test_known_failure_is_retried_after_progress(self):
+        """Testa nova tentativa após um passo de sucesso e em outra tarefa"""
+        self.cache.record_failure("make", "erro antigo", task_id="task_outra")
+        finish = [{"descricao": "fim", "comando": None}]
+        result, executed = self._run_task(
+            [[{"comando": "make"}], [{"comando": "./configure"}, {"comando": "make"}], finish],
+            [(False, "make: *** erro"), (True, "ok"), (True, "ok")]
+        )
+        self.assertTrue(result.success)
+        self.assertEqual(executed, ["make", "./configure", "make"])
+        self.assertIsNone(self.cache.lookup("make"))
+
+class TestCacheAdmission(unittest.TestCase):
+    """Testes da admissão de respostas no cache por resultado"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.namespace = CacheNamespace(
+            "gerente", "gerente", "modelo", MagicMock(), 0.98,
+            l1=ExactMatchCache(),
+            index=CacheEntryIndex(os.path.join(self.temp_dir, "index.db")),
+            admission=True
+        )
+
+    @patch('cache_manager.gptcache_put')
+    def test_provisional_response_is_not_served_until_commit(self, mock_put):
+        """Testa que a resposta só entra no cache após commit"""
+        self.namespace.hold("key", "prompt", '{"comando": "ls"}')
+        self.assertIsNone(self.namespace.l1.get("key"))
+        mock_put.assert_not_called()
+
+        self.assertTrue(self.namespace.commit("key"))
+        self.assertEqual(self.namespace.l1.get("key"), '{"comando": "ls"}')
+        self.assertEqual(self.namespace.index.count(), 1)
+
+    @patch('cache_manager.gptcache_put')
+    def test_identical_answers_are_kept_per_request(self, mock_put):
+        """Testa que respostas idênticas de prompts diferentes têm desfechos próprios"""
+        self.namespace.hold("key1", "listar", "ls")
+        self.namespace.hold("key2", "listar tudo", "ls")
+        self.assertEqual(self.namespace.pending_count(), 2)
+
+        self.assertTrue(self.namespace.commit("key1"))
+        self.assertEqual(self.namespace.reject("key2", "ls"), 1)
+        self.assertEqual(self.namespace.l1.get("key1"), "ls")
+        self.assertIsNone(self.namespace.l1.get("key2"))
+        self.assertEqual(self.namespace.index.count(), 1)
+
+    @patch('cache_manager.gptcache_put')
+    def test_reject_evicts_committed_response(self, mock_put):
+        """Testa que um desfecho negativo remove resposta já admitida"""
+        self.namespace.hold("key", "prompt", "resposta")
+        self.namespace.commit("key")
+
+        self.assertEqual(self.namespace.reject("key", "resposta"), 1)
+        self.assertIsNone(self.namespace.l1.get("key"))
+        self.assertEqual(self.namespace.index.count(), 0)
+
+        self.namespace.hold("key2", "prompt2", "ruim")
+        self.assertEqual(self.namespace.reject("key2", "ruim"), 1)
+        self.assertFalse(self.namespace.commit("key2"))
+
+class TestThresholdTuner(unittest.TestCase):
+    """Testes do ajuste online de threshold por papel"""
+
+    def setUp(self):
+        self.config = CacheConfig(similarity_threshold=0.95, autotune_min_samples=10)
+        self.applied = []
+        self.tuner = ThresholdTuner(self.config, lambda role, value: self.applied.append((role, value)))
+
+    def test_false_hits_raise_threshold_within_bounds(self):
+        """Testa que acertos falsos sobem o threshold, sem passar do máximo"""
+        for _ in range(10):
+            self.tuner.record("gerente", False)
+        self.assertEqual(self.applied, [("gerente", 0.955)])
+
+        for _ in range(200):
+            self.tuner.record("gerente", False)
+        self.assertEqual(self.tuner.thresholds()["gerente"], self.config.autotune_max_threshold)
+
+    def test_hysteresis_keeps_threshold_inside_dead_band(self):
+        """Testa que taxa de acertos falsos entre low e high não altera o threshold"""
+        self.config.autotune_min_samples = 40
+        for index in range(40):
+            # 1 falha em 40 (2,5%): dentro da banda morta de 1% a 5%
+            self.tuner.record("supervisor", index != 5)
+        self.assertEqual(self.applied, [])
+        self.assertEqual(self.tuner.get_stats()["supervisor"]["threshold"], 0.95)
+
+class TestHedgedFallback(unittest.TestCase):
+    """Testes da execução especulativa entre níveis"""
+
+    def _make_manager(self, **hedging):
+        config = FrameworkConfig()
+        config.hedging.enabled = True
+        for key, value in hedging.items():
+            setattr(config.hedging, key, value)
+        return _make_fallback_manager(config)
+
+    @staticmethod
+    def _result(level, success, delay=0.0):
+        def _execute(*args):
+            time.sleep(delay)
+            return FallbackResult(success, level, {"comando": "ls"} if success else None,
+                                  None if success else "erro", delay)
+        return _execute
+
+    def test_slow_level_2_is_hedged_by_level_3(self):
+        """Testa que N3 começa após o prazo de N2 e vence se responder primeiro"""
+        manager = self._make_manager(default_deadline_seconds=0.05)
+        manager._execute_level_2 = self._result(EscalationLevel.N2_LOCAL_MEMORIA, True, delay=1.0)
+        manager._execute_level_3 = self._result(EscalationLevel.N3_EQUIPE_LOCAL, True)
+
+        result = manager.execute_fallback_chain("task", "tarefa")
+        self.assertEqual(result.level, EscalationLevel.N3_EQUIPE_LOCAL)
+
+    def test_fast_level_2_wins_without_hedging(self):
+        """Testa que N2 dentro do prazo não dispara os níveis seguintes"""
+        manager = self._make_manager(default_deadline_seconds=5.0)
+        manager._execute_level_2 = self._result(EscalationLevel.N2_LOCAL_MEMORIA, True)
+        manager._execute_level_3 = MagicMock()
+
+        result = manager.execute_fallback_chain("task", "tarefa")
+        self.assertEqual(result.level, EscalationLevel.N2_LOCAL_MEMORIA)
+        manager._execute_level_3.assert_not_called()
+
+    def test_losing_level_stream_is_closed(self):
+        """Testa que o nível perdedor é cancelado e seu stream fechado na hora"""
+        manager = self._make_manager(default_deadline_seconds=0.05)
+        stream = MagicMock()
+        stream.__iter__.return_value = iter([])
+        started = {}
+
+        def _slow_level_2(task_id, original_task, deadline, cancel_event):
+            started["stream"] = manager._metered_call(
+                'gerente', EscalationLevel.N2_LOCAL_MEMORIA, [], "gemma", lambda: stream,
+                stream=True, content_of=chat_chunk_content, cancel_event=cancel_event
+            )
+            started["event"] = cancel_event
+            cancel_event.wait(2.0)
+            return FallbackResult(False, EscalationLevel.N2_LOCAL_MEMORIA, None, "cancelado", 0.0)
+
+        manager._execute_level_2 = _slow_level_2
+        manager._execute_level_3 = self._result(EscalationLevel.N3_EQUIPE_LOCAL, True, delay=0.1)
+
+        result = manager.execute_fallback_chain("task", "tarefa")
+        self.assertEqual(result.level, EscalationLevel.N3_EQUIPE_LOCAL)
+        self.assertTrue(started["event"].is_set())
+        stream.close.assert_called_once()
+        with self.assertRaises(LevelCancelled):
+            list(_stream_text(started["stream"], chat_chunk_content, started["event"]))
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Testes do disjuntor por papel dos servidores Llama.cpp"""
+
+    def test_breaker_opens_and_recovers_through_half_open(self):
+        """Testa fechado -> aberto após falhas -> meio-aberto com uma chamada de teste -> fechado"""
+        breaker = CircuitBreaker("analista", failure_threshold=2, recovery_seconds=0.05)
+        breaker.record_failure("timeout")
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+        breaker.record_failure("timeout")
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow_request())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        # Só uma chamada de teste por vez no meio-aberto
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+
+        breaker.record_probe(False, "Connection refused")
+        self.assertEqual(breaker.to_dict()["state"], "open")
+        self.assertEqual(health_url("http://localhost:8001/v1"), "http://localhost:8001/health")
+
+    def test_open_circuit_skips_level_instantly(self):
+        """Testa que N3 falha sem chamar o analista quando o programador está aberto"""
+        manager = _make_fallback_manager()
+        manager.llm_clients = {role: MagicMock() for role in manager.config.llama.urls}
+        manager.circuit_breakers["programador"].record_probe(False, "Connection refused")
+
+        result = manager._execute_level_3("task", "tarefa")
+        self.assertFalse(result.success)
+        self.assertIn("circuito aberto", result.error)
+        manager.llm_clients["analista"].chat.completions.create.assert_not_called()
+        self.assertEqual(manager.get_circuit_status()["programador"]["state"], "open")
+
+    def test_probe_needs_consecutive_failures_to_open(self):
+        """Testa que só failure_threshold sondagens seguidas com falha abrem o circuito"""
+        breaker = CircuitBreaker("analista")
+        endpoint_health = []
+        prober = HealthProber({"analista": ["http://localhost:8001/v1"]}, {"analista": breaker},
+                              on_endpoint=lambda role, url, healthy: endpoint_health.append(healthy),
+                              failure_threshold=3)
+        results = iter([(False, "timeout"), (False, "timeout"), (True, ""),
+                        (False, "timeout"), (False, "timeout"), (False, "timeout")])
+        with patch.object(prober, "_probe_url", side_effect=lambda url: next(results)):
+            for _ in range(5):
+                prober.probe("analista")
+                self.assertEqual(breaker.state, CircuitState.CLOSED)
+            prober.probe("analista")
+        self.assertTrue(breaker.is_open())
+        # Réplica só é dada como fora após a terceira falha seguida
+        self.assertEqual(endpoint_health, [True, False])
+
+    def test_probe_treats_busy_503_as_healthy(self):
+        """Testa que 503 'no slot available' conta como vivo e 503 ao carregar não"""
+        prober = HealthProber({"analista": ["http://localhost:8001/v1"]}, {})
+
+        def http_503(body):
+            return urllib.error.HTTPError("http://localhost:8001/health", 503, "Service Unavailable",
+                                          {}, io.BytesIO(body))
+
+        with patch("urllib.request.urlopen",
+                   side_effect=http_503(b'{"error": {"message": "no slot available"}}')):
+            self.assertEqual(prober._probe_url("http://localhost:8001/v1"), (True, ""))
+        with patch("urllib.request.urlopen", side_effect=http_503(b'{"error": "Loading model"}')):
+            healthy, error = prober._probe_url("http://localhost:8001/v1")
+        self.assertFalse(healthy)
+        self.assertIn("503", error)
+
+    def test_shutdown_stops_health_prober(self):
+        """Testa que o shutdown do framework encerra a thread de sondagem"""
+        with patch.object(HealthProber, "probe_all"):
+            manager = _make_fallback_manager(health_probe_interval=60)
+            thread = manager.health_prober._thread
+            self.assertTrue(thread.is_alive())
+
+            with patch.object(GenAIMiniFramework, "_initialize_components"):
+                framework = GenAIMiniFramework(manager.config)
+            framework.fallback_manager = manager
+            framework.cache_manager = manager.cache_manager
+            framework.shutdown()
+        self.assertFalse(thread.is_alive())
+        manager.cache_manager.close.assert_called_once()
+
+class TestHttpTransport(unittest.TestCase):
+    """Testes do transporte HTTP compartilhado entre os papéis"""
+
+    def test_roles_share_one_client_with_own_timeouts(self):
+        """Testa um único httpx.Client para todos os papéis e timeout de leitura por papel"""
+        manager = _make_fallback_manager()
+        config = manager.config
+        clients = [manager.llm_clients[role]._client for role in config.llama.urls]
+        self.assertTrue(all(client._client is manager.http_client for client in clients))
+        self.assertEqual(role_timeout(config.llama, "gerente").read, 60.0)
+        self.assertEqual(role_timeout(config.llama, "analista").read, config.llama.read_timeout_seconds)
+        self.assertEqual(role_timeout(config.llama, "analista").connect, config.llama.connect_timeout_seconds)
+
+class TestContextBuilder(unittest.TestCase):
+    """Testes do contexto de histórico com orçamento de tokens"""
+
+    @staticmethod
+    def _history(count):
+        return [
+            {"task_id": "t1", "timestamp": f"2024-01-01T00:{i:02d}", "level": "N2_LOCAL_MEMORIA",
+             "step_desc": f"Passo {i}", "command": f"cmd_{i}", "success": i % 3 != 0,
+             "output": f"saída do comando {i} " * 40}
+            for i in range(count)
+        ]
+
+    def test_long_history_fits_budget_with_recent_failure_verbatim(self):
+        """Testa que o contexto cabe no orçamento e mantém a falha mais recente na íntegra"""
+        builder = ContextBuilder(ContextConfig(role_budgets={"gerente": 400}))
+        history = self._history(45)
+
+        context = builder.build("tarefa longa", history, "gerente")
+        self.assertLessEqual(builder.counter.count(context), 400)
+        self.assertIn("Resumo dos Passos Anteriores:", context)
+        # Passo 43 (índice 42) é a falha mais recente
+        self.assertIn("Passo 43 (N2_LOCAL_MEMORIA):", context)
+        self.assertIn("Passo 45 (N2_LOCAL_MEMORIA):", context)
+
+    def test_rolling_summary_only_summarizes_new_steps(self):
+        """Testa que o resumo em cache é estendido a cada novo passo"""
+        builder = ContextBuilder(ContextConfig())
+        history = self._history(10)
+        builder.build("tarefa", history)
+
+        with patch.object(builder, "_summary_line", wraps=builder._summary_line) as summary_line:
+            builder.build("tarefa", history + self._history(11)[10:])
+            self.assertEqual(summary_line.call_count, 1)
+
+    def test_turns_keep_previous_round_as_prefix(self):
+        """Testa que a rodada seguinte só acrescenta turnos ao final da conversa anterior"""
+        builder = ContextBuilder(ContextConfig())
+        history = self._history(4)
+
+        previous = builder.build_turns("tarefa", history[:3], tail="\nPróximo passo?")
+        current = builder.build_turns("tarefa", history, tail="\nPróximo passo?")
+        self.assertEqual(current[:len(previous) - 1], previous[:-1])
+        self.assertTrue(previous[-1]["content"].startswith(current[len(previous) - 1]["content"]))
+        self.assertEqual([m["role"] for m in current[:3]], ["user", "assistant", "user"])
+
+class TestPlanSchema(unittest.TestCase):
+    """Testes da decodificação restrita dos planejadores"""
+
+    def test_constraint_modes(self):
+        """Testa schema em response_format e gramática GBNF mesclada ao extra_body"""
+        request = constrain_request({"messages": []}, "plan")
+        self.assertEqual(request["response_format"]["schema"], PLAN_SCHEMA)
+
+        request = constrain_request(
+            {"response_format": {"type": "json_object"}, "extra_body": {"cache_prompt": True}},
+            "step", "grammar"
+        )
+        self.assertNotIn("response_format", request)
+        self.assertTrue(request["extra_body"]["cache_prompt"])
+        self.assertTrue(request["extra_body"]["grammar"].startswith("root   ::= step"))
+
+        with self.assertRaises(ValueError):
+            constrain_request({}, "step", "regex")
+
+    def test_level_2_request_is_constrained_to_step(self):
+        """Testa que a requisição do gerente leva o schema do passo"""
+        manager = _make_fallback_manager()
+        request = manager.build_level_2_request("listar arquivos", [], "sistema", task_id="t1")
+        self.assertEqual(request["response_format"]["schema"], STEP_SCHEMA)
+        self.assertTrue(request["extra_body"]["cache_prompt"])
+        # Sem slots configurados o servidor escolhe (nada de todas as tarefas no slot 0)
+        self.assertNotIn("id_slot", request["extra_body"])
+
+        manager.config.llama.server_slots = {"gerente": 4}
+        slots = {manager.build_level_2_request("tarefa", [], "sistema", task_id=f"t{i}")["extra_body"]["id_slot"]
+                 for i in range(20)}
+        self.assertTrue(slots <= {0, 1, 2, 3})
+        self.assertGreater(len(slots), 1)
+
+class TestLevelExecution(unittest.TestCase):
+    """Testes de ponta a ponta de N3 e N4 com clientes falsos"""
+
+    PLAN = '[{"descricao": "listar", "comando": "ls"}, {"descricao": "contar", "comando": "wc -l"}]'
+
+    def _make_manager(self, streaming=False):
+        config = FrameworkConfig()
+        config.enable_streaming = streaming
+        return _make_fallback_manager(config)
+
+    @staticmethod
+    def _chat_client(content):
+        client = MagicMock()
+        client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
+        return client
+
+    @classmethod
+    def _streaming_chat_client(cls, pieces):
+        client = MagicMock()
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+                  for piece in pieces]
+        chunks.append(SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=50, completion_tokens=30)))
+        client.chat.completions.create.return_value = iter(chunks)
+        return client
+
+    @classmethod
+    def _plan_pieces(cls):
+        return [cls.PLAN[i:i + 7] for i in range(0, len(cls.PLAN), 7)]
+
+    def _assert_streamed_plan(self, result, tickets):
+        self.assertTrue(result.success, result.error)
+        self.assertIsInstance(result.response, StreamingPlan)
+        self.assertEqual(result.response.pop(0)["comando"], "ls")
+        self.assertEqual(result.response.pop(0)["comando"], "wc -l")
+        self.assertTrue(result.response.wait(2.0))
+        # Resposta completa vira ticket de admissão no cache
+        self.assertEqual(len(result.cache_tickets), tickets)
+        self.assertEqual(result.cache_tickets[-1].answer, self.PLAN)
+        metrics = result.llm_calls[-1]
+        self.assertTrue(metrics.streaming)
+        self.assertIsNotNone(metrics.ttft_seconds)
+
+    def test_level_3_builds_plan_from_analyst_and_programmer(self):
+        """Testa N3 de ponta a ponta: prompt do programador com o formato JSON literal"""
+        manager = self._make_manager()
+        manager.llm_clients = {
+            "analista": self._chat_client("Liste os arquivos e conte as linhas."),
+            "programador": self._chat_client(self.PLAN)
+        }
+
+        result = manager._execute_level_3("task", "contar arquivos")
+        self.assertTrue(result.success, result.error)
+        self.assertEqual([step["comando"] for step in result.response], ["ls", "wc -l"])
+        self.assertEqual(len(result.cache_tickets), 2)
+
+        request = manager.llm_clients["programador"].chat.completions.create.call_args.kwargs
+        prompt = request["messages"][-1]["content"]
+        self.assertIn('[{"descricao": "...", "comando": "..."}, ...]', prompt)
+        self.assertIn("Liste os arquivos e conte as linhas.", prompt)
+
+    def test_level_4_builds_plan_from_supervisor(self):
+        """Testa N4 de ponta a ponta: prompt do supervisor com o formato JSON literal"""
+        manager = self._make_manager()
+        manager.genai_model = MagicMock()
+        manager.genai_model.generate_content.return_value = SimpleNamespace(text=f"```json\n{self.PLAN}\n```")
+
+        result = manager._execute_level_4("task", "contar arquivos")
+        self.assertTrue(result.success, result.error)
+        self.assertEqual([step["comando"] for step in result.response], ["ls", "wc -l"])
+        prompt = manager.genai_model.generate_content.call_args.args[0]
+        self.assertIn('[{"descricao": "...", "comando": "..."}, ...]', prompt)
+        self.assertIn("Tarefa Original: contar arquivos", prompt)
+
+    def test_level_3_streams_constrained_programmer_plan(self):
+        """Testa N3 em streaming: programador com schema do plano e passos liberados do stream"""
+        manager = self._make_manager(streaming=True)
+        manager.llm_clients = {
+            "analista": self._chat_client("Liste os arquivos e conte as linhas."),
+            "programador": self._streaming_chat_client(self._plan_pieces())
+        }
+
+        result = manager._execute_level_3("task", "contar arquivos")
+        self._assert_streamed_plan(result, tickets=2)
+        self.assertEqual(result.llm_calls[-1].completion_tokens, 30)
+
+        request = manager.llm_clients["programador"].chat.completions.create.call_args.kwargs
+        self.assertTrue(request["stream"])
+        self.assertEqual(request["stream_options"], {"include_usage": True})
+        self.assertEqual(request["response_format"]["schema"], PLAN_SCHEMA)
+
+    def test_level_3_stream_uses_grammar_when_configured(self):
+        """Testa N3 em streaming com a gramática GBNF do plano no extra_body"""
+        manager = self._make_manager(streaming=True)
+        manager.config.llama.constrained_decoding = "grammar"
+        manager.llm_clients = {
+            "analista": self._chat_client("Liste os arquivos."),
+            "programador": self._streaming_chat_client(self._plan_pieces())
+        }
+
+        result = manager._execute_level_3("task", "contar arquivos")
+        self._assert_streamed_plan(result, tickets=2)
+        request = manager.llm_clients["programador"].chat.completions.create.call_args.kwargs
+        self.assertNotIn("response_format", request)
+        self.assertIn("grammar", request["extra_body"])
+
+    def test_level_3_stream_without_steps_fails(self):
+        """Testa que stream do programador sem passo válido falha o nível"""
+        manager = self._make_manager(streaming=True)
+        manager.llm_clients = {
+            "analista": self._chat_client("Liste os arquivos."),
+            "programador": self._streaming_chat_client(["Não sei ", "responder."])
+        }
+
+        result = manager._execute_level_3("task", "contar arquivos")
+        self.assertFalse(result.success)
+        self.assertEqual(result.level, EscalationLevel.N3_EQUIPE_LOCAL)
+
+    def test_level_4_streams_supervisor_plan(self):
+        """Testa N4 em streaming: chunks do GenAI liberam os passos do plano"""
+        manager = self._make_manager(streaming=True)
+        manager.genai_model = MagicMock()
+        manager.genai_model.generate_content.return_value = iter(
+            [SimpleNamespace(text=piece) for piece in self._plan_pieces()]
+        )
+
+        result = manager._execute_level_4("task", "contar arquivos")
+        self._assert_streamed_plan(result, tickets=1)
+        self.assertTrue(manager.genai_model.generate_content.call_args.kwargs["stream"])
+
+class TestLevelRouter(unittest.TestCase):
+    """Testes do roteamento adaptativo do nível inicial"""
+
+    @staticmethod
+    def _similar_task(n2_success):
+        level_stats = {}
+        record_level_attempt(level_stats, EscalationLevel.N2_LOCAL_MEMORIA, 6.0, success=n2_success)
+        if not n2_success:
+            record_level_attempt(level_stats, EscalationLevel.N3_EQUIPE_LOCAL, 20.0, success=True)
+        return {"score": 0.95, "level_stats": level_stats}
+
+    def _route(self, outcomes):
+        memory_manager = MagicMock()
+        memory_manager.search_task_outcomes.return_value = outcomes
+        return LevelRouter(FrameworkConfig(), memory_manager).route("instalar pacote")
+
+    def test_skips_level_2_when_it_usually_fails(self):
+        """Testa início em N3 quando N2 falha em quase todas as tarefas similares"""
+        decision = self._route([self._similar_task(False) for _ in range(19)] + [self._similar_task(True)])
+        self.assertEqual(decision.level, EscalationLevel.N3_EQUIPE_LOCAL)
+        self.assertGreater(decision.estimated_savings_seconds, 1.0)
+
+    def test_defaults_to_level_2(self):
+        """Testa N2 com pouco histórico ou quando N2 costuma resolver"""
+        self.assertEqual(self._route([self._similar_task(False)]).level, EscalationLevel.N2_LOCAL_MEMORIA)
+        decision = self._route([self._similar_task(True) for _ in range(10)])
+        self.assertEqual(decision.level, EscalationLevel.N2_LOCAL_MEMORIA)
+        self.assertEqual(decision.estimated_savings_seconds, 0.0)
+
+class TestEndpointPool(unittest.TestCase):
+    """Testes do balanceamento entre réplicas de um papel"""
+
+    @staticmethod
+    def _pool(clients, **kwargs):
+        return EndpointPool("analista", list(clients), lambda url: clients[url], **kwargs)
+
+    def test_prefers_less_loaded_replica_and_fails_over(self):
+        """Testa escolha da réplica com menos carga e failover com ejeção em erro de conexão"""
+        import httpx
+        from openai import APIConnectionError
+
+        clients = {"http://a/v1": MagicMock(), "http://b/v1": MagicMock()}
+        pool = self._pool(clients)
+        pool.endpoints[0].outstanding = 3
+        pool.create(model="m", messages=[])
+        clients["http://b/v1"].chat.completions.create.assert_called_once()
+
+        clients["http://b/v1"].chat.completions.create.side_effect = APIConnectionError(
+            request=httpx.Request("POST", "http://b/v1")
+        )
+        pool.endpoints[0].outstanding = 0
+        pool.endpoints[0].latency_ewma = 5.0
+        pool.create(model="m", messages=[])
+        self.assertEqual(clients["http://a/v1"].chat.completions.create.call_count, 1)
+        self.assertTrue(pool.get_stats()[1]["ejected"])
+
+    def test_slow_replica_is_ejected(self):
+        """Testa ejeção da réplica cuja latência EWMA passa do fator sobre a mediana"""
+        pool = self._pool({"http://a/v1": MagicMock(), "http://b/v1": MagicMock()},
+                          min_latency_samples=2)
+        fast, slow = pool.endpoints
+        for _ in range(2):
+            fast.outstanding += 1
+            pool._release(fast, 0.5)
+        for _ in range(2):
+            slow.outstanding += 1
+            pool._release(slow, 4.0)
+
+        stats = pool.get_stats()
+        self.assertFalse(stats[0]["ejected"])
+        self.assertTrue(stats[1]["ejected"])
+
+    def test_affinity_pins_task_to_one_replica(self):
+        """Testa que a mesma chave vai sempre para a mesma réplica, mesmo com mais carga"""
+        urls = [f"http://r{i}/v1" for i in range(4)]
+        pool = self._pool({url: MagicMock() for url in urls})
+        served = set()
+        for load in range(5):
+            for endpoint in pool.endpoints:
+                endpoint.outstanding = 0
+            pool.endpoints[load % 4].outstanding = 10
+            with pool.affinity("task-42"):
+                pool.create(model="m", messages=[])
+            served.add(pool.served_by())
+        self.assertEqual(len(served), 1)
+
+    def test_stream_holds_replica_until_consumed(self):
+        """Testa que o stream só devolve a réplica (e mede a latência) ao terminar ou fechar"""
+        client = MagicMock()
+        client.chat.completions.create.return_value = iter(["a", "b"])
+        pool = self._pool({"http://a/v1": client})
+        endpoint = pool.endpoints[0]
+
+        stream = pool.create(model="m", messages=[], stream=True)
+        self.assertEqual(endpoint.outstanding, 1)
+        self.assertEqual(list(stream), ["a", "b"])
+        self.assertEqual(endpoint.outstanding, 0)
+        self.assertEqual(endpoint.samples, 1)
+
+        client.chat.completions.create.return_value = iter(["a", "b"])
+        stream = pool.create(model="m", messages=[], stream=True)
+        stream.close()
+        self.assertEqual(endpoint.outstanding, 0)
+        self.assertEqual(endpoint.samples, 1)
+
+class TestLLMMetrics(unittest.TestCase):
+    """Testes das métricas por chamada de LLM"""
+
+    def test_level_2_records_tokens_and_server_timings(self):
+        """Testa tokens, prefill/decode do llama.cpp e réplica na chamada do gerente"""
+        manager = _make_fallback_manager()
+        manager.llm_clients["gerente"] = MagicMock()
+        manager.llm_clients["gerente"].chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='{"descricao": "listar", "comando": "ls"}'))],
+            usage=SimpleNamespace(prompt_tokens=120, completion_tokens=15),
+            timings={"prompt_ms": 80.0, "predicted_ms": 300.0}
+        )
+
+        result = manager._execute_level_2("task", "listar arquivos")
+        self.assertTrue(result.success)
+        metrics = result.llm_calls[0]
+        self.assertEqual((metrics.prompt_tokens, metrics.completion_tokens), (120, 15))
+        self.assertAlmostEqual(metrics.decode_seconds, 0.3)
+        self.assertEqual(metrics.endpoint, manager.config.llama.urls["gerente"])
+        self.assertFalse(metrics.cache_hit)
+        self.assertEqual(manager.get_llm_metrics()["gerente"]["prompt_tokens"], 120)
+
+    def test_stream_marks_first_token_and_final_usage(self):
+        """Testa TTFT no primeiro conteúdo e uso de tokens no chunk final do stream"""
+        chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None))]),
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="[{"))]),
+            SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=40, completion_tokens=9))
+        ]
+        finished = []
+        metrics = LLMCallMetrics(role="programador", streaming=True)
+        stream = MeteredStream(chunks, metrics, time.perf_counter(), chat_chunk_content, finished.append)
+
+        self.assertEqual(len(list(stream)), 3)
+        self.assertIsNotNone(metrics.ttft_seconds)
+        self.assertEqual(metrics.completion_tokens, 9)
+        stream.close()
+        self.assertEqual(finished, [metrics])
+
+class TestDeadline(unittest.TestCase):
+    """Testes do prazo de ponta a ponta das tarefas"""
+
+    def test_level_that_does_not_fit_is_skipped(self):
+        """Testa que N3 (lento no histórico) é pulado e N4 atende dentro do prazo"""
+        manager = _make_fallback_manager()
+        manager._level_latencies[EscalationLevel.N3_EQUIPE_LOCAL].extend([60.0] * 5)
+        manager._execute_level_2 = MagicMock(return_value=FallbackResult(
+            False, EscalationLevel.N2_LOCAL_MEMORIA, None, "erro", 0.1))
+        manager._execute_level_3 = MagicMock()
+        manager._execute_level_4 = MagicMock(return_value=FallbackResult(
+            True, EscalationLevel.N4_SUPERVISOR_ONLINE, [{"comando": "ls"}], None, 0.1))
+
+        deadline = Deadline(10.0)
+        result = manager.execute_fallback_chain("task", "tarefa", deadline=deadline)
+        self.assertEqual(result.level, EscalationLevel.N4_SUPERVISOR_ONLINE)
+        manager._execute_level_3.assert_not_called()
+        manager._execute_level_4.assert_called_once_with("task", "tarefa", deadline, None)
+        self.assertLessEqual(role_timeout(manager.config.llama, "analista", deadline).read, 10.0)
+
+    def test_expired_deadline_fails_fast(self):
+        """Testa que prazo esgotado encerra a cadeia sem chamar nenhum nível"""
+        manager = _make_fallback_manager()
+        manager._execute_level_2 = MagicMock()
+
+        result = manager.execute_fallback_chain("task", "tarefa", deadline=Deadline(0.0))
+        self.assertEqual(result.level, EscalationLevel.DESISTIR)
+        self.assertIn("Prazo", result.error)
+        manager._execute_level_2.assert_not_called()
+
+    @patch('memory_manager.QdrantClient')
+    @patch('memory_manager.genai')
+    def test_level_fails_when_history_does_not_fit(self, mock_genai, mock_qdrant):
+        """Testa que sem tempo para ler o histórico o nível falha em vez de replanejar do zero"""
+        mock_genai.embed_content.return_value = {'embedding': [0.1, 0.2, 0.3]}
+        config = FrameworkConfig()
+        config.genai.api_key = "test_key"
+        manager = _make_fallback_manager(config, MemoryManager(config))
+        manager.llm_clients["gerente"] = MagicMock()
+
+        result = manager._execute_level_2("task", "tarefa", Deadline(0.8))
+        self.assertFalse(result.success)
+        self.assertIn("Prazo", result.error)
+        manager.llm_clients["gerente"].chat.completions.create.assert_not_called()
+
+    def test_outcome_is_stored_after_deadline(self):
+        """Testa que o desfecho de uma tarefa que estourou o prazo é gravado com timeout próprio"""
+        config = FrameworkConfig()
+        config.persistence_timeout_seconds = 7.0
+        with patch.object(GenAIMiniFramework, "_initialize_components"):
+            framework = GenAIMiniFramework(config)
+        framework.initialized = True
+        framework.memory_manager = MagicMock()
+        framework.level_router = MagicMock()
+        framework.level_router.route.side_effect = RuntimeError("qdrant fora do ar")
+        framework._run_task = MagicMock(return_value=TaskResult(
+            "task", False, 3, EscalationLevel.N3_EQUIPE_LOCAL, 5.0, error="Prazo da tarefa esgotado"))
+
+        result = framework.run_task("tarefa", deadline=Deadline(0.0))
+        self.assertEqual(result.routing["start_level"], "N2_LOCAL_MEMORIA")
+        self.assertEqual(framework._run_task.call_args.args[2], EscalationLevel.N2_LOCAL_MEMORIA)
+        self.assertEqual(framework.memory_manager.store_task_outcome.call_args.kwargs["timeout"], 7.0)
+
+    def test_whole_seconds_never_exceeds_remaining_time(self):
+        """Testa segundos inteiros arredondados para baixo e chamada pulada abaixo de 1s"""
+        self.assertIsNone(whole_seconds(None))
+        self.assertEqual(whole_seconds(2.9), 2)
+        self.assertEqual(whole_seconds(1.0), 1)
+        with self.assertRaises(DeadlineExceeded):
+            whole_seconds(0.4)
+
+class _WordEmbedding:
+    """Embedding determinístico (bag of words) no lugar do modelo HuggingFace"""
+    dimension = 32
+
+    def to_embeddings(self, data, **kwargs):
+        vector = np.zeros(self.dimension, dtype="float32")
+        for word in str(data).lower().split():
+            vector[zlib.crc32(word.encode()) % self.dimension] += 1.0
+        return vector
+
+class TestCacheNamespace(unittest.TestCase):
+    """Testes do namespace GPTCache real (SQLite + FAISS) de um papel"""
+
+    def setUp(self):
+        # Sem limpeza: o GPTCache grava o índice no atexit
+        self.temp_dir = tempfile.mkdtemp()
+        config = FrameworkConfig()
+        config.enable_cache = False
+        config.cache.data_dir = self.temp_dir
+        self.manager = CacheManager(config)
+        self.manager._embedding = _WordEmbedding()
+        self.manager._initialized = True
+
+    def test_second_lookup_hits_semantic_cache(self):
+        """Testa put/get no store criado pelo gerenciador"""
+        namespace = self.manager.get_namespace("gerente", "modelo")
+        self.assertIsNone(namespace.get("listar arquivos do projeto"))
+
+        namespace.put("listar arquivos do projeto", '{"comando": "ls"}')
+        self.assertEqual(namespace.get("listar arquivos do projeto"), '{"comando": "ls"}')
+        self.assertIsNone(namespace.get("reiniciar o servidor web"))
+
+        # Chave exata diferente: a resposta vem do cache semântico
+        namespace.store("k1", "contar linhas", "wc -l")
+        self.assertEqual(namespace.lookup_with_level("k2", "contar linhas"), ("wc -l", "semantic"))
+        self.assertEqual(namespace.lookup_with_level("k2", "contar linhas"), ("wc -l", "l1"))
+
+    def test_ticket_commits_the_request_response(self):
+        """Testa que a resposta do LLM carrega a chave exata usada no commit do ticket"""
+        client = MagicMock()
+        client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="ls"))]
+        )
+        cached_client = self.manager.wrap_openai_client(client, "gerente", "modelo")
+        request = {"model": "modelo", "messages": [{"role": "user", "content": "listar"}]}
+
+        response = cached_client.chat.completions.create(**request)
+        ticket = CacheTicket("gerente", "modelo", "ls", exact_key=response.exact_key)
+        self.assertTrue(self.manager.commit_response(ticket))
+
+        cached = cached_client.chat.completions.create(**request)
+        self.assertEqual((cached.cache_level, cached.exact_key), ("l1", response.exact_key))
+        client.chat.completions.create.assert_called_once()
+
+    def test_compact_and_clear_remove_store_entries(self):
+        """Testa que compactar não duplica entradas e que limpar esvazia o store"""
+        namespace = self.manager.get_namespace("analista", "modelo")
+        store = namespace.cache.data_manager.s
+        namespace.store("k1", "listar arquivos", "ls")
+        namespace.store("k2", "contar linhas", "wc -l")
+        namespace.reject("k1", "ls")
+
+        namespace.compact()
+        self.assertEqual(store.count(), 1)
+        self.assertIsNone(namespace.get("listar arquivos"))
+        self.assertEqual(namespace.get("contar linhas"), "wc -l")
+
+        namespace.compact()
+        self.assertEqual(store.count(), 1)
+
+        namespace.clear()
+        self.assertEqual(store.count(), 0)
+        self.assertIsNone(namespace.get("contar linhas"))
+
+    def test_background_maintenance_expires_idle_entries(self):
+        """Testa que a manutenção periódica aplica o TTL sem novas gravações"""
+        namespace = self.manager.get_namespace("gerente", "modelo")
+        namespace.store("k1", "contar linhas", "wc -l", ttl_seconds=0.05)
+
+        self.manager._start_maintenance(0.02)
+        time.sleep(0.3)
+        self.manager.close()
+
+        self.assertEqual(namespace.index.count(), 0)
+        self.assertIsNone(namespace.l1.get("k1"))
+
+class TestSharedDataDir(unittest.TestCase):
+    """Testes de workers que compartilham o mesmo data_dir (modo compartilhado)"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def _worker(self):
+        config = FrameworkConfig()
+        config.enable_cache = False
+        config.cache.data_dir = self.temp_dir
+        config.cache.shared_mode = True
+        config.cache.shared_write_batch_size = 2
+        config.cache.index_write_batch_size = 2
+        manager = CacheManager(config)
+        manager._embedding = _WordEmbedding()
+        manager._initialized = True
+        return manager.get_namespace("programador", "modelo")
+
+    def test_workers_see_each_other_writes(self):
+        """Testa WAL, tier L1 em disco e acessos em lote entre conexões distintas"""
+        worker_a, worker_b = self._worker(), self._worker()
+        worker_a.store("k1", "contar linhas", "wc -l")
+
+        mode = sqlite3.connect(worker_a.db_path).execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+        self.assertEqual(worker_b.index.count(), 1)
+        self.assertEqual(worker_b.lookup_with_level("k1", "contar linhas"), ("wc -l", "l1"))
+
+        # Segundo acesso completa o lote e o commit fica visível ao outro worker
+        hits = "SELECT hits FROM cache_entries"
+        worker_b.lookup_with_level("k1", "contar linhas")
+        self.assertEqual(worker_a.index._db.execute(hits).fetchone()[0], 2)
+
+    def test_compaction_does_not_remap_other_workers_vectors(self):
+        """Testa que reject + compact de um worker não faz outro servir resposta alheia"""
+        worker_a, worker_b = self._worker(), self._worker()
+        worker_b.store("k1", "reiniciar servidor web", "systemctl restart nginx")
+        worker_a.store("k2", "contar linhas", "wc -l")
+
+        worker_a.reject("k1", "systemctl restart nginx")
+        worker_a.compact()
+        worker_a.store("k3", "listar processos", "ps aux")
+        self.assertEqual(worker_b.lookup_with_level("k9", "reiniciar servidor web"), (None, None))
+
+        # Ids nunca reusados; um worker novo carrega os vetores de todos
+        ids = [row[0] for row in sqlite3.connect(worker_a.db_path).execute(
+            "SELECT id FROM gptcache_question ORDER BY id")]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(len(ids), 3)
+        worker_c = self._worker()
+        self.assertEqual(worker_c.lookup_with_level("k8", "contar linhas"), ("wc -l", "semantic"))
+        self.assertEqual(worker_c.lookup_with_level("k7", "listar processos"), ("ps aux", "semantic"))
+
+    def test_other_process_writes_are_visible(self):
+        """Testa gravações de outro processo no tier L1 em disco e no cache de falhas"""
+        worker = self._worker()
+        negative_path = os.path.join(self.temp_dir, "negative.db")
+        negative = NegativeCache(negative_path, fingerprint="env", shared=True)
+        script = (
+            "import sys\n"
+            "from exact_cache import ExactMatchCache\n"
+            "from negative_cache import NegativeCache\n"
+            "ExactMatchCache(disk_path=sys.argv[1], shared=True).put('k2', 'ls -la')\n"
+            "NegativeCache(sys.argv[2], fingerprint='env', shared=True).record_failure('make', 'erro')\n"
+        )
+        subprocess.run(
+            [sys.executable, "-c", script, worker.l1.disk_path, negative_path],
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        )
+
+        self.assertEqual(worker.l1.get("k2"), "ls -la")
+        self.assertEqual(negative.lookup("make")["error"], "erro")
+
+class TestPlanParser(unittest.TestCase):
+    """Testes da leitura incremental de planos JSON"""
+
+    plan = [
+        {"descricao": "Listar [tmp]", "comando": "ls /tmp | grep '}'"},
+        {"descricao": "Concluir", "comando": None}
+    ]
+
+    def test_steps_are_emitted_as_soon_as_they_close(self):
+        """Testa emissão passo a passo, inclusive dentro de {"plan": [...]} e cercas markdown"""
+        for text in (json.dumps(self.plan),
+                     "```json\n" + json.dumps({"plan": self.plan}) + "\n```"):
+            parser = IncrementalPlanParser()
+            first_step = json.dumps(self.plan[0])
+            first_closed = text.index(first_step) + len(first_step)
+            self.assertEqual(parser.feed(text[:first_closed]), [self.plan[0]])
+            self.assertEqual(parser.feed(text[first_closed:]), [self.plan[1]])
+            self.assertEqual(parser.finish(), [])
+
+    def test_extract_plan_repairs_recoverable_output(self):
+        """Testa cercas, texto em volta, vírgulas finais, aspas simples e truncamento"""
+        step = {"descricao": "Listar", "comando": "ls"}
+        outputs = [
+            "```json\n" + json.dumps([step]) + "\n```",
+            "Plano: " + json.dumps({"plan": [step]})[:-2] + ",]} fim",
+            "[{'descricao': 'Listar', 'comando': 'ls'}]",
+            '[{"description": "Listar", "command": "ls"}]',
+            json.dumps([step, {"descricao": "Contar", "comando": "wc -l"}])[:-10]
+        ]
+        for output in outputs:
+            self.assertEqual(extract_plan(output), [step])
+
+            # Em streaming (padrão para programador e supervisor) os mesmos reparos valem
+            chunks = [output[i:i + 5] for i in range(0, len(output), 5)]
+            plan = StreamingPlan(iter(chunks)).start()
+            streamed = []
+            while plan:
+                streamed.append(plan.pop(0))
+            self.assertEqual(streamed, [step], output)
+            self.assertIsNone(plan.error)
+
+        # Passo único truncado: o comando pode estar cortado, não há reparo seguro
+        with self.assertRaises(ValueError):
+            extract_plan('{"descricao": "Remover", "comando": "rm -rf /tmp/fo')
+
+    def test_streaming_plan_behaves_like_step_queue(self):
+        """Testa o StreamingPlan como fila de passos e o callback de conclusão"""
+        completed = []
+        text = json.dumps(self.plan)
+        plan = StreamingPlan(iter([text[:10], text[10:]]), on_complete=completed.append).start()
+
+        self.assertTrue(plan)
+        self.assertEqual(plan.pop(0), self.plan[0])
+        self.assertEqual(plan.pop(0), self.plan[1])
+        self.assertFalse(plan)
+        self.assertEqual(completed, [text])
+
+class TestCacheBenchmark(unittest.TestCase):
+    """Testes do replay de calibração do cache"""
+
+    def test_load_replay_log_accepts_plain_prompts(self):
+        """Testa que linhas com 'prompt' viram requisições de chat"""
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write(json.dumps({"prompt": "listar arquivos", "response": "{}", "success": True}) + "\n\n")
+
+        records = load_replay_log(f.name)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["request"]["messages"][0]["content"], "listar arquivos")
+
+    def test_recommend_respects_false_hit_limit(self):
+        """Testa que a recomendação descarta thresholds com muitos acertos falsos"""
+        loose = BenchmarkResult("m", 0.85, requests=10, hits=8, hit_rate=0.8, false_hit_rate=0.25)
+        strict = BenchmarkResult("m", 0.97, requests=10, hits=4, hit_rate=0.4, false_hit_rate=0.0)
+
+        self.assertEqual(recommend([loose, strict], 0.01).threshold, 0.97)
+        self.assertIsNone(recommend([loose], 0.01))
+
+    def test_other_tasks_plan_is_a_false_hit(self):
+        """Testa que servir o plano (bem-sucedido) de outra tarefa conta como acerto falso"""
+        class _LooseNamespace:
+            """Namespace que serve a primeira resposta para qualquer prompt"""
+            name = "bench"
+            canonicalize = True
+            answer = None
+
+            def lookup(self, exact_key, prompt):
+                return self.answer
+
+            def store(self, exact_key, prompt, answer):
+                self.answer = self.answer or answer
+
+        def record(prompt, response, success=True):
+            return {"request": {"messages": [{"role": "user", "content": prompt}]},
+                    "response": response, "success": success}
+
+        records = [
+            record("listar arquivos", '{"comando": "ls"}'),
+            record("listar arquivos", '{"comando": "ls"}'),
+            record("espaço em disco", '{"comando": "df -h"}'),
+        ]
+        with tempfile.TemporaryDirectory() as data_dir:
+            result = CacheBenchmark(FrameworkConfig(), records)._replay(
+                _LooseNamespace(), "m", 0.5, data_dir
+            )
+
+        self.assertEqual(result.hits, 2)
+        self.assertEqual(result.false_hits, 1)
+        self.assertEqual(result.false_hit_rate, 0.5)
+
+class TestPlanCache(unittest.TestCase):
+    """Testes do cache de planos (nível N1)"""
+
+    def test_normalize_task_description(self):
+        """Testa normalização da descrição da tarefa"""
+        self.assertEqual(
+            normalize_task_description("  Listar   arquivos\n .py. "),
+            normalize_task_description("listar arquivos .py")
+        )
+
+    @patch('plan_cache.get_environment_fingerprint', return_value="env123")
+    def test_lookup_and_store(self, mock_fingerprint):
+        """Testa consulta por ambiente e armazenamento só de descrição/comando"""
+        memory_manager = MagicMock()
+        memory_manager.search_plan.return_value = {
+            "id": "p1", "score": 0.99, "steps": [{"descricao": "listar", "comando": "ls"}]
+        }
+        plan_cache = PlanCache(FrameworkConfig(), memory_manager)
+
+        plan = plan_cache.lookup("Listar arquivos")
+        self.assertEqual(plan["id"], "p1")
+        memory_manager.search_plan.assert_called_with(
+            "listar arquivos", "env123",
+            score_threshold=FrameworkConfig().cache.plan_similarity_threshold,
+            timeout=None
+        )
+
+        plan_cache.store("Listar arquivos", [{"descricao": "listar", "comando": "ls", "extra": 1}])
+        stored_steps = memory_manager.store_plan.call_args[0][3]
+        self.assertEqual(stored_steps, [{"descricao": "listar", "comando": "ls"}])
+
 class TestFrameworkIntegration(unittest.TestCase):
     """Testes de integração completa"""
 
@@ -0,0 +1,113 @@
+"""
+Threshold Tuner - Ajuste Online do Threshold de Similaridade por Papel
+Acompanha, para cada papel, quantos acertos semânticos levaram a sucesso e
+move o threshold dentro de limites, com histerese, para maximizar acertos seguros
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Any, Optional
+
+from framework_config import CacheConfig
+
+class RoleThresholdState:
+    """Janela de desfechos dos acertos semânticos de um papel"""
+
+    def __init__(self, threshold: float, window: int):
+        self.threshold = threshold
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.since_adjustment = 0
+        self.adjustments = 0
+
+    @property
+    def false_hit_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "samples": len(self.outcomes),
+            "false_hit_rate": self.false_hit_rate,
+            "adjustments": self.adjustments
+        }
+
+class ThresholdTuner:
+    """Controlador por papel: sobe o threshold com acertos falsos, desce quando seguro"""
+
+    def __init__(self, cache_config: CacheConfig, apply: Callable[[str, float], None]):
+        self.cache_config = cache_config
+        self.apply = apply
+        self.logger = logging.getLogger(__name__)
+        self.roles: Dict[str, RoleThresholdState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, role: str) -> RoleThresholdState:
+        if role not in self.roles:
+            self.roles[role] = RoleThresholdState(
+                self.cache_config.threshold_for(role), self.cache_config.autotune_window
+            )
+        return self.roles[role]
+
+    def record(self, role: str, success: bool):
+        """Registra o desfecho de uma resposta servida pelo cache semântico"""
+        if not self.cache_config.threshold_autotune:
+            return
+
+        with self._lock:
+            state = self._state(role)
+            state.outcomes.append(success)
+            state.since_adjustment += 1
+            new_threshold = self._next_threshold(state)
+
+            if new_threshold is None:
+                return
+            old_threshold = state.threshold
+            state.threshold = new_threshold
+            state.adjustments += 1
+            # Nova janela: desfechos antigos foram medidos com outro threshold
+            state.outcomes.clear()
+            state.since_adjustment = 0
+
+        self.logger.info(
+            f"Threshold do papel {role}: {old_threshold:.3f} -> {new_threshold:.3f}"
+        )
+        self.apply(role, new_threshold)
+
+    def _next_threshold(self, state: RoleThresholdState) -> Optional[float]:
+        """Novo threshold, ou None dentro da banda morta / sem amostras suficientes"""
+        config = self.cache_config
+        if state.since_adjustment < config.autotune_min_samples:
+            return None
+
+        false_hit_rate = state.false_hit_rate
+        if false_hit_rate > config.autotune_false_hit_high:
+            target = min(state.threshold + config.autotune_step, config.autotune_max_threshold)
+        elif false_hit_rate < config.autotune_false_hit_low:
+            target = max(state.threshold - config.autotune_step, config.autotune_min_threshold)
+        else:
+            return None
+
+        return round(target, 4) if abs(target - state.threshold) > 1e-9 else None
+
+    def restore(self, thresholds: Dict[str, float]):
+        """Reaplica thresholds ajustados em execuções anteriores"""
+        if not self.cache_config.threshold_autotune:
+            return
+
+        config = self.cache_config
+        for role, threshold in thresholds.items():
+            threshold = min(max(threshold, config.autotune_min_threshold), config.autotune_max_threshold)
+            with self._lock:
+                self._state(role).threshold = threshold
+            self.apply(role, threshold)
+
+    def thresholds(self) -> Dict[str, float]:
+        with self._lock:
+            return {role: state.threshold for role, state in self.roles.items()}
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {role: state.to_dict() for role, state in self.roles.items()}